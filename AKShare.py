@@ -1,21 +1,31 @@
-import akshare as ak
+import logging
 from pytz import timezone
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple, Iterator
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta, date
+import threading
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 
 from vnpy.trader.object import HistoryRequest, BarData
 from vnpy.trader.constant import Exchange, Interval
 
 from utils import log
+from ratelimit import TokenBucket
+from kline_cache import KlineCache, KLINE_COLUMNS
+from sources import SourceScheduler
+from universe import UniverseSnapshot
+from listing import ListingIndex
+from barsink import BarFrame
+from metrics import metrics, ROW_BUCKETS, PHASE_NETWORK, PHASE_SLEEP, PHASE_CONVERT
+from httppool import SessionPool
 
 CHINA_TZ = timezone("Asia/Shanghai")
 
 #akshare_token: str = ""
 
-MAX_QUERY_SIZE: int = 5000
 TS_DATE_FORMATE: str = '%Y%m%d'
 MAX_QUERY_TIMES: int = 500
 
@@ -28,6 +38,37 @@ EXCHANGE_TS2VT: Dict[str, Exchange] = {
 
 EXCHANGE_VT2TS: Dict[Exchange, str] = {v: k for k, v in EXCHANGE_TS2VT.items()}
 
+# 单次K线请求超时(秒)；股票列表、交易日历、行情快照等全市场接口数据量大，单独设置超时
+KLINE_TIMEOUT: float = 30.0
+BULK_TIMEOUT: float = 120.0
+
+# 未指定下载线程数时对冲线程池的大小，enable_hedge按线程数×数据源数设置
+HEDGE_WORKERS: int = 16
+
+# 各数据源单次K线请求最多返回的行数，None为不限(akshare内部已分页)；运行中发现截断时按实际返回行数收紧
+SOURCE_ROW_LIMITS: Dict[str, Optional[int]] = {
+    "东方财富": None,
+    "新浪": None,
+    "腾讯": None,
+}
+
+# 发布探测中两个数据源的同日K线视为一致时成交量的相对误差上限(各源成交量单位换算与取整不同)
+PROBE_VOLUME_TOLERANCE: float = 0.001
+
+# 沪市首个交易日，查询起点不晚于此日时首个非空窗口的首根K线即为上市后首个交易日
+MARKET_START_DATE: date = date(1990, 12, 19)
+
+# 判断窗口被截断的阈值：窗口开头缺失的交易日数与返回的行数下限，低于阈值按停牌处理
+TRUNCATION_MIN_GAP: int = 60
+TRUNCATION_MIN_ROWS: int = 500
+
+# 各数据源K线请求限流参数(每秒请求数, 突发容量)，所有线程共享同一个令牌桶
+SOURCE_RATE_LIMITS: Dict[str, Tuple[float, float]] = {
+    "东方财富": (5.0, 5.0),
+    "新浪": (3.0, 3.0),
+    "腾讯": (5.0, 5.0),
+}
+
 
 def get_stock_type(stock_code):
     """判断股票ID对应的证券市场
@@ -52,6 +93,16 @@ def get_stock_type(stock_code):
         return "sh"
     return "sz"
 
+def _same_bar(a: pd.Series, b: pd.Series) -> bool:
+    """
+    两个数据源的同日标准化K线是否一致：开高低收相同(按分取整)，成交量相对误差不超过PROBE_VOLUME_TOLERANCE
+    """
+    for column in ('open', 'high', 'low', 'close'):
+        if round(float(a[column]), 2) != round(float(b[column]), 2):
+            return False
+    volume_a, volume_b = float(a['volumn']), float(b['volumn'])
+    return abs(volume_a - volume_b) <= PROBE_VOLUME_TOLERANCE * max(volume_a, volume_b)
+
 def to_vnpy_codes(symbol: str):
     exchange = EXCHANGE_TS2VT[get_stock_type(symbol)]
     return symbol, exchange
@@ -66,7 +117,8 @@ class AKShareClient:
     def __init__(self):
         """"""
 
-        self.pro: object = None
+        # akshare模块，首次请求数据时才导入(导入耗时较长)
+        self._pro: object = None
 
         self.inited: bool = False
 
@@ -76,14 +128,132 @@ class AKShareClient:
         # 获得交易日历
         self.trade_cal: Dict[str, pd.DataFrame] = None
 
+        # 完整交易日历(含今天及之后的交易日)，datetime64[D]升序
+        self.trade_days: np.ndarray = None
+
         # 东财失败熔断：网络异常后跳过该源，按探测间隔尝试恢复
         self.em_blocked: bool = False
         self.em_fail_at: float = 0.0
         self.em_probe_interval: float = 1800.0
 
+        # 多线程共享同一个Client时保护东财熔断状态
+        self.lock: threading.Lock = threading.Lock()
+
+        # 按数据源限流，取代每个查询窗口后固定sleep
+        self.limiters: Dict[str, TokenBucket] = {
+            source_name: TokenBucket(rate, capacity)
+            for source_name, (rate, capacity) in SOURCE_RATE_LIMITS.items()
+        }
+
+        # 本地K线缓存，默认关闭
+        self.cache: Optional[KlineCache] = None
+
+        # 按滚动耗时与失败率调度数据源；hedge开启时主源超时未返回即并发请求下一源
+        self.scheduler: SourceScheduler = SourceScheduler()
+        self.hedge: bool = False
+        self.hedge_workers: int = HEDGE_WORKERS
+        self.hedge_executor: Optional[ThreadPoolExecutor] = None
+
+        # akshare调用超时(秒)，超时的调用被放弃并按数据源失败处理，0或None表示不限时
+        self.timeout: Optional[float] = KLINE_TIMEOUT
+        self.bulk_timeout: Optional[float] = BULK_TIMEOUT
+        self.timeouts: int = 0
+
+        # 股票列表与交易日历的本地快照，默认关闭；快照过期时在后台线程刷新
+        self.universe: Optional[UniverseSnapshot] = None
+        self.universe_thread: Optional[threading.Thread] = None
+
+        # 个股上市日期索引，默认关闭；各数据源单次请求行数上限
+        self.listing: Optional[ListingIndex] = None
+        self.row_limits: Dict[str, Optional[int]] = dict(SOURCE_ROW_LIMITS)
+
+        # akshare请求共享的keep-alive连接池，默认关闭
+        self.session_pool: Optional[SessionPool] = None
+
+    @property
+    def pro(self):
+        """"""
+        if self._pro is None:
+            import akshare
+            self._pro = akshare
+            if self.session_pool is not None:
+                self.session_pool.install()
+        return self._pro
+
+    @pro.setter
+    def pro(self, value):
+        """"""
+        self._pro = value
+
+    def enable_session_pool(self, pool_size: int):
+        """
+        启用HTTP连接池，akshare的请求复用keep-alive连接，不再每次请求都重新TCP/TLS握手
+        :param pool_size: 每个主机保持的连接数，应不小于并发下载线程数
+        """
+        self.session_pool = SessionPool(pool_size)
+        # akshare已导入时立即替换，否则在首次导入akshare时替换
+        if self._pro is not None:
+            self.session_pool.install()
+
+    def enable_hedge(self, workers: int):
+        """
+        开启对冲请求，对冲线程池同时执行主源与对冲请求
+        :param workers: 并发下载线程数，线程池按每个下载线程同时请求全部数据源确定大小，请求不在池中排队，
+                        否则总并发被线程池限制，排队的主源请求还会超过对冲延迟而误触发对冲
+        """
+        self.hedge = True
+        self.hedge_workers = max(workers, 1) * len(SOURCE_RATE_LIMITS)
+        with self.lock:
+            if self.hedge_executor is not None:
+                self.hedge_executor.shutdown(wait=False)
+                self.hedge_executor = None
+
+    def session_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        各主机的请求数、新建连接数与复用连接的请求数，未启用连接池时为空
+        """
+        if self.session_pool is None:
+            return {}
+        return self.session_pool.stats()
+
+    def enable_universe_snapshot(self, path: str, ttl: float):
+        """
+        启用股票列表与交易日历快照，init时优先读取快照
+        :param path: 快照文件
+        :param ttl: 快照有效期(秒)
+        """
+        self.universe = UniverseSnapshot(path, ttl)
+
+    def _load_universe(self) -> bool:
+        """
+        从快照初始化股票列表与交易日历，快照超过有效期时启动后台线程刷新，本次运行仍使用快照
+        :return: 是否成功从快照初始化
+        """
+        snapshot = self.universe.load()
+        if snapshot is None:
+            return False
+        self.symbols, list_trade, age = snapshot
+        self._set_trade_calendar(list_trade)
+        log.info("股票列表与交易日历来源：本地快照(已保存{:.1f}小时，{}只股票)".format(age / 3600, len(self.symbols)))
+        if age > self.universe.ttl:
+            # 非守护线程：运行很快结束时也等刷新完成再退出，保证下次启动拿到新快照
+            self.universe_thread = threading.Thread(target=self._refresh_universe, name="universe-refresh")
+            self.universe_thread.start()
+        return True
+
+    def _refresh_universe(self):
+        """
+        重新查询股票列表与交易日历并写入快照，只影响下次启动，不替换本次运行中使用的数据
+        """
+        try:
+            self.universe.save(self._fetch_symbols(), self._fetch_trade_calendar())
+            log.info("股票列表与交易日历快照已在后台刷新")
+        except Exception as ex:
+            log.war("股票列表与交易日历快照刷新失败：{}".format(repr(ex)))
+
     def init(self, retry: int = 3, retry_interval: int = 10) -> bool:
         """
-        初始化数据源(股票列表+交易日历)
+        初始化数据源(股票列表+交易日历)，启用快照时优先读取快照
         :param retry: 失败重试次数
         :param retry_interval: 重试基础间隔(秒), 每次递增
         :return: 是否初始化成功
@@ -91,11 +261,19 @@ class AKShareClient:
         if self.inited:
             return True
 
+        if self.universe is not None and self._load_universe():
+            self.inited = True
+            return True
+
         for attempt in range(1, retry + 1):
             try:
-                self.pro = ak
                 self.stock_list()
-                self.trade_day_list()
+                list_trade = self.trade_day_list()
+                if self.universe is not None and list_trade is not None:
+                    try:
+                        self.universe.save(self.symbols, list_trade)
+                    except OSError as ex:
+                        log.war("股票列表与交易日历快照写入失败：{}".format(repr(ex)))
                 self.inited = True
                 return True
             except (BaseException) as ex:
@@ -107,13 +285,160 @@ class AKShareClient:
 
         return False
 
+    def reference_data(self) -> Dict:
+        """
+        导出已初始化的股票列表和交易日历，供子进程中新建的Client直接使用，无需重复请求
+        """
+        return {"symbols": self.symbols, "trade_cal": self.trade_cal, "trade_days": self.trade_days}
+
+    def load_reference_data(self, data: Dict):
+        """
+        载入reference_data导出的股票列表和交易日历并标记为已初始化
+        """
+        self.symbols = data["symbols"]
+        self.trade_cal = data["trade_cal"]
+        self.trade_days = data["trade_days"]
+        self.inited = True
+
+    def _call_with_timeout(self, timeout: Optional[float], func, *args, **kwargs):
+        """
+        在守护线程中执行akshare调用并限时等待
+        超时后放弃该调用(线程无法强制终止，其结果被丢弃，随进程退出)，抛出TimeoutError
+        TimeoutError属于OSError，调用方按网络异常处理并切换下一数据源
+        :param timeout: 超时秒数，0或None时直接在当前线程调用
+        """
+        if not timeout:
+            return func(*args, **kwargs)
+
+        outcome: List = []
+
+        def target():
+            try:
+                outcome.append((True, func(*args, **kwargs)))
+            except BaseException as ex:
+                outcome.append((False, ex))
+
+        thread = threading.Thread(target=target, name="akshare-call", daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if not outcome:
+            with self.lock:
+                self.timeouts += 1
+            metrics.inc("akshare_timeouts_total", call=getattr(func, "__name__", str(func)))
+            raise TimeoutError("{}超过{:g}秒未返回".format(getattr(func, "__name__", func), timeout))
+
+        ok, value = outcome[0]
+        if not ok:
+            raise value
+        return value
+
+    def enable_listing_index(self, path: str):
+        """
+        启用上市日期索引，历史数据查询从上市日期开始
+        :param path: 索引文件
+        """
+        self.listing = ListingIndex(path)
+
+    def _fetch_listing_dates(self) -> Dict[str, date]:
+        """
+        从沪深交易所股票列表批量查询上市日期，单个列表失败时跳过，其余照常使用
+        """
+        queries = [
+            ("上交所主板", self.pro.stock_info_sh_name_code, {"symbol": "主板A股"}, '证券代码', '上市日期'),
+            ("上交所科创板", self.pro.stock_info_sh_name_code, {"symbol": "科创板"}, '证券代码', '上市日期'),
+            ("深交所", self.pro.stock_info_sz_name_code, {"symbol": "A股列表"}, 'A股代码', 'A股上市日期'),
+        ]
+        dates: Dict[str, date] = {}
+        for name, func, kwargs, code_column, date_column in queries:
+            try:
+                df = self._call_with_timeout(self.bulk_timeout, func, **kwargs)
+            except Exception as ex:
+                log.war("{}上市日期查询失败：{}".format(name, repr(ex)))
+                continue
+            listed = pd.to_datetime(df[date_column], errors="coerce")
+            valid = listed.notna()
+            dates.update(zip(df.loc[valid, code_column].astype(str).str.zfill(6), listed[valid].dt.date))
+        return dates
+
+    def refresh_listing_dates(self, symbols: List[str]):
+        """
+        索引中有未收录的股票时批量查询上市日期，每个刷新间隔内最多查询一次
+        """
+        if self.listing is None or not self.listing.needs_refresh(symbols):
+            return
+        dates = self._fetch_listing_dates()
+        if dates:
+            added = self.listing.update(dates)
+            log.info("上市日期索引新收录{}只股票，共{}只".format(added, len(self.listing.dates)))
+
+    def _window_end(self, start: date, end: date) -> date:
+        """
+        按数据源行数上限确定查询窗口结束日：上限为N行时取start起第N个交易日，各源均不限时一次查询到end
+        多个数据源有上限时取最小值，保证切换数据源后窗口仍不会被截断
+        """
+        with self.lock:
+            limits = [limit for limit in self.row_limits.values() if limit]
+        if not limits or self.trade_days is None:
+            return end
+        index = int(np.searchsorted(self.trade_days, np.datetime64(start, 'D'))) + min(limits) - 1
+        if index >= len(self.trade_days):
+            return end
+        return min(end, self.trade_days[index].astype(date))
+
+    def _is_front_truncated(self, source_name: str, rows: int, start: date, first_day: date) -> bool:
+        """
+        判断窗口是否被数据源截断(只返回了最近的若干行)：已知上市日期时窗口开头仍大段缺失且返回行数较多
+        确认截断后把该源的行数上限收紧为本次返回的行数，后续窗口按新上限切分
+        """
+        if rows < TRUNCATION_MIN_ROWS or self.trade_days is None:
+            return False
+        missing = int(np.searchsorted(self.trade_days, np.datetime64(first_day, 'D'))
+                      - np.searchsorted(self.trade_days, np.datetime64(start, 'D')))
+        if missing < TRUNCATION_MIN_GAP:
+            return False
+        with self.lock:
+            limit = self.row_limits.get(source_name)
+            if limit is None or rows < limit:
+                self.row_limits[source_name] = rows
+                log.war("{}单次K线请求疑似最多返回{}行，之后按该上限切分查询窗口".format(source_name, rows))
+        return True
+
+    def enable_cache(self, path: str, **kwargs):
+        """
+        启用本地K线缓存，命中缓存的查询窗口不请求网络也不消耗限流令牌
+        :param path: 缓存目录
+        :param kwargs: 传给KlineCache的淘汰参数(max_bytes/max_age)
+        """
+        self.cache = KlineCache(path, **kwargs)
+
+    def _cacheable_end(self) -> Optional[date]:
+        """
+        可缓存窗口的最晚结束日：最近一个交易日(含今天)的前一天，此前的K线不再变化；未启用缓存时返回None
+        最近交易日当天可能尚未收盘或数据源尚未发布，视为易变数据不缓存
+        """
+        if self.cache is None or self.trade_days is None:
+            return None
+        today = np.datetime64(date.today(), 'D')
+        index = np.searchsorted(self.trade_days, today, side='right')
+        if index == 0:
+            return None
+        return (self.trade_days[index - 1] - np.timedelta64(1, 'D')).astype(date)
+
+    def _is_cacheable(self, end: str) -> bool:
+        """
+        查询窗口是否可以缓存：结束日期不晚于_cacheable_end
+        """
+        cacheable_end = self._cacheable_end()
+        return cacheable_end is not None and datetime.strptime(end, TS_DATE_FORMATE).date() <= cacheable_end
+
     def _fetch_kline_em(self, symbol: str, start: str, end: str) -> Optional[pd.DataFrame]:
         """
         东方财富日K线(不复权，与实时行情一致)，成交量单位为手，此处统一归一化为股
         :param symbol: 不带交易所前缀的6位股票代码
         :return: 标准化df(含trade_date/open/high/low/close/volumn/turnover)，失败抛出异常
         """
-        df = self.pro.stock_zh_a_hist(symbol=symbol, period="daily", start_date=start, end_date=end, adjust="")
+        df = self._call_with_timeout(self.timeout, self.pro.stock_zh_a_hist, symbol=symbol, period="daily",
+                                     start_date=start, end_date=end, adjust="")
         df['成交量'] = df['成交量'] * 100
         return df.rename(columns={'日期': 'trade_date', '开盘': 'open', '最高': 'high',
                                   '最低': 'low', '收盘': 'close', '成交量': 'volumn', '成交额': 'turnover'})
@@ -124,7 +449,8 @@ class AKShareClient:
         :param symbol: 带交易所前缀的代码(如sz000001)
         :return: 标准化df(含trade_date/open/high/low/close/volumn/turnover)，失败抛出异常
         """
-        df = self.pro.stock_zh_a_daily(symbol=symbol, start_date=start, end_date=end, adjust="")
+        df = self._call_with_timeout(self.timeout, self.pro.stock_zh_a_daily, symbol=symbol,
+                                     start_date=start, end_date=end, adjust="")
         # 新浪返回同时含amount(成交额)与turnover(换手率)，必须先选列再重命名，否则产生重复列名
         df = df[['date', 'open', 'high', 'low', 'close', 'volume', 'amount']]
         return df.rename(columns={'date': 'trade_date', 'volume': 'volumn', 'amount': 'turnover'})
@@ -135,44 +461,204 @@ class AKShareClient:
         :param symbol: 带交易所前缀的代码(如sz000001)
         :return: 标准化df(含trade_date/open/high/low/close/volumn/turnover)，失败抛出异常
         """
-        df = self.pro.stock_zh_a_hist_tx(symbol=symbol, start_date=start, end_date=end, adjust="")
+        df = self._call_with_timeout(self.timeout, self.pro.stock_zh_a_hist_tx, symbol=symbol,
+                                     start_date=start, end_date=end, adjust="")
         if symbol.startswith("sz000"):
             df['volume'] = df['volume'] * 100
         # 腾讯返回同时含volume(成交量)与turnover(换手率)，必须先选列再重命名，否则产生重复列名
         df = df[['date', 'open', 'high', 'low', 'close', 'volume', 'amount']]
         return df.rename(columns={'date': 'trade_date', 'volume': 'volumn', 'amount': 'turnover'})
 
-    def _fetch_kline(self, symbol: str, prefixed_symbol: str, start: str, end: str) -> Optional[pd.DataFrame]:
+    def fetch_adjust_factors(self, symbol: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
         """
-        按优先级(东方财富→新浪→腾讯)获取日K线并返回标准化df
-        东财网络异常后被熔断跳过，仅按探测间隔尝试一次；某源异常时记录警告并尝试下一源，全部失败返回None
+        查询个股后复权因子表(新浪)，只含除权除息引起因子变化的日期，数据量很小
         :param symbol: 不带交易所前缀的6位股票代码
-        :param prefixed_symbol: 带交易所前缀的代码(如sz000001)
+        :return: (生效日期datetime64[D]升序, 后复权因子)，网络异常或超时返回None；新浪无因子数据时返回空表
+        """
+        self._acquire("新浪")
+        try:
+            with metrics.phase(PHASE_NETWORK):
+                df = self._call_with_timeout(self.timeout, self.pro.stock_zh_a_daily,
+                                             symbol=get_stock_type(symbol) + symbol, adjust="hfq-factor")
+        except ValueError as ex:
+            # akshare在因子表为空(上市以来无除权除息)时抛出ValueError
+            log.sample("无后复权因子", "{}无后复权因子：{}".format(symbol, repr(ex)))
+            return np.array([], dtype='datetime64[D]'), np.array([], dtype=float)
+        except Exception as ex:
+            log.sample("后复权因子查询失败", "{}后复权因子查询失败：{}".format(symbol, repr(ex)), logging.WARNING)
+            return None
+
+        df = pd.DataFrame({
+            'day': pd.to_datetime(df['date']).values.astype('datetime64[D]'),
+            'factor': df['hfq_factor'].astype(float).to_numpy(),
+        }).drop_duplicates('day', keep='last').sort_values('day')
+        return df['day'].to_numpy(), df['factor'].to_numpy()
+
+    def _em_available(self) -> bool:
+        """
+        判断本次请求是否可以使用东方财富
+        熔断期间到达探测间隔时只放行一个请求去探测，其余线程继续跳过东财
+        """
+        with self.lock:
+            if not self.em_blocked:
+                return True
+            if time.time() - self.em_fail_at >= self.em_probe_interval:
+                self.em_fail_at = time.time()
+                return True
+            return False
+
+    def _em_succeeded(self):
+        """"""
+        with self.lock:
+            if self.em_blocked:
+                log.info("东方财富接口已恢复，恢复使用东方财富数据源")
+                metrics.inc("akshare_circuit_transitions_total", source="东方财富", state="closed")
+                metrics.set("akshare_circuit_open", 0, source="东方财富")
+            self.em_blocked = False
+
+    def _em_failed(self, message: str):
+        """"""
+        with self.lock:
+            if not self.em_blocked:
+                log.war(message)
+                metrics.inc("akshare_circuit_transitions_total", source="东方财富", state="open")
+                metrics.set("akshare_circuit_open", 1, source="东方财富")
+            self.em_blocked = True
+            self.em_fail_at = time.time()
+
+    def _acquire(self, source_name: str):
+        """
+        取数据源限流令牌，等待时间计入限流等待统计
+        """
+        waited = self.limiters[source_name].acquire()
+        if waited:
+            metrics.inc("akshare_ratelimit_wait_seconds_total", waited, source=source_name)
+            metrics.inc("sync_phase_seconds_total", waited, phase=PHASE_SLEEP)
+
+    def _record_request(self, source_name: str, latency: float, ok: bool):
+        """
+        记录一次数据源请求：供调度排序，并计入请求耗时直方图与网络耗时
+        """
+        self.scheduler.record(source_name, latency, ok)
+        metrics.observe("akshare_request_seconds", latency, source=source_name, result="ok" if ok else "error")
+        metrics.inc("sync_phase_seconds_total", latency, phase=PHASE_NETWORK)
+
+    def _request_kline(self, source_name: str, fetch_func, sym: str, symbol: str,
+                       start: str, end: str) -> pd.DataFrame:
+        """
+        向单个数据源请求日K线，记录耗时与成败供调度使用，失败时抛出异常
+        """
+        self._acquire(source_name)
+        begin = time.monotonic()
+        try:
+            kline_df = fetch_func(sym, start, end)
+        except OSError as ex:
+            self._record_request(source_name, time.monotonic() - begin, False)
+            log.sample(source_name + "日K线网络异常", "{}获取{}日K线网络异常，尝试下一数据源：{}".format(
+                source_name, symbol, repr(ex)), logging.WARNING)
+            if source_name == "东方财富":
+                self._em_failed("东方财富接口异常，后续K线查询直接使用新浪，定期探测恢复")
+            raise
+        except Exception as ex:
+            self._record_request(source_name, time.monotonic() - begin, False)
+            log.sample(source_name + "日K线获取失败", "{}获取{}日K线失败，尝试下一数据源：{}".format(
+                source_name, symbol, repr(ex)), logging.WARNING)
+            raise
+
+        self._record_request(source_name, time.monotonic() - begin, True)
+        metrics.observe("akshare_request_rows", len(kline_df), ROW_BUCKETS, source=source_name)
+        if source_name == "东方财富":
+            self._em_succeeded()
+        return kline_df
+
+    def _fetch_kline_hedged(self, sources: List[Tuple], symbol: str, start: str,
+                            end: str) -> Tuple[Optional[str], Optional[pd.DataFrame]]:
+        """
+        对冲请求：当前数据源超过其耗时高分位数仍未返回时，同时请求下一数据源，取最先成功的结果
+        某源失败时立即请求下一数据源；样本不足的数据源不设时限，行为与顺序请求一致
+        :return: (数据源名称, 标准化df)，全部失败返回(None, None)
+        """
+        if self.hedge_executor is None:
+            with self.lock:
+                if self.hedge_executor is None:
+                    self.hedge_executor = ThreadPoolExecutor(max_workers=self.hedge_workers,
+                                                              thread_name_prefix="hedge")
+
+        remaining = list(sources)
+        pending: Dict[Future, str] = {}
+
+        def launch() -> str:
+            source_name, fetch_func, sym = remaining.pop(0)
+            future = self.hedge_executor.submit(self._request_kline, source_name, fetch_func, sym,
+                                                symbol, start, end)
+            pending[future] = source_name
+            return source_name
+
+        last_source = launch()
+        while pending:
+            delay = self.scheduler.hedge_delay(last_source) if remaining else None
+            done, _ = wait(list(pending), timeout=delay, return_when=FIRST_COMPLETED)
+            if not done:
+                log.sample("对冲请求", "{}获取{}日K线超过{:.2f}秒未返回，对冲请求{}".format(
+                    last_source, symbol, delay, remaining[0][0]))
+                last_source = launch()
+                continue
+
+            for future in done:
+                source_name = pending.pop(future)
+                if future.exception() is None:
+                    return source_name, future.result()
+            if not pending and remaining:
+                last_source = launch()
+        return None, None
+
+    def _kline_sources(self, symbol: str, prefixed_symbol: str) -> List[Tuple]:
+        """
+        按调度顺序排列的(数据源名称, 查询函数, 代码)，东财熔断期间按探测间隔尝试一次，避免反复请求被封接口
         """
         sources = [("新浪", self._fetch_kline_sina, prefixed_symbol),
                    ("腾讯", self._fetch_kline_tx, prefixed_symbol)]
-        # 东财熔断期间按探测间隔尝试一次，避免反复请求被封接口
-        if not self.em_blocked or time.time() - self.em_fail_at >= self.em_probe_interval:
+        if self._em_available():
             sources.insert(0, ("东方财富", self._fetch_kline_em, symbol))
+        return self.scheduler.order(sources)
 
-        for source_name, fetch_func, sym in sources:
-            try:
-                kline_df = fetch_func(sym, start, end)
-                if source_name == "东方财富" and self.em_blocked:
-                    log.info("东方财富接口已恢复，恢复使用东方财富数据源")
-                    self.em_blocked = False
-                log.info(symbol + " 日K线来源：" + source_name)
-                return kline_df
-            except OSError as ex:
-                log.war("{}获取{}日K线网络异常，尝试下一数据源：{}".format(source_name, symbol, repr(ex)))
-                if source_name == "东方财富":
-                    if not self.em_blocked:
-                        log.war("东方财富接口异常，后续K线查询直接使用新浪，定期探测恢复")
-                    self.em_blocked = True
-                    self.em_fail_at = time.time()
-            except Exception as ex:
-                log.war("{}获取{}日K线失败，尝试下一数据源：{}".format(source_name, symbol, repr(ex)))
-        return None
+    def _fetch_kline(self, symbol: str, prefixed_symbol: str, start: str,
+                     end: str) -> Tuple[Optional[str], Optional[pd.DataFrame]]:
+        """
+        按期望代价(滚动耗时/成功率)排序的数据源获取日K线并返回标准化df，无统计时按东方财富→新浪→腾讯
+        东财网络异常后被熔断跳过，仅按探测间隔尝试一次；某源异常时记录警告并尝试下一源，全部失败返回None
+        每次请求前从对应数据源的令牌桶取令牌，多线程下整体请求速率不超过各源限额
+        :param symbol: 不带交易所前缀的6位股票代码
+        :param prefixed_symbol: 带交易所前缀的代码(如sz000001)
+        :return: (数据源名称, 标准化df)，全部失败时df为None
+        """
+        sources = self._kline_sources(symbol, prefixed_symbol)
+
+        cacheable = self._is_cacheable(end)
+        if cacheable:
+            # 各源数据已标准化，任一源的缓存均可直接使用
+            source_name, kline_df = self.cache.get(list(SOURCE_RATE_LIMITS), symbol, start, end)
+            if kline_df is not None:
+                log.sample("日K线来源：本地缓存", symbol + " 日K线来源：本地缓存(" + source_name + ")")
+                return source_name, kline_df
+
+        source_name, kline_df = None, None
+        if self.hedge:
+            source_name, kline_df = self._fetch_kline_hedged(sources, symbol, start, end)
+        else:
+            for source_name, fetch_func, sym in sources:
+                try:
+                    kline_df = self._request_kline(source_name, fetch_func, sym, symbol, start, end)
+                    break
+                except Exception:
+                    continue
+
+        if kline_df is None:
+            return None, None
+        log.sample("日K线来源：" + source_name, symbol + " 日K线来源：" + source_name)
+        if cacheable:
+            self.cache.put(source_name, symbol, start, end, kline_df)
+        return source_name, kline_df
 
     def query_history(self, req: HistoryRequest) -> Optional[List[BarData]]:
         """
@@ -180,147 +666,354 @@ class AKShareClient:
         :param req:查询请求
         :return: Optional[List[BarData]]
         """
-        if self.symbols is None:
+        df = self.query_history_df(req)
+        if df is None:
             return None
+        return self.df_to_bars(df, req.symbol, req.exchange, req.interval)
+
+    def iter_history(self, req: HistoryRequest) -> Iterator[Optional[List[BarData]]]:
+        """
+        逐窗口查询历史数据，每个窗口返回后立即转换为BarData产出，调用方可边查边存
+        某窗口各数据源均失败时产出None并结束，之前产出的窗口不受影响
+        :param req:查询请求
+        :return: 逐窗口产出List[BarData]，失败时最后产出None
+        """
+        for df in self.iter_history_df(req):
+            if df is None:
+                yield None
+                return
+            yield self.df_to_bars(df, req.symbol, req.exchange, req.interval)
+
+    def query_history_df(self, req: HistoryRequest) -> Optional[pd.DataFrame]:
+        """
+        从akshare里查询历史数据，返回未转换为BarData的标准化df，供流水线分阶段转换
+        :param req:查询请求
+        :return: 标准化df，无数据时为空df，查询失败或请求不支持时返回None
+        """
+        frames: List[pd.DataFrame] = []
+        for df in self.iter_history_df(req):
+            if df is None:
+                return None
+            frames.append(df)
+
+        if not frames:
+            return pd.DataFrame(columns=KLINE_COLUMNS)
+        df = pd.concat(frames, ignore_index=True)
+        # 各源日期列类型不同(字符串或date)，统一按字符串排序去重
+        trade_date = df['trade_date'].astype(str)
+        order = trade_date.drop_duplicates().sort_values().index
+        return df.loc[order].reset_index(drop=True)
+
+    def iter_history_df(self, req: HistoryRequest) -> Iterator[Optional[pd.DataFrame]]:
+        """
+        逐窗口查询历史数据，按到达顺序产出各窗口的标准化df(空窗口不产出)
+        窗口开头被截断时补查的前段在后续产出，各窗口日期不重叠
+        :param req:查询请求
+        :return: 逐窗口产出标准化df，某窗口各数据源均失败或请求不支持时产出None并结束
+        """
+        if self.symbols is None:
+            yield None
+            return
 
         symbol = req.symbol
         exchange = req.exchange
         interval = req.interval
-        start = req.start.strftime(TS_DATE_FORMATE)
-        end = req.end.strftime(TS_DATE_FORMATE)
 
         if interval is not Interval.DAILY:
-            return None
+            yield None
+            return
         if exchange not in [Exchange.SSE, Exchange.SZSE]:
-            return None
+            yield None
+            return
 
         # 东财K线用裸代码，新浪K线需带交易所前缀
         prefixed_symbol = get_stock_type(symbol) + symbol
 
-        # tscode = to_ts_symbol(symbol, exchange)
-
-        # 修改查询数据逻辑，在每次5000条数据的限制下，很可能一次无法读取完
-        cnt = 0
-        df: pd.DataFrame = None
-        while datetime.strptime(start, TS_DATE_FORMATE) <= datetime.strptime(end, TS_DATE_FORMATE):
-            # 保证每次查询最多5000天数据
-            start_date = datetime.strptime(start, TS_DATE_FORMATE)
-            simulate_end_date = min(datetime.strptime(end, TS_DATE_FORMATE),
-                                    start_date + timedelta(days=MAX_QUERY_SIZE))
-            simulate_end = simulate_end_date.strftime(TS_DATE_FORMATE)
-
-            akshare_df = None
-            query_retry_cnt = 0
-            while True:
-                akshare_df = self._fetch_kline(symbol, prefixed_symbol, start, simulate_end)
-                if akshare_df is not None:
-                    break
-                query_retry_cnt += 1
-                if query_retry_cnt > 10:
-                    log.error(symbol + " 各数据源连续重试失败，跳过该股票")
-                    return None
-                log.info("获取" + symbol + "失败，15秒后重试")
-                time.sleep(15.0)
-
-            if akshare_df is not None and not akshare_df.empty:
-                if df is None:
-                    df = akshare_df
-                else:
-                    df = pd.concat([df, akshare_df], ignore_index=True)
-            # end_time = time.time()
-            # delta = round(end_time - begin_time, 3)
-            # if delta < 60 / MAX_QUERY_TIMES:
-
-            sleep_time = 0.10
-            log.info("sleep：" + str(sleep_time) + "s")
-            time.sleep(sleep_time)
-
-            cnt += 1
-            start = (simulate_end_date + timedelta(days=1)).strftime(TS_DATE_FORMATE)
-
-        data: List[BarData] = []
-
-        
-        if df is not None:
-            for ix, row in df.iterrows():
-                date = datetime.strptime(str(row.trade_date), '%Y-%m-%d')
-                date = CHINA_TZ.localize(date)
-
-                if pd.isnull(row['open']):
-                    log.info(symbol + '.' + EXCHANGE_VT2TS[exchange] + row['trade_date'] + "open_price为None")
-                elif pd.isnull(row['high']):
-                    log.info(symbol + '.' + EXCHANGE_VT2TS[exchange] + row['trade_date'] + "high_price为None")
-                elif pd.isnull(row['low']):
-                    log.info(symbol + '.' + EXCHANGE_VT2TS[exchange] + row['trade_date'] + "low_price为None")
-                elif pd.isnull(row['close']):
-                    log.info(symbol + '.' + EXCHANGE_VT2TS[exchange] + row['trade_date'] + "close_price为None")
-                elif pd.isnull(row['volumn']):
-                    log.info(symbol + '.' + EXCHANGE_VT2TS[exchange] + row['trade_date'] + "volume为None")
-
-                row.fillna(0)
-                bar = BarData(
-                    symbol=symbol,
-                    exchange=exchange,
-                    interval=interval,
-                    datetime=date,
-                    open_price=row['open'],
-                    high_price=row['high'],
-                    low_price=row['low'],
-                    close_price=row['close'],
-                    volume=row['volumn'],
-                    turnover=row['turnover'],
-                    gateway_name='akshare'
-                )
-
-                data.append(bar)
-        return data
+        # 上市日期之前没有数据，直接从上市日期开始查询；未收录时从首个非空窗口学习
+        start_day = req.start.date()
+        end_day = req.end.date()
+        listing_date = self.listing.get(symbol) if self.listing is not None else None
+        if listing_date is not None and listing_date > start_day:
+            start_day = listing_date
+        learn_listing = self.listing is not None and listing_date is None and start_day <= MARKET_START_DATE
 
-    def stock_list(self):
+        # 按数据源行数上限切分窗口；窗口开头被截断时把未覆盖的部分重新放回待查询区间
+        fetched = False
+        ranges: List[Tuple[date, date]] = [(start_day, end_day)]
+        # 启用缓存时历史部分可缓存：已缓存时与最近交易日起的易变尾部分开查询(按栈顺序先查历史部分，读缓存)；
+        # 未缓存时仍整段一次请求，返回后把历史部分写入缓存，冷缓存时请求次数与不启用缓存相同
+        prefix_end: Optional[date] = None
+        cacheable_end = self._cacheable_end()
+        if cacheable_end is not None and start_day <= cacheable_end < end_day:
+            if self.cache.contains(list(SOURCE_RATE_LIMITS), symbol, start_day.strftime(TS_DATE_FORMATE),
+                                   cacheable_end.strftime(TS_DATE_FORMATE)):
+                ranges = [(cacheable_end + timedelta(days=1), end_day), (start_day, cacheable_end)]
+            else:
+                prefix_end = cacheable_end
+        while ranges:
+            range_start, range_end = ranges.pop()
+            if range_start > range_end:
+                continue
+            window_end = self._window_end(range_start, range_end)
+            if window_end < range_end:
+                ranges.append((window_end + timedelta(days=1), range_end))
+            start = range_start.strftime(TS_DATE_FORMATE)
+            end = window_end.strftime(TS_DATE_FORMATE)
+
+            # 各数据源均失败时立即结束，由调用方放入延迟重试队列，不在此处原地等待
+            source_name, akshare_df = self._fetch_kline(symbol, prefixed_symbol, start, end)
+            if akshare_df is None:
+                log.war("{} {}~{}各数据源均获取失败".format(symbol, start, end))
+                yield None
+                return
+            if akshare_df.empty:
+                continue
+
+            trade_dates = pd.to_datetime(akshare_df['trade_date'].astype(str))
+            first_day = trade_dates.min().date()
+            truncated = False
+            if learn_listing and not fetched:
+                self.listing.learn(symbol, first_day)
+            elif (listing_date is not None or range_start > start_day) and \
+                    self._is_front_truncated(source_name, len(akshare_df), range_start, first_day):
+                ranges.append((range_start, first_day - timedelta(days=1)))
+                truncated = True
+            if prefix_end is not None and range_start == start_day and prefix_end < window_end and not truncated:
+                # 整段请求中的历史部分写入缓存，键与下次分开查询时的历史部分一致
+                self.cache.put(source_name, symbol, start, prefix_end.strftime(TS_DATE_FORMATE),
+                               akshare_df[(trade_dates.dt.date <= prefix_end).to_numpy()])
+            fetched = True
+            yield akshare_df
+
+    def df_to_frame(self, df: pd.DataFrame, symbol: str, exchange: Exchange, interval: Interval) -> BarFrame:
+        """
+        将标准化df按列解析为列式K线数据，供列式批量写入和BarData转换共用
+        日期整列解析并本地化时区，缺失值按列统计后汇总为一条日志(按间隔采样)，再统一填0
+        :param df: 标准化df(含trade_date/open/high/low/close/volumn/turnover)
+        :return: BarFrame
+        """
+        if df.empty:
+            return BarFrame(symbol, exchange, interval, pd.DatetimeIndex([], tz=CHINA_TZ), np.empty((0, 6)))
+        with metrics.phase(PHASE_CONVERT):
+            return self._parse_frame(df, symbol, exchange, interval)
+
+    def _parse_frame(self, df: pd.DataFrame, symbol: str, exchange: Exchange, interval: Interval) -> BarFrame:
+        """"""
+        dates = pd.DatetimeIndex(pd.to_datetime(df['trade_date'].astype(str), format='%Y-%m-%d'))
+
+        columns = ['open', 'high', 'low', 'close', 'volumn', 'turnover']
+        values = df[columns]
+        null_mask = values.isnull()
+        null_counts = null_mask.sum()
+        if null_counts.any():
+            null_rows = null_mask.any(axis=1).to_numpy()
+            null_dates = df['trade_date'].astype(str).to_numpy()[null_rows]
+            log.sample("K线空值", "{}.{} 共{}条K线存在空值({})，首个{} 末个{}，已填0".format(
+                symbol, EXCHANGE_VT2TS[exchange], int(null_rows.sum()),
+                ",".join("{}:{}".format(k, int(v)) for k, v in null_counts.items() if v),
+                null_dates[0], null_dates[-1]))
+
+        return BarFrame(symbol, exchange, interval, dates.tz_localize(CHINA_TZ),
+                        values.fillna(0).to_numpy(dtype=float))
+
+    def df_to_bars(self, df: pd.DataFrame, symbol: str, exchange: Exchange, interval: Interval) -> List[BarData]:
+        """
+        将标准化df按列向量化转换为BarData列表
+        :param df: 标准化df(含trade_date/open/high/low/close/volumn/turnover)
+        :return: List[BarData]
+        """
+        if df.empty:
+            return []
+
+        frame = self.df_to_frame(df, symbol, exchange, interval)
+        with metrics.phase(PHASE_CONVERT):
+            return frame.to_bars('akshare')
+
+    def _fetch_symbols(self) -> pd.DataFrame:
         """
         调用akshare获取沪深A股所有股票代码和名称
         优先东方财富(熔断期间跳过)，接口失败或被封禁时自动切换新浪
+        :return: 含symbol/name列的df
+        """
+        if not self.em_blocked:
+            try:
+                df = self._call_with_timeout(self.bulk_timeout, self.pro.stock_zh_a_spot_em)
+                symbols = df[['代码', '名称']].rename(columns={'代码': 'symbol', '名称': 'name'})
+                self._em_succeeded()
+                log.info("股票列表来源：东方财富")
+                return symbols
+            except Exception as ex:
+                self._em_failed("东方财富股票列表获取失败，切换新浪：{}".format(repr(ex)))
+        else:
+            log.war("东方财富接口处于熔断状态，股票列表直接使用新浪")
+
+        df = self._call_with_timeout(self.bulk_timeout, self.pro.stock_info_a_code_name)
+        # 过滤北交所(92开头)等非沪深A股，避免to_vnpy_codes误判交易所
+        df = df[df['code'].str.startswith(('00', '30', '60', '68'))]
+        log.info("股票列表来源：新浪")
+        return df[['code', 'name']].rename(columns={'code': 'symbol', 'name': 'name'})
+
+    def stock_list(self):
+        """
+        查询股票列表
         :return:
         """
         if self.symbols is None:
-            if not self.em_blocked:
-                try:
-                    df = self.pro.stock_zh_a_spot_em()
-                    self.symbols = df[['代码', '名称']].rename(
-                        columns={'代码': 'symbol', '名称': 'name'})
-                    self.em_blocked = False
-                    log.info("股票列表来源：东方财富")
-                    return
-                except Exception as ex:
-                    log.war("东方财富股票列表获取失败，切换新浪：{}".format(repr(ex)))
-                    self.em_blocked = True
-                    self.em_fail_at = time.time()
-            else:
-                log.war("东方财富接口处于熔断状态，股票列表直接使用新浪")
+            self.symbols = self._fetch_symbols()
 
-            df = self.pro.stock_info_a_code_name()
-            # 过滤北交所(92开头)等非沪深A股，避免to_vnpy_codes误判交易所
-            df = df[df['code'].str.startswith(('00', '30', '60', '68'))]
-            self.symbols = df[['code', 'name']].rename(
-                columns={'code': 'symbol', 'name': 'name'})
-            log.info("股票列表来源：新浪")
+    def _fetch_trade_calendar(self) -> pd.DataFrame:
+        """
+        调用akshare获取完整交易日历(含今天及之后的交易日)
+        """
+        return self._call_with_timeout(self.bulk_timeout, self.pro.tool_trade_date_hist_sina)
+
+    def _set_trade_calendar(self, list_trade: pd.DataFrame):
+        """
+        由完整交易日历生成trade_days与trade_cal
+        """
+        self.trade_days = np.sort(pd.to_datetime(list_trade['trade_date']).values.astype('datetime64[D]'))
+        # trade_cal只保留今天之前的交易日；今天不是交易日时也不会因找不到今天而初始化失败
+        list_trade = list_trade[list_trade['trade_date'] < date.today()].reset_index(drop=True)
+        self.trade_cal = {Exchange.SZSE.value: list_trade, Exchange.SSE.value: list_trade}
 
-    def trade_day_list(self):
+    def trade_day_list(self) -> Optional[pd.DataFrame]:
         """
         查询交易日历
-        :return:
+        :return: 本次查询到的完整交易日历，已初始化时返回None
         """
         if self.trade_cal is None:
-            self.trade_cal = dict()
-            list_trade = self.pro.tool_trade_date_hist_sina()
-            index = list_trade[list_trade['trade_date'] == date.today()]
-            list_trade = list_trade.iloc[:index.index[0]]
-            self.trade_cal[Exchange.SZSE.value] = self.trade_cal[Exchange.SSE.value] = list_trade
+            # 请求成功后再赋值trade_cal，超时或失败时init重试会重新查询
+            list_trade = self._fetch_trade_calendar()
+            self._set_trade_calendar(list_trade)
+            return list_trade
+        return None
+
+    def is_trade_day(self, day: date) -> bool:
+        """
+        判断是否为交易日
+        """
+        index = np.searchsorted(self.trade_days, np.datetime64(day, 'D'))
+        return bool(index < len(self.trade_days) and self.trade_days[index] == np.datetime64(day, 'D'))
+
+    def prev_trade_day(self, day: date) -> Optional[date]:
+        """
+        查询指定日期之前(不含当天)的最近一个交易日
+        """
+        index = np.searchsorted(self.trade_days, np.datetime64(day, 'D'))
+        if index == 0:
+            return None
+        return self.trade_days[index - 1].astype(date)
+
+    def next_trade_day(self, day: date) -> Optional[date]:
+        """
+        查询指定日期之后(不含当天)的最近一个交易日，超出交易日历范围时返回None
+        """
+        index = np.searchsorted(self.trade_days, np.datetime64(day, 'D'), side='right')
+        if index >= len(self.trade_days):
+            return None
+        return self.trade_days[index].astype(date)
+
+    def refresh_trade_calendar(self) -> bool:
+        """
+        重新查询完整交易日历，常驻运行时在交易日历用尽(跨年)前获取新的交易日
+        :return: 是否查询成功
+        """
+        try:
+            self._set_trade_calendar(self._fetch_trade_calendar())
+            return True
+        except Exception as ex:
+            log.war("交易日历查询失败：{}".format(repr(ex)))
+            return False
+
+    def probe_published(self, symbol: str, day: date) -> Optional[int]:
+        """
+        探测数据源是否已发布指定交易日的最终日K线：向各数据源查询一只股票一天的数据(不使用缓存)
+        东方财富盘中即返回当日实时K线，只有一个数据源有当日K线时不能确认已是最终数据，需多个数据源一致
+        :param symbol: 6位股票代码，应选择很少停牌的股票
+        :return: 与首个返回当日K线的数据源一致(开高低收相同、成交量在误差内)的数据源个数(含其自身)，
+                 0为尚未发布，各数据源均失败时为None
+        """
+        end = day.strftime(TS_DATE_FORMATE)
+        sources = self._kline_sources(symbol, get_stock_type(symbol) + symbol)
+        bars: List[pd.Series] = []
+        failed = 0
+        for source_name, fetch_func, sym in sources:
+            try:
+                df = self._request_kline(source_name, fetch_func, sym, symbol, end, end)
+            except Exception:
+                failed += 1
+                continue
+            rows = df[pd.to_datetime(df['trade_date'].astype(str)).dt.date == day]
+            if len(rows):
+                bars.append(rows.iloc[-1])
+        if failed == len(sources):
+            return None
+        if not bars:
+            return 0
+        return sum(1 for bar in bars if _same_bar(bars[0], bar))
+
+    def query_spot_bars(self, trade_date: date) -> Dict[str, BarData]:
+        """
+        从全市场实时行情快照构建当日日K线，一次请求覆盖全部A股
+        需在收盘且盘后交易结束后调用，此时快照即为当日最终日线；停牌(无开盘价或无成交)的股票不返回
+        优先东方财富(熔断期间跳过)，失败时切换新浪
+        :param trade_date: 快照对应的交易日
+        :return: {股票代码: BarData}，全部失败时返回空dict
+        """
+        df = None
+        if self._em_available():
+            try:
+                df = self._call_with_timeout(self.bulk_timeout, self.pro.stock_zh_a_spot_em)
+                self._em_succeeded()
+                # 东财成交量单位为手，统一归一化为股
+                df['成交量'] = df['成交量'] * 100
+                log.info("全市场行情快照来源：东方财富")
+            except Exception as ex:
+                self._em_failed("东方财富行情快照获取失败，切换新浪：{}".format(repr(ex)))
+                df = None
+        if df is None:
+            try:
+                df = self._call_with_timeout(self.bulk_timeout, self.pro.stock_zh_a_spot)
+                df['代码'] = df['代码'].str[-6:]
+                log.info("全市场行情快照来源：新浪")
+            except Exception as ex:
+                log.error("全市场行情快照获取失败：{}".format(repr(ex)))
+                return {}
+
+        df = df[['代码', '今开', '最高', '最低', '最新价', '成交量', '成交额']].rename(
+            columns={'代码': 'symbol', '今开': 'open', '最高': 'high', '最低': 'low',
+                     '最新价': 'close', '成交量': 'volumn', '成交额': 'turnover'})
+        df = df[df['symbol'].str.startswith(('00', '30', '60', '68'))]
+        df = df[(df['open'] > 0) & (df['volumn'] > 0)]
+        df = df.drop_duplicates('symbol')
+
+        dt = CHINA_TZ.localize(datetime.combine(trade_date, datetime.min.time()))
+        columns = ['open', 'high', 'low', 'close', 'volumn', 'turnover']
+        arrays = df[columns].fillna(0).to_numpy(dtype=float).T.tolist()
+
+        bars: Dict[str, BarData] = {}
+        for symbol, open_price, high_price, low_price, close_price, volume, turnover in zip(df['symbol'], *arrays):
+            _, exchange = to_vnpy_codes(symbol)
+            bars[symbol] = BarData(
+                symbol=symbol,
+                exchange=exchange,
+                interval=Interval.DAILY,
+                datetime=dt,
+                open_price=open_price,
+                high_price=high_price,
+                low_price=low_price,
+                close_price=close_price,
+                volume=volume,
+                turnover=turnover,
+                gateway_name='akshare'
+            )
+        return bars
     
     def stock_individual_info(self, symbol):
         """
         查询个股信息（包括上市时间）
         """
-        df = self.pro.stock_individual_info_em(symbol=symbol)
+        df = self._call_with_timeout(self.timeout, self.pro.stock_individual_info_em, symbol=symbol)
         list_day = df.loc[df['item']=='上市时间','value'].iloc[0]
         return str(list_day)
 
@@ -0,0 +1,160 @@
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 复权方式
+ADJUST_QFQ: str = "qfq"
+ADJUST_HFQ: str = "hfq"
+
+# 因子表：(生效日期datetime64[D]升序, 后复权因子)，因子自该日起生效直到下一条
+FactorTable = Tuple[np.ndarray, np.ndarray]
+
+
+def factors_at(table: FactorTable, days: np.ndarray) -> np.ndarray:
+    """
+    取每个交易日生效的后复权因子，早于因子表首条日期的交易日使用首条因子，因子表为空时全部为1
+    :param days: 交易日，datetime64[D]
+    """
+    factor_days, factors = table
+    if not factors.size:
+        return np.ones(len(days))
+    index = np.searchsorted(factor_days, days.astype("datetime64[D]"), side="right") - 1
+    return factors[np.maximum(index, 0)]
+
+
+def adjust_prices(values: np.ndarray, days: np.ndarray, table: FactorTable, mode: str) -> np.ndarray:
+    """
+    向量化计算复权价格，成交量与成交额不变
+    后复权 = 不复权价 × 当日后复权因子；前复权 = 不复权价 × 当日后复权因子 / 最新后复权因子
+    :param values: n×6数组，列依次为open/high/low/close/volume/turnover
+    :param days: 各行交易日，datetime64[D]
+    :param mode: ADJUST_QFQ或ADJUST_HFQ
+    :return: 复权后的n×6新数组
+    """
+    ratio = factors_at(table, days)
+    if mode == ADJUST_QFQ and table[1].size:
+        ratio = ratio / table[1][-1]
+    adjusted = values.astype(float, copy=True)
+    adjusted[:, :4] *= ratio[:, None]
+    return adjusted
+
+
+class AdjustFactorStore:
+    """
+    个股后复权因子的本地存储(SQLite)
+    每只股票按各自的检查周期重新查询因子表，只有因子表发生变化(除权除息)的股票才改写，K线数据无需重新下载
+    检查周期按股票代码crc32在[ttl/2, ttl)之间错开，首次全量查询后每天只有一部分股票到期
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: 因子数据库文件
+        """
+        self.path: str = path
+        self.lock: threading.Lock = threading.Lock()
+
+        self.conn: sqlite3.Connection = sqlite3.connect(path, timeout=60.0, check_same_thread=False,
+                                                        isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS factors ("
+            "symbol TEXT NOT NULL, "
+            "day TEXT NOT NULL, "
+            "hfq_factor REAL NOT NULL, "
+            "PRIMARY KEY (symbol, day))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS checks ("
+            "symbol TEXT PRIMARY KEY, "
+            "checked_at REAL NOT NULL, "
+            "changed_at REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS exports ("
+            "symbol TEXT NOT NULL, "
+            "mode TEXT NOT NULL, "
+            "exported_at REAL NOT NULL, "
+            "PRIMARY KEY (symbol, mode))"
+        )
+
+    def get(self, symbol: str) -> Optional[FactorTable]:
+        """
+        读取因子表，从未查询过的股票返回None
+        """
+        with self.lock:
+            checked = self.conn.execute("SELECT 1 FROM checks WHERE symbol=?", (symbol,)).fetchone()
+            rows = self.conn.execute(
+                "SELECT day, hfq_factor FROM factors WHERE symbol=? ORDER BY day", (symbol,)
+            ).fetchall()
+        if checked is None:
+            return None
+        return (np.array([row[0] for row in rows], dtype="datetime64[D]"),
+                np.array([row[1] for row in rows], dtype=float))
+
+    def due(self, symbols: List[str], ttl: float) -> List[str]:
+        """
+        需要重新查询因子表的股票：从未查询或距上次查询超过各自的检查周期
+        :param ttl: 检查周期上限(秒)
+        """
+        with self.lock:
+            checked: Dict[str, float] = dict(self.conn.execute("SELECT symbol, checked_at FROM checks").fetchall())
+        now = time.time()
+        return [
+            symbol for symbol in symbols
+            if now - checked.get(symbol, 0.0) >= ttl * (0.5 + (zlib.crc32(symbol.encode()) % 1000) / 2000)
+        ]
+
+    def update(self, symbol: str, table: FactorTable) -> bool:
+        """
+        写入查询到的因子表，与已有因子表相同时只更新检查时间
+        :return: 因子表是否变化
+        """
+        now = time.time()
+        rows = [(symbol, str(day), float(factor)) for day, factor in zip(*table)]
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            old = self.conn.execute(
+                "SELECT symbol, day, hfq_factor FROM factors WHERE symbol=? ORDER BY day", (symbol,)
+            ).fetchall()
+            checked = self.conn.execute("SELECT 1 FROM checks WHERE symbol=?", (symbol,)).fetchone()
+            changed = checked is None or old != sorted(rows)
+            if changed:
+                self.conn.execute("DELETE FROM factors WHERE symbol=?", (symbol,))
+                self.conn.executemany("INSERT INTO factors (symbol, day, hfq_factor) VALUES (?, ?, ?)", rows)
+            self.conn.execute(
+                "INSERT INTO checks (symbol, checked_at, changed_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (symbol) DO UPDATE SET checked_at=excluded.checked_at, "
+                "changed_at=CASE WHEN ? THEN excluded.changed_at ELSE changed_at END",
+                (symbol, now, now, changed)
+            )
+            self.conn.execute("COMMIT")
+        return changed
+
+    def changed_since_export(self, symbol: str, mode: str) -> bool:
+        """
+        因子表在该股票上次导出复权数据之后是否变化(从未导出也视为变化)
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT c.changed_at, e.exported_at FROM checks c "
+                "LEFT JOIN exports e ON e.symbol=c.symbol AND e.mode=? WHERE c.symbol=?",
+                (mode, symbol)
+            ).fetchone()
+        return row is None or row[1] is None or row[0] >= row[1]
+
+    def mark_exported(self, symbol: str, mode: str):
+        """"""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO exports (symbol, mode, exported_at) VALUES (?, ?, ?)",
+                (symbol, mode, time.time())
+            )
+
+    def close(self):
+        """"""
+        with self.lock:
+            self.conn.close()
@@ -1,11 +1,21 @@
+import cProfile
+import io
 import multiprocessing
+import pstats
 import os
+import queue
+import zlib
 import sys
+import threading
 import traceback
-from datetime import datetime, timedelta, time
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta, time, date
 from time import sleep
-from typing import List
+from typing import List, Callable, Dict, Tuple, Optional
 import argparse
+import contextlib
+import numpy as np
+import pandas as pd
 import pytz
 
 from tqdm import tqdm
@@ -14,34 +24,145 @@ from vnpy.trader.database import get_database, BarOverview
 from vnpy.trader.object import HistoryRequest, BarData
 
 from importlib import import_module
-from vnpy.trader.database import BaseDatabase, BarOverview
+from vnpy.trader.database import BaseDatabase, BarOverview, DB_TZ, convert_tz
 
-# database_manager: BaseDatabase = import_module("vnpy_mongodb").Database()
-
-database_manager: BaseDatabase = get_database()
+# 数据库在首次使用时才连接(get_database()内部缓存实例)，导入本模块和--help不产生数据库与网络开销
+# database: BaseDatabase = import_module("vnpy_mongodb").Database()
 
 from utils import log
 
 sys.path.append(os.getcwd())
 
-from AKShare import akshare_client, TS_DATE_FORMATE, to_vnpy_codes
+from AKShare import AKShareClient, akshare_client, TS_DATE_FORMATE, to_vnpy_codes, CHINA_TZ, SOURCE_RATE_LIMITS
+from journal import SyncJournal, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED
+from pipeline import SyncPipeline
+from retry import RetryQueue
+from ratelimit import SharedTokenBucket
+from workqueue import WorkQueue
+from barsink import BarSink, BarFrame, create_bar_sink
+from panel import DailyPanel
+from metrics import metrics, PHASE_SAVE, PHASE_SLEEP
+from adjust import AdjustFactorStore, adjust_prices, ADJUST_QFQ, ADJUST_HFQ
+
+# 进度日志的采样间隔(秒)，进度条仍逐只更新
+PROGRESS_LOG_INTERVAL: float = 10.0
 
 # 东方财富接口被封禁时无法查询个股上市时间，下载起始日期退化为固定早日期
 FALLBACK_START_DATE: str = '19900101'
 
+# 收盘及科创板/创业板盘后固定价格交易(15:05~15:30)结束后，行情快照即为当日最终日线
+SPOT_READY_TIME: time = time(15, 30)
+
+# 数据源在交易日15点~16点之间发布当日日线，16点之后才视为当日K线已可查询
+KLINE_PUBLISH_TIME: time = time(16, 0)
+
+# 定时更新：交易日盘后固定价格交易结束后开始探测数据源是否已发布当日日线
+PUBLISH_PROBE_START: time = SPOT_READY_TIME
+# 到该时间仍未探测到发布(探测股票停牌或数据源异常)时不再等待，直接更新，未发布的K线由下一交易日补齐
+PUBLISH_DEADLINE: time = time(20, 0)
+# 探测数据发布用的股票，选择很少停牌的平安银行
+PUBLISH_CANARY: str = "000001"
+# 发布时间前需要该数量的数据源返回一致的当日K线才视为已是最终数据，发布时间后有一个数据源返回即可
+PUBLISH_PROBE_SOURCES: int = 2
+# 发布探测间隔、更新失败后的重试间隔、等待下一交易日时单次休眠上限(秒，系统休眠或校时后及时重新计算)
+PUBLISH_PROBE_INTERVAL: float = 120.0
+AUTO_UPDATE_RETRY_INTERVAL: float = 1800.0
+AUTO_UPDATE_MAX_SLEEP: float = 600.0
+
+
+def to_china_date(dt: datetime):
+    """
+    将数据库中的时间转换为北京时间日期，无时区信息时按数据库时区处理
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=DB_TZ)
+    return dt.astimezone(CHINA_TZ).date()
+
+
+def find_gap_ranges(trade_days: np.ndarray, local_dates: np.ndarray) -> List[Tuple[date, date, int]]:
+    """
+    找出本地首根K线之后缺失的交易日，并把交易日历上连续的缺失日合并为区间
+    :param trade_days: 交易日历，datetime64[D]升序
+    :param local_dates: 本地已有K线日期，datetime64[D]
+    :return: [(缺口起始日, 缺口结束日, 缺失交易日数)]
+    """
+    if local_dates.size == 0:
+        return []
+    calendar = trade_days[trade_days >= local_dates.min()]
+    missing = np.flatnonzero(~np.isin(calendar, local_dates))
+    if missing.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(missing) != 1)
+    starts = missing[np.r_[0, breaks + 1]]
+    ends = missing[np.r_[breaks, missing.size - 1]]
+    return [(calendar[start].astype(date), calendar[end].astype(date), int(end - start + 1))
+            for start, end in zip(starts, ends)]
+
 
 class AShareDailyDataManager:
 
-    def __init__(self):
-        """"""
-        self.akshare_client = akshare_client
+    def __init__(self, client: Optional[AKShareClient] = None, database: Optional[BaseDatabase] = None):
+        """
+        :param client: 数据源Client，默认使用全局akshare_client
+        :param database: 数据库，默认在首次使用时取vnpy全局数据库；多进程下载时每个子进程各自新建
+        构造时不请求网络也不连接数据库，首次执行同步任务时再初始化
+        """
+        self.akshare_client: AKShareClient = client or akshare_client
+        self._database: Optional[BaseDatabase] = database
+        self.inited: bool = False
         self.symbols = None
         self.trade_cal = None
+        # 今天之前的交易日，按交易所区分，datetime64[D]升序
+        self.trade_day_index: Dict[str, np.ndarray] = {}
         self.bar_overviews: List[BarOverview] = None
-        self.init()
+        # 按(symbol, exchange, interval)索引的K线汇总，保存数据后在内存中同步更新
+        self.overview_index: Dict[Tuple[str, Exchange, Interval], BarOverview] = {}
+        # 多线程下载时数据库连接不保证线程安全，读写统一加锁
+        self.db_lock: threading.RLock = threading.RLock()
+        # 断点续传日志，默认关闭
+        self.journal: Optional[SyncJournal] = None
+        self.fresh: bool = False
+        self.run_id: Optional[int] = None
+        # 是否使用抓取→转换→写入流水线执行下载/更新
+        self.use_pipeline: bool = False
+        # 失败股票的延迟重试次数与首次重试基础延迟(秒)
+        self.retries: int = 3
+        self.retry_delay: float = 5.0
+        # 本进程内最近一次处理失败的股票及错误信息，重新开始处理或成功后移除
+        self.failures: Dict[str, str] = {}
+        self.failure_lock: threading.Lock = threading.Lock()
+        # 重试用尽仍失败的股票，多进程下载时由子进程汇总回主进程
+        self.permanent_failures: Dict[str, str] = {}
+        # 多进程下载的子进程中不显示进度条，每完成一只股票把进度描述发送到该队列由主进程统一显示
+        self.progress_queue = None
+        # 多主机分片(序号, 分片数)，只处理股票代码crc32取模等于序号的股票
+        self.shard: Optional[Tuple[int, int]] = None
+        # 是否以列式批量写入保存K线(不构造BarData)，数据库后端不支持时退回save_bar_data
+        self.bulk_write: bool = False
+        self.bar_sink: Optional[BarSink] = None
+        # 全市场日线面板目录，设置后下载/更新结束时增量导出
+        self.panel_path: Optional[str] = None
+        # 后复权因子存储与检查周期(秒)，设置后下载/更新结束时刷新到期股票的因子表
+        self.factor_store: Optional[AdjustFactorStore] = None
+        self.factor_ttl: float = 7 * 24 * 3600.0
+        # 同步结束后导出为独立vnpy数据集(代码加_qfq/_hfq后缀)的复权方式
+        self.adjusted_modes: List[str] = []
+        # 定时更新探测确认已发布日线的交易日，早于按发布时间推算的结果时生效
+        self.published_day: Optional[date] = None
 
-    def init(self):
+    @property
+    def database(self) -> BaseDatabase:
         """"""
+        if self._database is None:
+            self._database = get_database()
+        return self._database
+
+    def init(self):
+        """
+        初始化股票列表、交易日历和本地K线汇总，重复调用直接返回
+        """
+        if self.inited:
+            return
         if not self.akshare_client.init():
             raise RuntimeError(
                 "AKShare数据源初始化失败(股票列表获取失败)，请检查网络或东方财富接口是否被封禁，"
@@ -49,217 +170,1294 @@ class AShareDailyDataManager:
             )
         self.symbols = self.akshare_client.symbols
         self.trade_cal = self.akshare_client.trade_cal
-        self.bar_overviews = database_manager.get_bar_overview()
+        self.trade_day_index = {
+            exchange: np.sort(pd.to_datetime(trade_cal['trade_date']).values.astype('datetime64[D]'))
+            for exchange, trade_cal in self.trade_cal.items()
+        }
+        self.bar_overviews = self.database.get_bar_overview()
+        self.overview_index = {
+            (overview.symbol, overview.exchange, overview.interval): overview
+            for overview in self.bar_overviews
+        }
+        if self.bulk_write and self.bar_sink is None:
+            self.bar_sink = create_bar_sink(self.database)
+        # 无本地数据的股票需从上市日期开始下载，上市日期索引缺少这些股票时批量补充
+        self.akshare_client.refresh_listing_dates([
+            tscode for tscode in self._all_tscodes()
+            if (tscode, to_vnpy_codes(tscode)[1], Interval.DAILY) not in self.overview_index
+        ])
+        self.inited = True
+
+    def get_overview(self, symbol: str, exchange: Exchange, interval: Interval) -> Optional[BarOverview]:
+        """
+        查询本地K线汇总(起止时间为数据库时区的无时区时间)
+        """
+        return self.overview_index.get((symbol, exchange, interval))
+
+    def _update_overview(self, symbol: str, exchange: Exchange, interval: Interval,
+                         start: datetime, end: datetime, count: int):
+        """
+        保存K线后同步更新内存中的K线汇总，同一进程内后续处理无需重新查询数据库
+        :param start: 本次保存的第一根K线时间
+        :param end: 本次保存的最后一根K线时间
+        :param count: 本次保存的K线数量
+        """
+        start = convert_tz(start)
+        end = convert_tz(end)
+        key = (symbol, exchange, interval)
+        with self.db_lock:
+            overview = self.overview_index.get(key)
+            if overview is None:
+                overview = BarOverview(symbol=symbol, exchange=exchange, interval=interval,
+                                       count=count, start=start, end=end)
+                self.overview_index[key] = overview
+                self.bar_overviews.append(overview)
+            else:
+                # 仅追加在原最新数据之后时数量可精确累加，覆盖写入旧区间时数量为估计值
+                if start > overview.end:
+                    overview.count += count
+                overview.start = min(start, overview.start)
+                overview.end = max(end, overview.end)
+
+    def enable_journal(self, path: str, fresh: bool = False):
+        """
+        启用断点续传日志
+        :param path: 日志数据库文件
+        :param fresh: 放弃未完成的任务重新开始
+        """
+        self.journal = SyncJournal(path)
+        self.fresh = fresh
+
+    def enable_adjust_factors(self, path: str, ttl: float = 7 * 24 * 3600.0):
+        """
+        启用后复权因子存储
+        :param path: 因子数据库文件
+        :param ttl: 单只股票因子表的检查周期上限(秒)
+        """
+        self.factor_store = AdjustFactorStore(path)
+        self.factor_ttl = ttl
+
+    def _all_tscodes(self) -> List[str]:
+        """
+        本节点负责的全部股票代码，启用分片时按crc32取模过滤
+        crc32与进程、主机无关(不同于内置hash)，各主机以相同分片数运行时划分结果一致且互不重叠
+        """
+        tscodes = list(self.symbols['symbol'])
+        if self.shard is None:
+            return tscodes
+        index, count = self.shard
+        return [tscode for tscode in tscodes if zlib.crc32(tscode.encode()) % count == index]
+
+    def _database_settings(self) -> Dict:
+        """
+        多进程同步时子进程新建数据库所需的参数：主进程实际使用的数据库类型(含注入的数据库)及peewee数据库名/文件
+        """
+        database = self.database
+        return {"class": type(database), "database": getattr(getattr(database, "db", None), "database", None)}
+
+    @staticmethod
+    def _task_name(mode: str, dry_run: bool = False) -> str:
+        """"""
+        return {
+            "all": "all",
+            "update": "update:" + datetime.now().strftime(TS_DATE_FORMATE),
+            "check": "check-dry" if dry_run else "check",
+        }[mode]
+
+    def _open_run(self, task: str, tscodes: List[str]) -> List[str]:
+        """
+        打开断点续传任务，返回仍需处理的股票代码；未启用日志时原样返回
+        启用分片时任务名带分片号，同一台机器上的不同分片各自续传
+        """
+        if self.journal is None:
+            return tscodes
+        if self.shard is not None:
+            task += "#shard{}/{}".format(*self.shard)
+        self.run_id, pending = self.journal.open_run(task, tscodes, self.fresh)
+        if len(pending) < len(tscodes):
+            log.info("断点续传：已完成{}只股票，剩余{}只".format(len(tscodes) - len(pending), len(pending)))
+        return pending
+
+    def _close_run(self):
+        """
+        关闭断点续传任务并输出汇总，仍有失败股票时任务保持未完成，下次启动只处理这些股票
+        """
+        if self.journal is None or self.run_id is None:
+            return
+        summary = self.journal.finish_run(self.run_id)
+        log.info("同步任务{}汇总：{}".format(self.run_id, summary))
+        for tscode, error in self.journal.failed_symbols(self.run_id):
+            log.war("{}未完成：{}".format(tscode, error))
+        self.run_id = None
+
+    def _record(self, tscode: str, status: str, start: datetime = None, end: datetime = None,
+                bar_count: int = 0, error: str = ""):
+        """
+        记录单只股票处理状态到断点续传日志，同时登记本进程内的失败股票供延迟重试
+        """
+        with self.failure_lock:
+            if status == STATUS_FAILED:
+                self.failures[tscode] = error
+            else:
+                self.failures.pop(tscode, None)
+        if self.journal is not None and self.run_id is not None:
+            self.journal.mark(self.run_id, tscode, status, start, end, bar_count, error)
+
+    def _save_bars(self, tscode: str, bars: List[BarData], pending: Optional[List[Tuple]] = None) -> bool:
+        """
+        保存K线数据，多线程下载时串行化数据库写入
+        :param pending: 在调用方的事务中写入时传入，汇总更新放入该列表，由调用方在事务提交后执行
+        :return: 是否保存成功
+        """
+        # 数据库接口会就地修改BarData(时区、枚举值)，需先记录汇总信息
+        first, last = bars[0], bars[-1]
+        symbol, exchange, interval = first.symbol, first.exchange, first.interval
+        start, end = first.datetime, last.datetime
+        try:
+            with self.db_lock, metrics.phase(PHASE_SAVE):
+                self.database.save_bar_data(bars)
+        except Exception as ex:
+            log.error(tscode + "数据存入数据库异常")
+            log.error(ex)
+            traceback.print_exc()
+            return False
+        if pending is not None:
+            pending.append((symbol, exchange, interval, start, end, len(bars)))
+            return True
+        self._update_overview(symbol, exchange, interval, start, end, len(bars))
+        metrics.inc("sync_bars_saved_total", len(bars))
+        return True
+
+    def _save_frames(self, frames: List[BarFrame]) -> bool:
+        """
+        列式批量写入多只股票的K线，整批在同一事务中提交，失败时整批回滚
+        :return: 是否保存成功
+        """
+        frames = [frame for frame in frames if len(frame)]
+        if not frames:
+            return True
+        try:
+            with self.db_lock, metrics.phase(PHASE_SAVE):
+                self.bar_sink.save(frames)
+        except Exception as ex:
+            log.error(",".join(frame.symbol for frame in frames) + "数据批量存入数据库异常")
+            log.error(ex)
+            traceback.print_exc()
+            return False
+        for frame in frames:
+            self._update_overview(frame.symbol, frame.exchange, frame.interval,
+                                  frame.datetimes[0].to_pydatetime(), frame.datetimes[-1].to_pydatetime(), len(frame))
+        metrics.inc("sync_bars_saved_total", sum(len(frame) for frame in frames))
+        return True
+
+    def _convert(self, df: pd.DataFrame, req: HistoryRequest):
+        """
+        按写入方式转换标准化df：列式写入时为BarFrame，否则为List[BarData]
+        """
+        if self.bar_sink is not None:
+            return self.akshare_client.df_to_frame(df, req.symbol, req.exchange, req.interval)
+        return self.akshare_client.df_to_bars(df, req.symbol, req.exchange, req.interval)
+
+    def _save_converted(self, tscode: str, data) -> bool:
+        """"""
+        if isinstance(data, BarFrame):
+            return self._save_frames([data])
+        return self._save_bars(tscode, data)
+
+    def _stream_save(self, tscode: str, req: HistoryRequest) -> Tuple[int, str]:
+        """
+        逐窗口查询并保存，每个窗口到达后立即写入数据库，内存中最多保留一个窗口的数据
+        中途某窗口失败时已保存的窗口保留，更新和重试从本地最新数据之后继续
+        :return: (已保存的K线数量, 错误信息)，成功时错误信息为空
+        """
+        bar_count = 0
+        for df in self.akshare_client.iter_history_df(req):
+            if df is None:
+                return bar_count, "各数据源查询失败"
+            data = self._convert(df, req)
+            if len(data) and not self._save_converted(tscode, data):
+                return bar_count, "数据存入数据库异常"
+            bar_count += len(data)
+        return bar_count, ""
+
+    def _fetch_and_save(self, tscode: str, req: HistoryRequest):
+        """
+        查询并保存单只股票的历史数据，结果记录到断点续传日志
+        """
+        bar_count, error = self._stream_save(tscode, req)
+        if error:
+            self._record(tscode, STATUS_FAILED, req.start, req.end, bar_count, error=error)
+        else:
+            self._record(tscode, STATUS_DONE, req.start, req.end, bar_count)
+
+    def _handle_symbol(self, handler: Callable[[str], str], tscode: str) -> str:
+        """"""
+        self._record(tscode, STATUS_RUNNING)
+        begin = datetime.now()
+        try:
+            return handler(tscode)
+        except Exception as ex:
+            self._record(tscode, STATUS_FAILED, error=repr(ex))
+            raise
+        finally:
+            metrics.observe("sync_symbol_seconds", (datetime.now() - begin).total_seconds())
+
+    def _take_failure(self, tscode: str, retry_queue: RetryQueue,
+                      permanent: Dict[str, str]) -> bool:
+        """
+        处理完一只股票后检查是否失败，失败时放入延迟重试队列，重试用尽则登记为永久失败
+        :return: 是否已安排重试(此时不计入进度)
+        """
+        with self.failure_lock:
+            error = self.failures.get(tscode)
+        if error is None:
+            return False
+        delay = retry_queue.push(tscode)
+        if delay is not None:
+            metrics.inc("sync_retries_total")
+            log.war("{}处理失败({})，{:.1f}秒后第{}次重试".format(tscode, error, delay, retry_queue.attempts[tscode]))
+            return True
+        permanent[tscode] = error
+        metrics.inc("sync_failures_total")
+        return False
 
-    def download_all(self):
+    def _report_failures(self, retry_queue: RetryQueue, permanent: Dict[str, str]):
+        """
+        输出延迟重试汇总与重试用尽仍失败的股票
+        """
+        if retry_queue.retried:
+            log.info("延迟重试{}次".format(retry_queue.retried))
+        self.permanent_failures.update(permanent)
+        if permanent:
+            log.error("{}只股票重试{}次后仍失败：{}".format(
+                len(permanent), retry_queue.max_retries, ",".join(permanent)))
+            for tscode, error in permanent.items():
+                log.war("{}：{}".format(tscode, error))
+
+    def _progress_bar(self, total: int, initial: int) -> tqdm:
+        """"""
+        return tqdm(total=total, initial=initial, disable=self.progress_queue is not None)
+
+    def _advance(self, pbar: tqdm):
+        """
+        完成一只股票：更新进度条并输出进度日志(按间隔采样)，子进程中转发给主进程
+        """
+        pbar.update(1)
+        metrics.inc("sync_symbols_total")
+        log.sample("同步进度", pbar.desc, interval=PROGRESS_LOG_INTERVAL)
+        if self.progress_queue is not None:
+            self.progress_queue.put(("progress", pbar.desc))
+
+    def _run_symbols(self, tscodes: List[str], handler: Callable[[str], str], workers: int = 1, skipped: int = 0):
+        """
+        逐个或并发处理股票代码，进度条只在主线程更新
+        失败的股票放入延迟重试队列，到期前继续处理其他股票，到期后插队重试；重试用尽的股票在结束时汇总
+        :param tscodes: 待处理的股票代码
+        :param handler: 处理单个股票代码的函数，返回进度描述，并负责记录完成或失败状态
+        :param workers: 并发线程数，1为顺序执行
+        :param skipped: 已跳过的股票数量，计入进度条
+        """
+        workers = max(workers, 1)
+        retry_queue = RetryQueue(self.retries, self.retry_delay)
+        permanent: Dict[str, str] = {}
+        todo = list(reversed(tscodes))
+        futures: Dict[Future, str] = {}
+
+        with self._progress_bar(len(tscodes) + skipped, skipped) as pbar, \
+                ThreadPoolExecutor(max_workers=workers) as executor:
+            while todo or futures or len(retry_queue):
+                # 到期的重试优先，其次按顺序取新股票
+                while len(futures) < workers:
+                    tscode = retry_queue.pop_ready()
+                    if tscode is None and todo:
+                        tscode = todo.pop()
+                    if tscode is None:
+                        break
+                    futures[executor.submit(self._handle_symbol, handler, tscode)] = tscode
+
+                # 线程已满时等任一股票完成；否则最多等到下一个重试到期
+                timeout = None if len(futures) >= workers else retry_queue.wait_time()
+                if not futures:
+                    with metrics.phase(PHASE_SLEEP):
+                        sleep(timeout)
+                    continue
+                done, _ = wait(list(futures), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tscode = futures.pop(future)
+                    try:
+                        pbar.set_description_str(future.result())
+                    except Exception:
+                        log.error(tscode + "处理异常")
+                        traceback.print_exc()
+                    if self._take_failure(tscode, retry_queue, permanent):
+                        continue
+                    self._advance(pbar)
+
+        self._report_failures(retry_queue, permanent)
+
+    def _sync_symbol(self, builder: Callable[[str], Tuple[Optional[HistoryRequest], str]], tscode: str) -> str:
+        """
+        按请求构造函数查询并保存单只股票
+        """
+        req, desc = builder(tscode)
+        if req is not None:
+            self._fetch_and_save(tscode, req)
+        else:
+            self._record(tscode, STATUS_DONE)
+        return desc
+
+    def _write_batch(self, batch: List[Tuple[Tuple[str, Optional[HistoryRequest], str], Optional[List[BarData]]]]) \
+            -> List[Tuple[Tuple[str, Optional[HistoryRequest], str], str]]:
+        """
+        流水线写入阶段：一次持有数据库锁写入多只股票，数据库支持事务时整批在同一事务中提交
+        vnpy的save_bar_data按首根K线更新汇总，不能混合多只股票，因此批内仍逐只调用；列式写入时整批一次写入
+        写入异常(含事务提交失败)时批内股票均记为失败并进入延迟重试
+        """
+        try:
+            if self.bar_sink is not None:
+                return self._write_frames(batch)
+            return self._write_bars(batch)
+        except Exception as ex:
+            log.error("批量写入异常，批内{}只股票记为失败：{}".format(len(batch), repr(ex)))
+            results = []
+            for (tscode, req, desc), _ in batch:
+                if req is None:
+                    self._record(tscode, STATUS_DONE)
+                else:
+                    self._record(tscode, STATUS_FAILED, req.start, req.end, error="批量写入异常")
+                results.append(((tscode, req, desc), desc))
+            return results
+
+    def _write_bars(self, batch: List[Tuple[Tuple[str, Optional[HistoryRequest], str], Optional[List[BarData]]]]) \
+            -> List[Tuple[Tuple[str, Optional[HistoryRequest], str], str]]:
+        """
+        流水线写入阶段的BarData实现：事务提交后才更新K线汇总并记录断点续传日志，事务回滚时不会留下已完成的记录
+        """
+        db = getattr(self.database, "db", None)
+        transaction = db.atomic() if hasattr(db, "atomic") else contextlib.nullcontext()
+        outcomes: List[Tuple[str, Optional[HistoryRequest], str, int, str]] = []
+        overviews: List[Tuple] = []
+        with self.db_lock, transaction:
+            for (tscode, req, desc), bars in batch:
+                if req is None:
+                    outcomes.append((tscode, req, STATUS_DONE, 0, ""))
+                elif bars is None:
+                    outcomes.append((tscode, req, STATUS_FAILED, 0, "各数据源查询失败"))
+                elif bars and not self._save_bars(tscode, bars, overviews):
+                    outcomes.append((tscode, req, STATUS_FAILED, 0, "数据存入数据库异常"))
+                else:
+                    outcomes.append((tscode, req, STATUS_DONE, len(bars), ""))
+
+        for overview in overviews:
+            self._update_overview(*overview)
+            metrics.inc("sync_bars_saved_total", overview[-1])
+        results = []
+        for ((tscode, req, desc), _), (_, _, status, bar_count, error) in zip(batch, outcomes):
+            if req is None:
+                self._record(tscode, status)
+            else:
+                self._record(tscode, status, req.start, req.end, bar_count, error=error)
+            results.append(((tscode, req, desc), desc))
+        return results
+
+    def _write_frames(self, batch: List[Tuple[Tuple[str, Optional[HistoryRequest], str], Optional[BarFrame]]]) \
+            -> List[Tuple[Tuple[str, Optional[HistoryRequest], str], str]]:
+        """
+        流水线写入阶段的列式实现：整批K线与汇总在同一事务中写入，写入失败时批内股票均记为失败并进入重试
+        """
+        saved = self._save_frames([frame for (_, req, _), frame in batch if req is not None and frame is not None])
+        results = []
+        for (tscode, req, desc), frame in batch:
+            if req is None:
+                self._record(tscode, STATUS_DONE)
+            elif frame is None:
+                self._record(tscode, STATUS_FAILED, req.start, req.end, error="各数据源查询失败")
+            elif len(frame) and not saved:
+                self._record(tscode, STATUS_FAILED, req.start, req.end, error="数据存入数据库异常")
+            else:
+                self._record(tscode, STATUS_DONE, req.start, req.end, len(frame))
+            results.append(((tscode, req, desc), desc))
+        return results
+
+    def _run_pipeline(self, tscodes: List[str], builder: Callable[[str], Tuple[Optional[HistoryRequest], str]],
+                      workers: int = 1, skipped: int = 0):
+        """
+        以抓取→转换→写入流水线处理股票代码，结束后输出各阶段吞吐与队列深度统计
+        """
+        def fetch(task):
+            tscode, req, _ = task
+            self._record(tscode, STATUS_RUNNING)
+            if req is None:
+                return None
+            return self.akshare_client.query_history_df(req)
+
+        def convert(task, df):
+            _, req, _ = task
+            if req is None or df is None:
+                return None
+            return self._convert(df, req)
+
+        retry_queue = RetryQueue(self.retries, self.retry_delay)
+        permanent: Dict[str, str] = {}
+        with self._progress_bar(len(tscodes) + skipped, skipped) as pbar:
+            # 流水线按轮执行：本轮失败的股票进入延迟重试队列，全部处理完后等待最早到期的重试开始下一轮
+            while tscodes:
+                pipeline = SyncPipeline(fetch, convert, self._write_batch, fetch_workers=workers)
+                tasks = ((tscode,) + builder(tscode) for tscode in tscodes)
+                for (tscode, _, _), desc in pipeline.run(tasks):
+                    pbar.set_description_str(desc)
+                    if self._take_failure(tscode, retry_queue, permanent):
+                        continue
+                    self._advance(pbar)
+
+                for line in pipeline.stats().values():
+                    log.info("流水线" + line)
+
+                tscodes = []
+                if len(retry_queue):
+                    with metrics.phase(PHASE_SLEEP):
+                        sleep(retry_queue.wait_time())
+                    while True:
+                        tscode = retry_queue.pop_ready()
+                        if tscode is None:
+                            break
+                        tscodes.append(tscode)
+
+        self._report_failures(retry_queue, permanent)
+
+    def _run_requests(self, tscodes: List[str], builder: Callable[[str], Tuple[Optional[HistoryRequest], str]],
+                      workers: int = 1, skipped: int = 0):
+        """
+        按请求构造函数处理股票代码，根据配置选择流水线或线程池执行
+        :param builder: 为单个股票代码构造查询请求和进度描述，无需查询时请求为None
+        """
+        if self.use_pipeline:
+            self._run_pipeline(tscodes, builder, workers, skipped)
+        else:
+            self._run_symbols(tscodes, lambda tscode: self._sync_symbol(builder, tscode), workers, skipped)
+
+    def _load_frame(self, reader: Optional[BarSink], overview: BarOverview, start: Optional[date]) -> BarFrame:
+        """
+        读取一只股票start(北京时间日期)及之后的本地K线，数据库支持时列式读取，否则经load_bar_data转换
+        """
+        start_dt = convert_tz(CHINA_TZ.localize(datetime.combine(start, time()))) if start else None
+        if reader is not None:
+            with self.db_lock:
+                return reader.load(overview.symbol, overview.exchange, overview.interval, start_dt)
+        with self.db_lock:
+            bars = self.database.load_bar_data(overview.symbol, overview.exchange, overview.interval,
+                                               start_dt or overview.start, overview.end)
+        values = [[bar.open_price, bar.high_price, bar.low_price, bar.close_price, bar.volume, bar.turnover]
+                  for bar in bars]
+        return BarFrame(overview.symbol, overview.exchange, overview.interval,
+                        pd.DatetimeIndex([bar.datetime for bar in bars], tz=DB_TZ),
+                        np.array(values, dtype=float).reshape(-1, 6))
+
+    def export_panel(self):
+        """
+        把本地数据库的日线增量导出到全市场面板(交易日×股票×字段的内存映射.npy文件)
+        已导出的股票只读取面板中最新交易日之后的K线；数据库K线数与面板记录不一致(补全了旧缺口或覆盖写入)的股票整只重新导出
+        """
+        self.init()
+        panel = DailyPanel(self.panel_path, readonly=False)
+        published_day = self.last_published_day() or date.today()
+        trade_days = self.akshare_client.trade_days
+        panel.extend_dates(trade_days[trade_days <= np.datetime64(published_day, 'D')])
+
+        reader = self.bar_sink if self.bar_sink is not None else create_bar_sink(self.database)
+        with self.db_lock:
+            overviews = self.database.get_bar_overview()
+
+        appended = rebuilt = dropped = 0
+        for overview in overviews:
+            # 复权数据集(代码带_qfq/_hfq后缀)不进入面板
+            if overview.interval != Interval.DAILY or "_" in overview.symbol:
+                continue
+            last, count = panel.status(overview.symbol)
+            end_day = np.datetime64(to_china_date(overview.end), 'D')
+            if last is not None and last == end_day and count == overview.count:
+                continue
+            if last is not None and end_day > last:
+                frame = self._load_frame(reader, overview, (last + 1).astype(date))
+                if count + len(frame) == overview.count:
+                    days = frame.datetimes.tz_convert(CHINA_TZ).tz_localize(None).values.astype('datetime64[D]')
+                    dropped += panel.write(overview.symbol, days, frame.values)
+                    appended += 1
+                    continue
+            frame = self._load_frame(reader, overview, None)
+            days = frame.datetimes.tz_convert(CHINA_TZ).tz_localize(None).values.astype('datetime64[D]')
+            dropped += panel.write(overview.symbol, days, frame.values, reset=True)
+            rebuilt += 1
+        panel.commit()
+        if reader is not None and reader is not self.bar_sink:
+            reader.close()
+
+        log.info("日线面板{}：{}个交易日×{}只股票，增量追加{}只，整只导出{}只".format(
+            self.panel_path, len(panel.dates), len(panel.symbols), appended, rebuilt))
+        if dropped:
+            log.war("{}根K线的日期不在交易日历上，未写入日线面板".format(dropped))
+
+    def _refresh_factor(self, tscode: str, changed: List[str]) -> str:
+        """
+        重新查询单只股票的后复权因子表，因子表有变化时登记到changed
+        """
+        table = self.akshare_client.fetch_adjust_factors(tscode)
+        if table is None:
+            self._record(tscode, STATUS_FAILED, error="后复权因子查询失败")
+        else:
+            if self.factor_store.update(tscode, table):
+                changed.append(tscode)
+            self._record(tscode, STATUS_DONE)
+        return "正在检查后复权因子，股票代码:" + tscode
+
+    def refresh_adjust_factors(self, workers: int = 1) -> List[str]:
+        """
+        刷新到期股票的后复权因子表，失败的股票按延迟重试队列重试
+        :return: 因子表发生变化(新增或除权除息)的股票代码
+        """
+        self.init()
+        tscodes = self.factor_store.due(self._all_tscodes(), self.factor_ttl)
+        log.info("{}只股票的后复权因子到期，开始查询".format(len(tscodes)))
+        changed: List[str] = []
+        self._run_symbols(tscodes, lambda tscode: self._refresh_factor(tscode, changed), workers)
+        log.info("后复权因子查询完毕，{}只股票因子表有变化".format(len(changed)))
+        return changed
+
+    def load_adjusted_bars(self, symbol: str, exchange: Exchange, start: datetime, end: datetime,
+                           mode: str = ADJUST_QFQ) -> List[BarData]:
+        """
+        从本地不复权日线按后复权因子即时计算复权K线，无需向数据源重新下载
+        :param mode: ADJUST_QFQ前复权或ADJUST_HFQ后复权
+        :return: 复权K线，尚未查询过因子表时返回空列表
+        """
+        table = self.factor_store.get(symbol) if self.factor_store is not None else None
+        if table is None:
+            log.war("{}尚无后复权因子，请先刷新因子表".format(symbol))
+            return []
+        with self.db_lock:
+            bars = self.database.load_bar_data(symbol, exchange, Interval.DAILY, start, end)
+        if not bars:
+            return []
+        frame = BarFrame(symbol, exchange, Interval.DAILY,
+                         pd.DatetimeIndex([bar.datetime for bar in bars], tz=DB_TZ),
+                         np.array([[bar.open_price, bar.high_price, bar.low_price, bar.close_price, bar.volume,
+                                    bar.turnover] for bar in bars], dtype=float))
+        return self._adjust_frame(frame, symbol, table, mode).to_bars("DB")
+
+    @staticmethod
+    def _adjust_frame(frame: BarFrame, symbol: str, table, mode: str) -> BarFrame:
+        """"""
+        days = frame.datetimes.tz_convert(CHINA_TZ).tz_localize(None).values.astype('datetime64[D]')
+        return BarFrame(symbol, frame.exchange, frame.interval, frame.datetimes,
+                        adjust_prices(frame.values, days, table, mode))
+
+    def export_adjusted(self, mode: str):
+        """
+        把复权日线导出为独立的vnpy数据集，代码为原代码加后缀(如000001_qfq)，回测直接按该代码加载
+        因子表在上次导出后有变化的股票整只重写，其余股票只追加复权数据集最新日期之后的K线
+        """
+        self.init()
+        suffix = "_" + mode
+        with self.db_lock:
+            overviews = self.database.get_bar_overview()
+        targets = {(overview.symbol, overview.exchange): overview
+                   for overview in overviews if overview.symbol.endswith(suffix)}
+        reader = self.bar_sink if self.bar_sink is not None else create_bar_sink(self.database)
+
+        rewritten = appended = 0
+        for overview in overviews:
+            if overview.interval != Interval.DAILY or "_" in overview.symbol:
+                continue
+            table = self.factor_store.get(overview.symbol)
+            if table is None:
+                continue
+            target = targets.get((overview.symbol + suffix, overview.exchange))
+            if target is None or self.factor_store.changed_since_export(overview.symbol, mode):
+                if target is not None:
+                    with self.db_lock:
+                        self.database.delete_bar_data(target.symbol, target.exchange, target.interval)
+                        self.overview_index.pop((target.symbol, target.exchange, target.interval), None)
+                frame = self._load_frame(reader, overview, None)
+                rewritten += 1
+            elif target.end < overview.end:
+                frame = self._load_frame(reader, overview, to_china_date(target.end) + timedelta(days=1))
+                appended += 1
+            else:
+                continue
+
+            adjusted = self._adjust_frame(frame, overview.symbol + suffix, table, mode)
+            if len(adjusted) and not self._save_converted(
+                    overview.symbol, adjusted if self.bar_sink is not None else adjusted.to_bars("akshare")):
+                continue
+            self.factor_store.mark_exported(overview.symbol, mode)
+
+        if reader is not None and reader is not self.bar_sink:
+            reader.close()
+        log.info("{}数据集导出完毕：整只重写{}只，增量追加{}只".format(mode, rewritten, appended))
+
+    def _after_sync(self, workers: int = 1):
+        """
+        下载/更新结束后的派生数据：刷新到期的后复权因子并导出复权数据集，再导出日线面板
+        """
+        if self.factor_store is not None:
+            self.refresh_adjust_factors(workers)
+            for mode in self.adjusted_modes:
+                self.export_adjusted(mode)
+        if self.panel_path:
+            self.export_panel()
+
+    def _download_request(self, tscode: str) -> Tuple[Optional[HistoryRequest], str]:
+        """
+        构造单只股票全部日线数据的下载请求
+        """
+        symbol, exchange = to_vnpy_codes(tscode)
+        # 请求从固定早日期开始，Client按上市日期索引裁剪起点，未收录的股票从首个非空窗口学习上市日期
+        list_date = FALLBACK_START_DATE
+
+        start_date = datetime.strptime(list_date, TS_DATE_FORMATE)
+        req = HistoryRequest(symbol=symbol,
+                             exchange=exchange,
+                             start=start_date,
+                             end=datetime.now(),
+                             interval=Interval.DAILY)
+        return req, "下载A股日线数据股票代码:" + tscode
+
+    def download_all(self, workers: int = 1):
         """
         使用tushare下载A股股票全市场日线数据
+        :param workers: 并发下载线程数，1为顺序下载
         :return:
         """
         log.info("开始下载A股股票全市场日线数据")
-        # stared = False
+        self.init()
         if self.symbols is not None:
-            with tqdm(total=len(self.symbols)) as pbar:
-                for tscode in self.symbols['symbol']:
-                    symbol, exchange = to_vnpy_codes(tscode)
-                    # 不查上市时间(东财接口被封时不可用)，固定早日期，上市前数据源自然返回空
-                    list_date = FALLBACK_START_DATE
-
-                    pbar.set_description_str("下载A股日线数据股票代码:" + tscode)
-                    start_date = datetime.strptime(list_date, TS_DATE_FORMATE)
-                    req = HistoryRequest(symbol=symbol,
-                                         exchange=exchange,
-                                         start=start_date,
-                                         end=datetime.now(),
-                                         interval=Interval.DAILY)
-                    bardata = self.akshare_client.query_history(req=req)
-
-                    if bardata:
-                        try:
-                            database_manager.save_bar_data(bardata)
-                        except Exception as ex:
-                            log.error(tscode + "数据存入数据库异常")
-                            log.error(ex)
-                            traceback.print_exc()
-
-                    pbar.update(1)
-                    log.info(pbar.desc)
+            tscodes = self._all_tscodes()
+            pending = self._open_run("all", tscodes)
+            self._run_requests(pending, self._download_request, workers, len(tscodes) - len(pending))
+            self._close_run()
+            self._after_sync(workers)
 
         log.info("A股股票全市场日线数据下载完毕")
 
     def get_newest_bar_data(self, symbol: str, exchange: Exchange, interval: Interval) -> BarData or None:
-        """"""
-        for overview in self.bar_overviews:
-            if exchange == overview.exchange and interval == overview.interval and symbol == overview.symbol:
-                bars = database_manager.load_bar_data(symbol=symbol, exchange=exchange, interval=interval,
-                                                      start=overview.end, end=overview.end)
-                return bars[0] if bars is not None else None
-        return None
+        """
+        从数据库读取本地最新一根K线，仅需最新日期时直接使用get_overview
+        """
+        self.init()
+        overview = self.get_overview(symbol, exchange, interval)
+        if overview is None:
+            return None
+        bars = self.database.load_bar_data(symbol=symbol, exchange=exchange, interval=interval,
+                                           start=overview.end, end=overview.end)
+        return bars[0] if bars else None
+
+    def last_published_day(self) -> Optional[date]:
+        """
+        最近一个已发布日线数据的交易日：今天是交易日且已过发布时间时为今天，否则为之前最近的交易日
+        定时更新已探测到更晚的交易日发布时以探测结果为准
+        """
+        now = datetime.now()
+        today = now.date()
+        if self.akshare_client.is_trade_day(today) and now.time() >= KLINE_PUBLISH_TIME:
+            published_day = today
+        else:
+            published_day = self.akshare_client.prev_trade_day(today)
+        if self.published_day is not None and (published_day is None or self.published_day > published_day):
+            return self.published_day
+        return published_day
+
+    def _skip_up_to_date(self, tscodes: List[str]) -> List[str]:
+        """
+        跳过本地数据已到最近已发布交易日的股票，不发起任何网络请求
+        周末、节假日或当日数据发布前重复运行时，绝大多数股票在此直接完成
+        :return: 仍需更新的股票代码
+        """
+        published_day = self.last_published_day()
+        if published_day is None:
+            return tscodes
+
+        remaining: List[str] = []
+        for tscode in tscodes:
+            symbol, exchange = to_vnpy_codes(tscode)
+            overview = self.get_overview(symbol=symbol, exchange=exchange, interval=Interval.DAILY)
+            if overview is not None and to_china_date(overview.end) >= published_day:
+                self._record(tscode, STATUS_DONE)
+            else:
+                remaining.append(tscode)
+
+        log.info("最近已发布日线的交易日：{}，本地数据已是最新的股票直接跳过，免去{}次网络请求，{}只需更新".format(
+            published_day.strftime(TS_DATE_FORMATE), len(tscodes) - len(remaining), len(remaining)))
+        return remaining
+
+    def _update_request(self, tscode: str) -> Tuple[Optional[HistoryRequest], str]:
+        """
+        构造单只股票本地最新数据之后的更新请求，续传日期直接取自K线汇总，不查询数据库
+        """
+        symbol, exchange = to_vnpy_codes(tscode)
+
+        overview = self.get_overview(symbol=symbol, exchange=exchange, interval=Interval.DAILY)
+        if overview is not None:
+            newest_date = to_china_date(overview.end)
+            desc = "正在处理股票代码：" + tscode + " 本地最新数据：" + newest_date.strftime(TS_DATE_FORMATE)
+            published_day = self.last_published_day()
+            if published_day is not None and newest_date >= published_day:
+                return None, desc
+            start_date = datetime.combine(newest_date + timedelta(days=1), time())
+        else:
+            desc = "正在处理股票代码：" + tscode + " 无本地数据"
 
-    def update_newest(self, ss_symbol=''):
+            # 固定早日期，Client按上市日期索引裁剪起点
+            start_date = datetime.strptime(FALLBACK_START_DATE, TS_DATE_FORMATE)
+
+        if start_date.date() > datetime.now().date():
+            return None, desc
+        req = HistoryRequest(symbol=symbol,
+                             exchange=exchange,
+                             start=start_date,
+                             end=datetime.now(),
+                             interval=Interval.DAILY)
+        return req, desc
+
+    def _save_spot_bars(self, bars: List[BarData]) -> bool:
+        """
+        一次写入行情快照的K线(每只股票一根)：列式写入时整批一次写入，否则在同一事务中逐只追加
+        事务提交后才更新K线汇总，写入失败时整批回滚
+        :return: 是否保存成功
+        """
+        if self.bar_sink is not None:
+            return self._save_frames([
+                BarFrame(bar.symbol, bar.exchange, bar.interval, pd.DatetimeIndex([bar.datetime]),
+                         np.array([[bar.open_price, bar.high_price, bar.low_price, bar.close_price,
+                                    bar.volume, bar.turnover]], dtype=float))
+                for bar in bars
+            ])
+
+        overviews = [(bar.symbol, bar.exchange, bar.interval, bar.datetime, bar.datetime, 1) for bar in bars]
+        db = getattr(self.database, "db", None)
+        transaction = db.atomic() if hasattr(db, "atomic") else contextlib.nullcontext()
+        try:
+            with self.db_lock, metrics.phase(PHASE_SAVE), transaction:
+                for bar in bars:
+                    # 仅在末尾追加一根K线，以stream方式更新汇总数据，避免每只股票重新统计总数
+                    self.database.save_bar_data([bar], stream=True)
+        except Exception as ex:
+            log.error("行情快照K线批量存入数据库异常，{}只股票改为逐只查询".format(len(bars)))
+            log.error(ex)
+            traceback.print_exc()
+            return False
+        for overview in overviews:
+            self._update_overview(*overview)
+        metrics.inc("sync_bars_saved_total", len(bars))
+        return True
+
+    def update_from_spot(self, tscodes: List[str]) -> List[str]:
+        """
+        快速更新：用一次全市场行情快照补齐所有本地最新数据为上一交易日的股票
+        仅在交易日盘后可用；本地数据存在缺口、停牌或快照中缺失的股票需逐只查询历史数据
+        :param tscodes: 待更新的股票代码
+        :return: 仍需逐只查询历史数据的股票代码
+        """
+        now = datetime.now()
+        today = now.date()
+        if not self.akshare_client.is_trade_day(today) or now.time() < SPOT_READY_TIME:
+            log.info("今日非交易日或尚未收盘，不使用行情快照快速更新")
+            return tscodes
+
+        prev_day = self.akshare_client.prev_trade_day(today)
+        spot_bars = self.akshare_client.query_spot_bars(today)
+        if not spot_bars:
+            return tscodes
+
+        remaining: List[str] = []
+        batch: List[Tuple[str, BarData]] = []
+        for tscode in tscodes:
+            symbol, exchange = to_vnpy_codes(tscode)
+            bar = spot_bars.get(tscode)
+            overview = self.get_overview(symbol=symbol, exchange=exchange, interval=Interval.DAILY)
+            if bar is None or overview is None or to_china_date(overview.end) != prev_day:
+                remaining.append(tscode)
+                continue
+            batch.append((tscode, bar))
+
+        # 数据库接口会就地修改BarData的时间，需先记录
+        dt = CHINA_TZ.localize(datetime.combine(today, time()))
+        saved = 0
+        if batch and self._save_spot_bars([bar for _, bar in batch]):
+            for tscode, _ in batch:
+                self._record(tscode, STATUS_DONE, dt, dt, 1)
+            saved = len(batch)
+        else:
+            remaining.extend(tscode for tscode, _ in batch)
+
+        log.info("行情快照快速更新{}只股票，{}只需逐只查询历史数据".format(saved, len(remaining)))
+        return remaining
+
+    def update_newest(self, ss_symbol='', workers: int = 1, spot: bool = False):
         """
         使用tushare更新本地数据库中的最新数据，默认本地数据库中原最新的数据之前的数据都是完备的
+        :param ss_symbol: 从指定的股票代码开始更新
+        :param workers: 并发更新线程数，1为顺序更新
+        :param spot: 是否先用全市场行情快照快速更新，仅对快照无法覆盖的股票逐只查询
         :return:
         """
-        stared = False
         log.info("开始更新最新的A股股票全市场日线数据")
+        self.init()
         if self.symbols is not None:
-            with tqdm(total=len(self.symbols)) as pbar:
-                for tscode in self.symbols['symbol']:
-                   
-                    symbol, exchange = to_vnpy_codes(tscode)
-
-                    if ss_symbol:
-                        if (not stared and ss_symbol != symbol):
-                            log.info(symbol + ' ingore.')
-                            pbar.update(1)
-                            continue
-                        else:
-                            stared = True
-                    
-                    newest_local_bar = self.get_newest_bar_data(symbol=symbol,
-                                                                exchange=exchange,
-                                                                interval=Interval.DAILY)
-                    if newest_local_bar is not None:
-                        pbar.set_description_str("正在处理股票代码：" + tscode + " 本地最新数据：" +
-                                                 newest_local_bar.datetime.strftime(TS_DATE_FORMATE))
-                        start_date = newest_local_bar.datetime + timedelta(days=1)
-                    else:
-                        pbar.set_description_str("正在处理股票代码：" + tscode + " 无本地数据")
-
-                        # 不查上市时间(东财接口被封时不可用)，固定早日期，上市前数据源自然返回空
-                        start_date = datetime.strptime(FALLBACK_START_DATE, TS_DATE_FORMATE)
-    
-                    if start_date.date() < datetime.now().date():
-                        req = HistoryRequest(symbol=symbol,
-                                            exchange=exchange,
-                                            start=start_date,
-                                            end=datetime.now(),
-                                            interval=Interval.DAILY)
-                        bardata = self.akshare_client.query_history(req=req)
-                        if bardata:
-                            try:
-                                database_manager.save_bar_data(bardata)
-                            except Exception as ex:
-                                log.error(tscode + "数据存入数据库异常")
-                                log.error(ex)
-                                traceback.print_exc()
-
-                    pbar.update(1)
-                    log.info(pbar.desc)
+            all_tscodes = self._all_tscodes()
+            tscodes = self._open_run("update:" + datetime.now().strftime(TS_DATE_FORMATE), all_tscodes)
+            if ss_symbol and ss_symbol in tscodes:
+                index = tscodes.index(ss_symbol)
+                for tscode in tscodes[:index]:
+                    log.sample("跳过", tscode + ' ingore.')
+                tscodes = tscodes[index:]
+            # 行情快照在15:30后即可用，先于按16:00发布时间的跳过判断，否则本地已到上一交易日的股票均被跳过
+            if spot:
+                tscodes = self.update_from_spot(tscodes)
+            tscodes = self._skip_up_to_date(tscodes)
+            self._run_requests(tscodes, self._update_request, workers, len(all_tscodes) - len(tscodes))
+            self._close_run()
+            self._after_sync(workers)
 
         log.info("A股股票全市场日线数据更新完毕")
 
-    def check_update_all(self):
+    def _check_symbol(self, tscode: str, dry_run: bool, gap_report: Dict[str, List[Tuple[date, date, int]]]) -> str:
+        """
+        检查单只股票本地数据缺口，并按连续缺失区间补全
+        :param dry_run: 仅记录缺口，不请求数据源
+        :param gap_report: 汇总各股票缺口区间
+        """
+        desc = "正在检查A股日线数据，股票代码:" + tscode
+        symbol, exchange = to_vnpy_codes(tscode)
+        overview = self.get_overview(symbol=symbol, exchange=exchange, interval=Interval.DAILY)
+        if overview is None:
+            # 无本地数据的股票由download_all/update_newest负责
+            self._record(tscode, STATUS_DONE)
+            return desc
+
+        with self.db_lock:
+            local_bars = self.database.load_bar_data(symbol=symbol,
+                                                     exchange=exchange,
+                                                     interval=Interval.DAILY,
+                                                     start=overview.start,
+                                                     end=overview.end)
+        local_dates = np.array([to_china_date(bar.datetime) for bar in local_bars], dtype='datetime64[D]')
+        ranges = find_gap_ranges(self.trade_day_index[exchange.value], local_dates)
+        if not ranges:
+            self._record(tscode, STATUS_DONE)
+            return desc
+
+        with self.db_lock:
+            gap_report[tscode] = ranges
+        failed = 0
+        bar_count = 0
+        for start, end, days in ranges:
+            log.info("{}本地数据库缺失：{}~{}，共{}个交易日".format(
+                tscode, start.strftime(TS_DATE_FORMATE), end.strftime(TS_DATE_FORMATE), days))
+            if dry_run:
+                continue
+            req = HistoryRequest(symbol=symbol,
+                                 exchange=exchange,
+                                 start=datetime.combine(start, time()),
+                                 end=datetime.combine(end, time()),
+                                 interval=Interval.DAILY)
+            saved, error = self._stream_save(tscode, req)
+            bar_count += saved
+            if error:
+                failed += 1
+
+        first_day = datetime.combine(ranges[0][0], time())
+        last_day = datetime.combine(ranges[-1][1], time())
+        if failed:
+            self._record(tscode, STATUS_FAILED, first_day, last_day, bar_count,
+                         error="{}个缺口区间补全失败".format(failed))
+        else:
+            self._record(tscode, STATUS_DONE, first_day, last_day, bar_count)
+        return desc
+
+    def check_update_all(self, workers: int = 1, dry_run: bool = False) -> Dict[str, List[Tuple[date, date, int]]]:
         """
-        这个方法太慢了，不建议调用。
         这个方法用于本地数据库已经建立，但可能有部分数据缺失时使用
-        使用tushare检查更新所有的A股股票全市场日线数据
-        检查哪一个交易日的数据是缺失的，补全它
-        检查上市后是否每个交易日都有数据，若存在某一交易日无数据，尝试从tushare查询该日数据，若仍无，则说明当天停盘
-        :return:
+        检查每只股票从本地首根K线到最近交易日是否每个交易日都有数据，连续缺失的交易日合并为一个区间只请求一次
+        补全后仍缺失的交易日通常为停牌
+        :param workers: 并发线程数，1为顺序执行
+        :param dry_run: 仅检查并报告缺口，不请求数据源
+        :return: {股票代码: [(缺口起始日, 缺口结束日, 缺失交易日数)]}
         """
         log.info("开始检查更新所有的A股股票全市场日线数据")
+        self.init()
 
+        gap_report: Dict[str, List[Tuple[date, date, int]]] = {}
         if self.symbols is not None:
-            with tqdm(total=len(self.symbols)) as pbar:
-                # for tscode, list_date in zip(self.symbols['symbol'], self.symbols['list_date']):
+            tscodes = self._all_tscodes()
+            pending = self._open_run("check-dry" if dry_run else "check", tscodes)
+            self._run_symbols(pending,
+                              lambda tscode: self._check_symbol(tscode, dry_run, gap_report),
+                              workers, len(tscodes) - len(pending))
+            self._close_run()
 
-                for symbol in self.symbols['symbol']:
-                    pbar.set_description_str("正在检查A股日线数据，股票代码:" + symbol)
+        log.info("共{}只股票存在缺口，缺口区间{}个，缺失交易日{}个".format(
+            len(gap_report),
+            sum(len(ranges) for ranges in gap_report.values()),
+            sum(days for ranges in gap_report.values() for _, _, days in ranges)))
+        log.info("A股股票全市场日线数据检查更新完毕")
+        return gap_report
 
-                    symbol, exchange = to_vnpy_codes(symbol)
+    def run_shard(self, mode: str, tscodes: List[str], workers: int = 1,
+                  dry_run: bool = False) -> Dict[str, List[Tuple[date, date, int]]]:
+        """
+        处理一个分片的股票代码，断点续传任务由主进程打开和关闭
+        :param mode: "all"下载全部、"update"更新最新、"check"检查并补全缺口
+        :return: check模式下的缺口汇总，其他模式为空
+        """
+        self.init()
+        gap_report: Dict[str, List[Tuple[date, date, int]]] = {}
+        if mode == "all":
+            self._run_requests(tscodes, self._download_request, workers)
+        elif mode == "update":
+            self._run_requests(tscodes, self._update_request, workers)
+        else:
+            self._run_symbols(tscodes, lambda tscode: self._check_symbol(tscode, dry_run, gap_report), workers)
+        return gap_report
+
+    def run_processes(self, mode: str, processes: int, workers: int = 1, dry_run: bool = False,
+                      spot: bool = False) -> Dict[str, List[Tuple[date, date, int]]]:
+        """
+        多进程分片执行下载/更新/检查
+        股票代码轮流分配到各子进程，子进程各自新建Client和数据库连接，DataFrame解析和BarData构造可利用多核
+        各数据源的令牌桶在进程间共享，限流额度为所有进程合计；进度条与汇总在主进程统一输出
+        :param mode: "all"下载全部、"update"更新最新、"check"检查并补全缺口
+        :param processes: 子进程数
+        :param workers: 每个子进程内的并发线程数
+        :param dry_run: check模式下仅检查并报告缺口
+        :param spot: update模式下先在主进程用全市场行情快照快速更新
+        :return: check模式下的缺口汇总，其他模式为空
+        """
+        self.init()
+        task = self._task_name(mode, dry_run)
+        log.info("{}个子进程分片执行同步任务：{}".format(processes, task))
 
-                    # 不查上市时间(东财接口被封时不可用)，以交易日历起始日为检查起点
-                    list_date = self.trade_cal[exchange.value]['trade_date'].min().strftime(TS_DATE_FORMATE)
+        tscodes = self._all_tscodes()
+        pending = self._open_run(task, tscodes)
+        if mode == "update" and spot:
+            pending = self.update_from_spot(pending)
+        if mode == "update":
+            pending = self._skip_up_to_date(pending)
+        shards = [pending[index::processes] for index in range(processes)]
 
-                    local_bar = database_manager.load_bar_data(symbol=symbol,
-                                                               exchange=exchange,
-                                                               interval=Interval.DAILY,
-                                                               start=datetime.strptime(list_date, TS_DATE_FORMATE),
-                                                               end=datetime.now())
-                    local_bar_dates = [bar.datetime.strftime(TS_DATE_FORMATE) for bar in local_bar]
+        context = multiprocessing.get_context()
+        progress_queue = context.Queue()
+        limiters = {
+            source_name: SharedTokenBucket(rate, capacity, context)
+            for source_name, (rate, capacity) in SOURCE_RATE_LIMITS.items()
+        }
+        settings = {
+            "timeout": self.akshare_client.timeout,
+            "hedge": self.akshare_client.hedge,
+            "session_pool": self.akshare_client.session_pool.pool_size
+            if self.akshare_client.session_pool is not None else 0,
+            "cache": self.akshare_client.cache.path if self.akshare_client.cache is not None else None,
+            "listing": self.akshare_client.listing.path if self.akshare_client.listing is not None else None,
+            "journal": self.journal.path if self.journal is not None else None,
+            "run_id": self.run_id,
+            "use_pipeline": self.use_pipeline,
+            "retries": self.retries,
+            "retry_delay": self.retry_delay,
+            "bulk_write": self.bulk_write,
+            "database": self._database_settings(),
+        }
+        reference = self.akshare_client.reference_data()
+        children = {
+            index: context.Process(
+                target=run_shard_process,
+                args=(index, mode, shard, workers, dry_run, settings, reference, limiters, progress_queue),
+                name="ak_dm-shard{}".format(index))
+            for index, shard in enumerate(shards) if shard
+        }
+        for child in children.values():
+            child.start()
 
-                    index = self.trade_cal[exchange.value][(self.trade_cal[exchange.value]['trade_date'] == datetime.date(datetime.strptime(list_date, TS_DATE_FORMATE)))]
-                    if index.size == 0:  #当日发行股票，无行情数据
-                        continue
-                    trade_cal = self.trade_cal[exchange.value].iloc[index.index[0]:]
-                    for trade_date in trade_cal['trade_date']:
-                        if trade_date not in local_bar_dates:
-                            req = HistoryRequest(symbol=symbol,
-                                                 exchange=exchange,
-                                                 start=trade_date,
-                                                 end=trade_date,
-                                                 interval=Interval.DAILY)
-                            bardata = self.akshare_client.query_history(req=req)
-                            if bardata:
-                                log.info(symbol + "本地数据库缺失：" + trade_date.strftime(TS_DATE_FORMATE))
-                                try:
-                                    database_manager.save_bar_data(bardata)
-                                except Exception as ex:
-                                    log.error(symbol + "数据存入数据库异常")
-                                    log.error(ex)
-                                    traceback.print_exc()
+        results: Dict[int, Dict] = {}
+        with tqdm(total=len(tscodes), initial=len(tscodes) - len(pending)) as pbar:
+            while len(results) < len(children):
+                try:
+                    message = progress_queue.get(timeout=1.0)
+                except queue.Empty:
+                    # 子进程异常退出时不会发送汇总，全部退出且队列已空即结束等待
+                    if not any(child.is_alive() for child in children.values()) and progress_queue.empty():
+                        break
+                    continue
+                if message[0] == "progress":
+                    pbar.set_description_str(message[1])
                     pbar.update(1)
-                    log.info(pbar.desc)
+                    metrics.inc("sync_symbols_total")
+                else:
+                    results[message[1]] = message[2]
 
-        log.info("A股股票全市场日线数据检查更新完毕")
+        for child in children.values():
+            child.join()
+
+        gap_report: Dict[str, List[Tuple[date, date, int]]] = {}
+        for index, child in children.items():
+            result = results.get(index)
+            if result is None:
+                log.error("分片{}子进程异常退出(exitcode={})，未完成的股票下次运行时续传".format(index, child.exitcode))
+                continue
+            log.info("分片{}：{}只股票，请求超时{}次，数据源统计：{}".format(
+                index, len(shards[index]), result["timeouts"], result["sources"]))
+            if result["cache"] is not None:
+                log.info("分片{} K线缓存统计：{}".format(index, result["cache"]))
+            gap_report.update(result["gaps"])
+            self.permanent_failures.update(result["failures"])
+            metrics.merge(result["metrics"])
+
+        if self.permanent_failures:
+            log.error("共{}只股票重试后仍失败：{}".format(
+                len(self.permanent_failures), ",".join(self.permanent_failures)))
+        if mode == "check":
+            log.info("共{}只股票存在缺口，缺口区间{}个，缺失交易日{}个".format(
+                len(gap_report),
+                sum(len(ranges) for ranges in gap_report.values()),
+                sum(days for ranges in gap_report.values() for _, _, days in ranges)))
+        self._close_run()
+        if mode != "check":
+            self._after_sync(workers)
+        log.info("A股股票全市场日线数据多进程同步完毕")
+        return gap_report
+
+    def run_queue(self, mode: str, path: str, workers: int = 1, dry_run: bool = False,
+                  batch: int = 20, lease_seconds: float = 600.0) -> Dict[str, List[Tuple[date, date, int]]]:
+        """
+        从共享任务队列领取股票执行下载/更新/检查，多个节点(主机或本机多个进程)指向同一队列文件即可协同
+        每次领取batch只，处理完成后回写结果再领取下一批，直到队列中没有可领取的股票
+        任务进度由队列记录，不使用本地断点续传日志；节点中断后其租约到期，剩余股票由其他节点接手
+        :param path: 队列数据库文件
+        :param batch: 每次领取的股票数
+        :param lease_seconds: 租约时长(秒)
+        :return: check模式下本节点发现的缺口汇总
+        """
+        self.init()
+        task = self._task_name(mode, dry_run)
+        work_queue = WorkQueue(path, lease_seconds)
+        added = work_queue.populate(task, self._all_tscodes())
+        log.info("任务队列{}：{}，节点{}，新登记{}只股票，当前状态{}".format(
+            path, task, work_queue.worker_id, added, work_queue.counts(task)))
+
+        stop = work_queue.start_heartbeat(task)
+        gap_report: Dict[str, List[Tuple[date, date, int]]] = {}
+        processed = 0
+        try:
+            while True:
+                tscodes = work_queue.lease(task, batch)
+                if not tscodes:
+                    break
+                gap_report.update(self.run_shard(mode, tscodes, workers, dry_run))
+                for tscode in tscodes:
+                    work_queue.complete(task, tscode, self.permanent_failures.get(tscode, ""))
+                processed += len(tscodes)
+        finally:
+            stop.set()
+
+        log.info("本节点处理{}只股票，任务队列状态{}".format(processed, work_queue.counts(task)))
+        work_queue.close()
+        return gap_report
 
 
 a_share_daily_data_manager = AShareDailyDataManager()
 
 
-def auto_update(start_time: time = time(18, 0)):
+def create_shard_database(database_settings: Dict) -> BaseDatabase:
+    """
+    子进程中按主进程数据库的类型新建实例，数据库连接不能跨进程共享
+    peewee数据库(如vnpy_sqlite)先关闭fork继承的模块级连接，再按主进程使用的数据库文件重新初始化
+    :param database_settings: AShareDailyDataManager._database_settings的返回值
+    """
+    database_class = database_settings["class"]
+    db = getattr(sys.modules.get(database_class.__module__), "db", None)
+    if db is not None and hasattr(db, "is_closed") and hasattr(db, "init"):
+        if not db.is_closed():
+            db.close()
+        if database_settings["database"]:
+            db.init(database_settings["database"])
+    return database_class()
+
+
+def run_shard_process(index: int, mode: str, tscodes: List[str], workers: int, dry_run: bool, settings: Dict,
+                      reference: Dict, limiters: Dict[str, SharedTokenBucket], progress_queue):
+    """
+    多进程同步的子进程入口：新建Client和数据库连接处理一个分片，结束后把汇总发送回主进程
+    """
+    metrics.reset()
+    client = AKShareClient()
+    client.load_reference_data(reference)
+    client.limiters = limiters
+    client.timeout = settings["timeout"]
+    if settings["hedge"]:
+        client.enable_hedge(workers)
+    if settings["session_pool"]:
+        client.enable_session_pool(settings["session_pool"])
+    if settings["cache"]:
+        client.enable_cache(settings["cache"])
+    if settings["listing"]:
+        client.enable_listing_index(settings["listing"])
+
+    manager = AShareDailyDataManager(client, create_shard_database(settings["database"]))
+    manager.use_pipeline = settings["use_pipeline"]
+    manager.retries = settings["retries"]
+    manager.retry_delay = settings["retry_delay"]
+    manager.bulk_write = settings["bulk_write"]
+    manager.progress_queue = progress_queue
+    if settings["journal"]:
+        manager.enable_journal(settings["journal"])
+        manager.run_id = settings["run_id"]
+
+    gap_report = manager.run_shard(mode, tscodes, workers, dry_run)
+    if client.listing is not None:
+        client.listing.save()
+    snapshot = metrics.snapshot()
+    progress_queue.put(("done", index, {
+        "gaps": gap_report,
+        "failures": manager.permanent_failures,
+        "timeouts": client.timeouts,
+        "sources": client.scheduler.snapshot(),
+        "cache": client.cache.stats() if client.cache is not None else None,
+        # 进度已由主进程按消息计数，子进程的股票计数不再合并
+        "metrics": dict(snapshot, counters=[item for item in snapshot["counters"]
+                                            if item["name"] != "sync_symbols_total"]),
+    }))
+
+
+def http_connection_stats(snapshot: Dict) -> Dict[str, str]:
+    """
+    从指标快照汇总各主机的HTTP请求数、新建连接数与连接复用率(含多进程子进程合并的指标)
+    """
+    counts: Dict[str, List[float]] = {}
+    for item in snapshot["counters"]:
+        if item["name"] in ("akshare_http_requests_total", "akshare_http_connections_total"):
+            pair = counts.setdefault(item["labels"]["host"], [0.0, 0.0])
+            pair[item["name"] == "akshare_http_connections_total"] += item["value"]
+    return {
+        host: "{:.0f}/{:.0f}/{:.0%}".format(requests_count, connections,
+                                           1 - connections / requests_count if requests_count else 0)
+        for host, (requests_count, connections) in counts.items()
+    }
+
+
+def auto_update(canary: str = PUBLISH_CANARY, deadline: time = PUBLISH_DEADLINE,
+                probe_interval: float = PUBLISH_PROBE_INTERVAL, workers: int = 1, spot: bool = False,
+                processes: int = 1):
     """
     每日盘后自动更新最新日线数据到本地数据库
     """
     log.info("启动A股股票全市场日线数据定时更新")
-    run_parent(start_time=start_time)
+    run_parent(canary, deadline, probe_interval, workers, spot, processes)
 
 
-def run_parent(start_time: time = time(18, 0)):
+def _update_window(client: AKShareClient, now: datetime) -> Optional[datetime]:
     """
-    运行父进程，定时启动子进程下载任务
-    :return:
+    下一次开始探测数据发布的时间：今天是交易日且未到探测时间时为今天，否则为下一个交易日，交易日历用尽时返回None
     """
-    log.info("启动A股股票全市场日线数据定时更新父进程")
+    today = now.date()
+    if client.is_trade_day(today) and now.time() < PUBLISH_PROBE_START:
+        return datetime.combine(today, PUBLISH_PROBE_START)
+    day = client.next_trade_day(today)
+    return datetime.combine(day, PUBLISH_PROBE_START) if day is not None else None
+
 
-    # 每天晚上18：30从tushare更新当时K线数据
-    UPDATE_TIME = start_time
+def run_parent(canary: str = PUBLISH_CANARY, deadline: time = PUBLISH_DEADLINE,
+               probe_interval: float = PUBLISH_PROBE_INTERVAL, workers: int = 1, spot: bool = False,
+               processes: int = 1):
+    """
+    运行父进程，按交易日历定时启动子进程下载任务：
+    休眠到下一个交易日收盘后，逐次探测canary股票的当日日线，多个数据源一致(或过了发布时间后有数据源返回)即立即更新，非交易日不运行
+    启动时先补跑一次(停机期间错过的交易日由增量更新一并补齐，本地已是最新的股票不产生网络请求)，更新失败时间隔重试
+    :param canary: 探测数据发布的股票代码
+    :param deadline: 到该时间仍未探测到发布时直接更新
+    :param probe_interval: 探测间隔(秒)
+    """
+    log.info("启动A股股票全市场日线数据定时更新父进程")
+    manager = a_share_daily_data_manager
+    client = manager.akshare_client
 
-    child_process = None
+    # 最近一次更新成功时的最新交易日，启动时未知
+    done_day: Optional[date] = None
 
     while True:
-        current_time = datetime.now().time()
+        now = datetime.now()
+        today = now.date()
+        # 父进程只查询交易日历，股票列表与K线汇总由每次更新的子进程重新读取
+        if client.trade_days is None or client.next_trade_day(today) is None:
+            if not client.refresh_trade_calendar() and client.trade_days is None:
+                sleep(AUTO_UPDATE_RETRY_INTERVAL)
+                continue
 
-        if current_time.hour == UPDATE_TIME.hour and current_time.minute == UPDATE_TIME.minute and child_process is None:
-            log.info("启动日线数据更新子进程")
-            child_process = multiprocessing.Process(target=run_child)
-            child_process.start()
-            log.info("日线数据更新子进程启动成功")
+        # 待更新的交易日：今天收盘后为今天，否则为之前最近的交易日
+        if client.is_trade_day(today) and now.time() >= PUBLISH_PROBE_START:
+            pending = today
+        else:
+            pending = client.prev_trade_day(today)
 
-        if (not (current_time.hour == UPDATE_TIME.hour and current_time.minute == UPDATE_TIME.minute)) \
-                and child_process is not None:
-            child_process.join()
-            child_process = None
-            log.info("数据更新子进程关闭成功")
-            log.info("进入A股股票全市场日线数据定时更新父进程")
+        if pending is None or (done_day is not None and done_day >= pending):
+            window = _update_window(client, now)
+            if window is None:
+                sleep(AUTO_UPDATE_MAX_SLEEP)
+                continue
+            sleep(min(max((window - now).total_seconds(), 1.0), AUTO_UPDATE_MAX_SLEEP))
+            continue
 
-        sleep(10)
+        if pending == today and now.time() < deadline:
+            agreed = client.probe_published(canary, today)
+            if not agreed or (agreed < PUBLISH_PROBE_SOURCES and now.time() < KLINE_PUBLISH_TIME):
+                log.sample("探测数据发布", "{}的{}日线尚未确认发布(一致的数据源{}个)，每{:g}秒探测一次".format(
+                    canary, today, agreed or 0, probe_interval), interval=1800)
+                sleep(probe_interval)
+                continue
+            log.info("探测到{}的{}日线已发布(一致的数据源{}个)，开始更新".format(canary, today, agreed))
+        elif pending == today:
+            log.war("{}前未探测到{}的{}日线发布，直接更新".format(deadline.strftime("%H:%M"), canary, today))
+        else:
+            log.info("补跑{}的日线数据更新".format(pending))
 
+        # 子进程按探测结果判断当日数据已发布，不再等到固定发布时间
+        manager.published_day = pending
+        log.info("启动日线数据更新子进程")
+        child_process = multiprocessing.Process(target=run_child, args=(workers, spot, processes),
+                                                name="ak_dm-update")
+        child_process.start()
+        child_process.join()
+        # 放弃未完成任务只在第一次更新时生效，失败重试时续传
+        manager.fresh = False
+        if child_process.exitcode == 0:
+            done_day = pending
+            window = _update_window(client, datetime.now())
+            log.info("数据更新子进程关闭成功，日线数据已更新至{}，{}开始探测下一交易日数据发布".format(
+                pending, window.strftime("%Y-%m-%d %H:%M") if window is not None else "交易日历更新后"))
+        else:
+            log.error("数据更新子进程异常退出(exitcode={})，{}秒后重试".format(
+                child_process.exitcode, AUTO_UPDATE_RETRY_INTERVAL))
+            sleep(AUTO_UPDATE_RETRY_INTERVAL)
 
-def run_child():
+
+def run_child(workers: int = 1, spot: bool = False, processes: int = 1):
     """
-    子线程下载数据
+    子进程下载数据，异常时以非零退出码结束，由父进程重试
     :return:
     """
     log.info("启动A股股票全市场日线数据定时更新子进程")
 
+    manager = a_share_daily_data_manager
+    # 父进程的交易日历只在用尽时刷新，今天之前的交易日(trade_cal)按父进程启动时过滤，子进程重新查询
+    manager.akshare_client.refresh_trade_calendar()
+    # 断点续传日志的sqlite连接不能跨进程使用，子进程重新打开
+    if manager.journal is not None:
+        manager.enable_journal(manager.journal.path, manager.fresh)
     try:
-        a_share_daily_data_manager.update_newest()
+        if processes > 1:
+            manager.run_processes("update", processes, workers, spot=spot)
+        else:
+            manager.update_newest(workers=workers, spot=spot)
     except Exception:
-        log.info("子进程异常")
-        traceback.print_exc()
+        log.error("子进程异常：{}".format(traceback.format_exc()))
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -272,23 +1470,156 @@ if __name__ == '__main__':
     parser.add_argument("-c", "--check", help="check_update_all",
                         action="store_true")
     parser.add_argument("-s", "--symbol", type=str, help="从指定的股票代码开始更新")
+    parser.add_argument("--auto", help="常驻运行：每个交易日收盘后探测数据源发布当日日线即自动更新，非交易日不运行",
+                        action="store_true")
+    parser.add_argument("--canary", type=str, default=PUBLISH_CANARY,
+                        help="配合--auto使用，探测数据发布的股票代码(默认000001)")
+    parser.add_argument("--probe-interval", type=float, default=PUBLISH_PROBE_INTERVAL,
+                        help="配合--auto使用，探测间隔秒数，默认120")
+    parser.add_argument("--publish-deadline", type=str, default=PUBLISH_DEADLINE.strftime("%H:%M"),
+                        help="配合--auto使用，到该时间(HH:MM)仍未探测到发布时直接更新，默认20:00")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="并发下载线程数，默认1为顺序下载")
+    parser.add_argument("--dry-run", help="配合-c使用，仅检查并报告数据缺口，不补全",
+                        action="store_true")
+    parser.add_argument("--cache", type=str, nargs="?", const=".kline_cache",
+                        help="启用本地K线缓存，可指定缓存目录(默认.kline_cache)")
+    parser.add_argument("--journal", type=str, default="sync_journal.db",
+                        help="断点续传日志文件，重启后从未完成和失败的股票继续(默认sync_journal.db)")
+    parser.add_argument("--no-journal", help="不记录断点续传日志", action="store_true")
+    parser.add_argument("--fresh", help="放弃未完成的同步任务，重新开始", action="store_true")
+    parser.add_argument("--pipeline", help="以抓取→转换→写入流水线执行下载/更新，-w为抓取线程数，结束后输出各阶段吞吐统计",
+                        action="store_true")
+    parser.add_argument("--bulk", help="K线按列批量写入数据库(不构造BarData，K线与汇总同一事务)，目前支持vnpy_sqlite，其他数据库自动退回逐根写入",
+                        action="store_true")
+    parser.add_argument("--panel", type=str, nargs="?", const=".panel",
+                        help="下载/更新结束后把日线增量导出为全市场内存映射面板(交易日×股票×字段的.npy文件)，可指定目录(默认.panel)")
+    parser.add_argument("--factors", type=str, nargs="?", const=".adjust_factors.db",
+                        help="下载/更新结束后刷新到期股票的后复权因子表(不重新下载K线)，可指定因子文件(默认.adjust_factors.db)")
+    parser.add_argument("--factor-ttl", type=float, default=7.0,
+                        help="配合--factors使用，单只股票因子表的检查周期上限(天)，各股票在周期的1/2~1之间错开到期，默认7")
+    parser.add_argument("--adjusted", type=str, nargs="+", choices=[ADJUST_QFQ, ADJUST_HFQ], default=[],
+                        help="配合--factors使用，把复权日线导出为独立vnpy数据集(代码加_qfq/_hfq后缀)")
+    parser.add_argument("--metrics", type=str, nargs="?", const="sync_metrics.prom",
+                        help="运行期间定期及结束时导出指标文件，扩展名.json为JSON，否则为Prometheus文本格式(默认sync_metrics.prom)")
+    parser.add_argument("--metrics-interval", type=float, default=30.0, help="配合--metrics使用，导出间隔秒数，默认30")
+    parser.add_argument("--profile", type=str, nargs="?", const="sync.prof",
+                        help="以cProfile剖析本次运行(多进程时仅主进程)，统计写入指定文件(默认sync.prof)，可用snakeviz等查看")
+    parser.add_argument("-p", "--processes", type=int, default=1,
+                        help="多进程分片执行下载/更新/检查的子进程数，各进程共享数据源限流额度，-w为每个进程的线程数")
+    parser.add_argument("--shard", type=str,
+                        help="多主机分片，格式i/n(如0/3)，按股票代码crc32取模只处理第i片，各主机使用相同n")
+    parser.add_argument("--queue", type=str,
+                        help="从共享任务队列文件领取股票执行(各节点指向同一文件)，节点中断后其股票在租约到期后由其他节点接手")
+    parser.add_argument("--lease", type=float, default=600.0, help="配合--queue使用，租约时长秒数，默认600")
+    parser.add_argument("--universe", type=str, default=".universe.pkl",
+                        help="股票列表与交易日历快照文件，启动时直接读取，无需请求网络(默认.universe.pkl)")
+    parser.add_argument("--universe-ttl", type=float, default=12.0,
+                        help="快照有效期(小时)，过期后本次仍使用快照并在后台刷新，0为不使用快照")
+    parser.add_argument("--listing", type=str, default=".listing_dates.json",
+                        help="个股上市日期索引文件，下载从上市日期开始，不再从1990年逐窗口空查；传空字符串不使用")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="失败股票的延迟重试次数(指数退避，等待期间继续处理其他股票)，默认3")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="单次K线请求超时秒数，超时视为该数据源失败并切换下一数据源，0为不限时")
+    parser.add_argument("--hedge", help="数据源超过其耗时高分位数未返回时同时请求下一数据源，取最先返回的结果",
+                        action="store_true")
+    parser.add_argument("--pool-size", type=int, default=0,
+                        help="HTTP连接池每个主机保持的连接数，默认0为按并发线程数自动设置")
+    parser.add_argument("--no-session-pool", help="不复用HTTP连接，每次请求新建连接(akshare默认行为)",
+                        action="store_true")
+    parser.add_argument("--spot", help="盘后用全市场行情快照一次性更新当日数据，仅对有缺口的股票逐只查询",
+                        action="store_true")
 
     args = parser.parse_args()
 
-    if args.all:
-        log.info("下载所有A股股票全市场日线数据")
-        a_share_daily_data_manager.download_all()
-    elif args.update:
-        log.info("自动更新A股股票全市场日线数据")
-        a_share_daily_data_manager.update_newest(args.symbol)
-    elif args.check:
-        log.info("检测并自动更新A股股票全市场日线数据(速度极慢)")
-        a_share_daily_data_manager.check_update_all()
-    else:
-        log.info("自动更新A股股票全市场日线数据")
-        a_share_daily_data_manager.update_newest(args.symbol)
+    if args.cache:
+        akshare_client.enable_cache(args.cache)
+    if args.listing:
+        akshare_client.enable_listing_index(args.listing)
+    if args.universe_ttl > 0:
+        akshare_client.enable_universe_snapshot(args.universe, args.universe_ttl * 3600)
+    if args.hedge:
+        akshare_client.enable_hedge(args.workers)
+    akshare_client.timeout = args.timeout
+    if not args.no_session_pool:
+        # 对冲请求同时占用两个连接
+        akshare_client.enable_session_pool(args.pool_size or max(args.workers, 1) * (2 if args.hedge else 1))
+    if not args.no_journal:
+        a_share_daily_data_manager.enable_journal(args.journal, args.fresh)
+    a_share_daily_data_manager.use_pipeline = args.pipeline
+    a_share_daily_data_manager.retries = args.retries
+    a_share_daily_data_manager.bulk_write = args.bulk
+    a_share_daily_data_manager.panel_path = args.panel
+    if args.factors:
+        a_share_daily_data_manager.enable_adjust_factors(args.factors, args.factor_ttl * 24 * 3600)
+        a_share_daily_data_manager.adjusted_modes = args.adjusted
+    elif args.adjusted:
+        parser.error("--adjusted需配合--factors使用")
+    if args.shard:
+        shard = tuple(int(value) for value in args.shard.split("/") if value.isdigit())
+        if len(shard) != 2 or not 0 <= shard[0] < shard[1]:
+            parser.error("--shard格式为i/n，且0<=i<n")
+        a_share_daily_data_manager.shard = shard
+    try:
+        publish_deadline = datetime.strptime(args.publish_deadline, "%H:%M").time()
+    except ValueError:
+        parser.error("--publish-deadline格式为HH:MM")
+
+    stop_exporter = None
+    if args.metrics:
+        stop_exporter = metrics.start_exporter(args.metrics, args.metrics_interval)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        mode = "all" if args.all else "check" if args.check else "update"
+        if args.auto:
+            auto_update(args.canary, publish_deadline, args.probe_interval, args.workers, args.spot,
+                        args.processes)
+        elif args.queue:
+            a_share_daily_data_manager.run_queue(mode, args.queue, args.workers, args.dry_run,
+                                                 lease_seconds=args.lease)
+        elif args.processes > 1:
+            a_share_daily_data_manager.run_processes(mode, args.processes, args.workers, args.dry_run, args.spot)
+        elif args.all:
+            log.info("下载所有A股股票全市场日线数据")
+            a_share_daily_data_manager.download_all(args.workers)
+        elif args.update:
+            log.info("自动更新A股股票全市场日线数据")
+            a_share_daily_data_manager.update_newest(args.symbol, args.workers, args.spot)
+        elif args.check:
+            log.info("检测并自动更新A股股票全市场日线数据")
+            a_share_daily_data_manager.check_update_all(args.workers, args.dry_run)
+        else:
+            log.info("自动更新A股股票全市场日线数据")
+            a_share_daily_data_manager.update_newest(args.symbol, args.workers, args.spot)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(20)
+            log.info("性能剖析结果已写入{}，累计耗时前20：\n{}".format(args.profile, summary.getvalue()))
+        if stop_exporter is not None:
+            stop_exporter.set()
+            metrics.write(args.metrics)
+
+    if akshare_client.cache is not None:
+        log.info("K线缓存统计：{}".format(akshare_client.cache.stats()))
+    log.info("数据源统计：{}，请求超时{}次".format(akshare_client.scheduler.snapshot(), akshare_client.timeouts))
+    snapshot = metrics.snapshot()
+    phases = {item["labels"]["phase"]: round(item["value"], 1)
+              for item in snapshot["counters"] if item["name"] == "sync_phase_seconds_total"}
+    log.info("运行{}秒，{}只股票/秒，各环节耗时(线程合计秒)：{}".format(
+        round(snapshot["elapsed_seconds"]), snapshot["symbols_per_second"], phases))
+    http_stats = http_connection_stats(snapshot)
+    if http_stats:
+        log.info("HTTP连接统计(请求数/新建连接数/复用率)：{}".format(http_stats))
+    if akshare_client.listing is not None:
+        akshare_client.listing.save()
 
     #a_share_daily_data_manager.download_all()
     #a_share_daily_data_manager.update_newest()
     #a_share_daily_data_manager.check_update_all()
-    #auto_update(start_time=time(21, 47))
+    #auto_update()
@@ -13,26 +13,6 @@ set OUTPUT_FILE=%TEMP%\akd_output.tmp
 :: 定义日志文件
 set LOG_FILE=akd.log
 
-:: 函数：从日志文件的结尾部分解析上次处理的股票
-:GET_SECOND_LAST_STOCK_CODE
-set log_file=%1
-setlocal enabledelayedexpansion
-set "last_lines="
-for /f "delims=" %%i in ('type "%log_file%" ^| findstr /r /c:"正在处理股票代码："') do (
-    set "line=%%i"
-    set "line=!line:*正在处理股票代码：=!"
-    set "line=!line:~0,6!"
-    if "!line!" neq "" (
-        set "stock_codes=!stock_codes! !line!"
-    )
-)
-set "stock_codes=%stock_codes: =;%
-set "stock_codes=%stock_codes:;;=;%
-set "stock_codes=%stock_codes:;= !%
-set "stock_codes=%stock_codes:~1%"
-endlocal & set "second_last_stock_code=%stock_codes:~-10,6%"
-goto :eof
-
 :: 函数：清理操作
 :CLEANUP
 echo 脚本被终止，正在清理... >> "%LOG_FILE%"
@@ -89,17 +69,10 @@ if exist "%OUTPUT_FILE%" (
             timeout /t %CHECK_INTERVAL% /nobreak >nul
         )
    
-        :: 获取上次处理的股票代码，如果没有找到，使用默认值
-        call :GET_SECOND_LAST_STOCK_CODE "%LOG_FILE%"
-        if defined second_last_stock_code (
-            echo 重新启动脚本，使用股票代码: %second_last_stock_code% >> "%LOG_FILE%"                
-            start /B python ak_dm.py -s %second_last_stock_code% > "%OUTPUT_FILE%" 2>&1
-            set PID=%errorlevel%
-        ) else (
-            echo 未找到上次股票代码，重新启动脚本... >> "%LOG_FILE%"
-            start /B python ak_dm.py > "%OUTPUT_FILE%" 2>&1
-            set PID=%errorlevel%
-        )
+        :: 断点续传日志(sync_journal.db)记录了每只股票的状态，重启后自动从未完成和失败的股票继续
+        echo 重新启动脚本，从断点续传日志继续... >> "%LOG_FILE%"
+        start /B python ak_dm.py > "%OUTPUT_FILE%" 2>&1
+        set PID=%errorlevel%
     )
 )
 
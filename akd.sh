@@ -12,18 +12,6 @@ OUTPUT_FILE=$(mktemp)
 # 定义日志文件
 LOG_FILE="akd.log"
 
-# 函数：从日志文件的结尾部分解析上次处理的股票
-get_second_last_stock_code() {
-    local log_file="$1"
-    # 使用 tail 命令获取日志文件的最后 100 行（可以根据需要调整行数）
-    local last_lines=$(tail -n 100 "$log_file")
-    # 使用 awk 提取所有“正在处理股票代码”行
-    local stock_codes=($(echo "$last_lines" | awk -F'正在处理股票代码：' '/正在处理股票代码：.* /{print $2}' | awk '{print $1}' | grep -E '^\d{6}$'))
-   
-    local second_last_stock_code="${stock_codes[${#stock_codes[@]}-3]}"
-    echo "$second_last_stock_code"
-}
-
 # 函数：清理操作
 cleanup() {
     echo "脚本被终止，正在清理..." | tee -a "$LOG_FILE"
@@ -73,17 +61,10 @@ while true; do
             kill -9 $PID
             wait $PID
    
-            # 获取上次处理的股票代码，如果没有找到，使用默认值”
-            second_last_stock_code=$(get_second_last_stock_code "$LOG_FILE")
-            if [ -n "$second_last_stock_code" ]; then
-                echo "重新启动脚本，使用股票代码: $second_last_stock_code" | tee -a "$LOG_FILE"                
-                python ak_dm.py -s "$second_last_stock_code" > >(tee "$OUTPUT_FILE" | tee -a "$LOG_FILE") 2>&1 &
-                PID=$!
-            else
-                echo "未找到上次股票代码，重新启动脚本..." | tee -a "$LOG_FILE"
-                python ak_dm.py > >(tee "$OUTPUT_FILE" | tee -a "$LOG_FILE") 2>&1 &
-                PID=$!
-            fi
+            # 断点续传日志(sync_journal.db)记录了每只股票的状态，重启后自动从未完成和失败的股票继续
+            echo "重新启动脚本，从断点续传日志继续..." | tee -a "$LOG_FILE"
+            python ak_dm.py > >(tee "$OUTPUT_FILE" | tee -a "$LOG_FILE") 2>&1 &
+            PID=$!
         fi
     fi
     
@@ -0,0 +1,177 @@
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from vnpy.trader.constant import Exchange, Interval
+from vnpy.trader.database import BaseDatabase, DB_TZ
+from vnpy.trader.object import BarData
+
+from utils import log
+
+# vnpy数据库中K线时间的存储格式(数据库时区，无时区信息)，与peewee DateTimeField写入的字符串一致
+DB_DATETIME_FORMAT: str = "%Y-%m-%d %H:%M:%S"
+
+
+class BarFrame:
+    """
+    单只股票一段K线的列式数据，替代逐根BarData
+    """
+
+    def __init__(self, symbol: str, exchange: Exchange, interval: Interval,
+                 datetimes: pd.DatetimeIndex, values: np.ndarray):
+        """
+        :param datetimes: 带时区的K线时间，升序
+        :param values: n×6浮点数组，列依次为open/high/low/close/volume/turnover，空值已填0
+        """
+        self.symbol: str = symbol
+        self.exchange: Exchange = exchange
+        self.interval: Interval = interval
+        self.datetimes: pd.DatetimeIndex = datetimes
+        self.values: np.ndarray = values
+
+    def __len__(self) -> int:
+        """"""
+        return len(self.datetimes)
+
+    def to_bars(self, gateway_name: str) -> List[BarData]:
+        """
+        转换为BarData列表，供vnpy接口写入和回测使用
+        """
+        arrays = self.values.T.tolist()
+        return [
+            BarData(
+                symbol=self.symbol,
+                exchange=self.exchange,
+                interval=self.interval,
+                datetime=dt,
+                open_price=open_price,
+                high_price=high_price,
+                low_price=low_price,
+                close_price=close_price,
+                volume=volume,
+                turnover=turnover,
+                gateway_name=gateway_name
+            )
+            for dt, open_price, high_price, low_price, close_price, volume, turnover
+            in zip(self.datetimes.to_pydatetime(), *arrays)
+        ]
+
+
+class BarSink(ABC):
+    """
+    列式K线批量读写接口，按数据库后端实现
+    一次写入多只股票的BarFrame并在同一事务中更新K线汇总，失败时整批回滚并抛出异常
+    """
+
+    @abstractmethod
+    def save(self, frames: List[BarFrame]):
+        """"""
+        pass
+
+    @abstractmethod
+    def load(self, symbol: str, exchange: Exchange, interval: Interval,
+             start: Optional[datetime] = None) -> BarFrame:
+        """
+        列式读取一只股票的K线，不构造BarData
+        :param start: 数据库时区的无时区时间(同BarOverview)，为None时读取全部
+        """
+        pass
+
+    def close(self):
+        """"""
+        pass
+
+
+class SqliteBarSink(BarSink):
+    """
+    vnpy_sqlite数据库文件的列式写入
+    沿用vnpy的dbbardata/dbbaroverview表结构，K线用executemany批量INSERT OR REPLACE(与save_bar_data的覆盖语义一致)，
+    汇总按写入后的实际数据重新统计，与K线在同一事务中提交
+    使用独立连接，与vnpy的peewee连接读写同一文件，调用方负责串行化本进程内的写入
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: vnpy_sqlite数据库文件
+        """
+        self.path: str = path
+        self.lock: threading.Lock = threading.Lock()
+        # 多进程同时写同一文件时等待写锁而不是立即报错
+        self.conn: sqlite3.Connection = sqlite3.connect(path, timeout=60.0, check_same_thread=False,
+                                                        isolation_level=None)
+
+    def save(self, frames: List[BarFrame]):
+        """
+        在一个事务中写入全部K线并更新各股票的K线汇总
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for frame in frames:
+                    if len(frame):
+                        self._save_frame(frame)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _save_frame(self, frame: BarFrame):
+        """"""
+        exchange = frame.exchange.value
+        interval = frame.interval.value
+        datetimes = frame.datetimes.tz_convert(DB_TZ).strftime(DB_DATETIME_FORMAT)
+        values = frame.values.T.tolist()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO dbbardata (symbol, exchange, datetime, interval, "
+            "open_price, high_price, low_price, close_price, volume, turnover, open_interest) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+            zip([frame.symbol] * len(frame), [exchange] * len(frame), datetimes, [interval] * len(frame), *values)
+        )
+        # 唯一索引覆盖(symbol, exchange, interval, datetime)，统计只扫描该股票的索引区间
+        count, start, end = self.conn.execute(
+            "SELECT COUNT(*), MIN(datetime), MAX(datetime) FROM dbbardata "
+            "WHERE symbol=? AND exchange=? AND interval=?",
+            (frame.symbol, exchange, interval)
+        ).fetchone()
+        self.conn.execute(
+            "INSERT INTO dbbaroverview (symbol, exchange, interval, count, start, end) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (symbol, exchange, interval) DO UPDATE SET "
+            "count=excluded.count, start=excluded.start, end=excluded.end",
+            (frame.symbol, exchange, interval, count, start, end)
+        )
+
+    def load(self, symbol: str, exchange: Exchange, interval: Interval,
+             start: Optional[datetime] = None) -> BarFrame:
+        """"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT datetime, open_price, high_price, low_price, close_price, volume, turnover FROM dbbardata "
+                "WHERE symbol=? AND exchange=? AND interval=? AND datetime>=? ORDER BY datetime",
+                (symbol, exchange.value, interval.value, start.strftime(DB_DATETIME_FORMAT) if start else "")
+            ).fetchall()
+        if not rows:
+            return BarFrame(symbol, exchange, interval, pd.DatetimeIndex([], tz=DB_TZ), np.empty((0, 6)))
+        columns = list(zip(*rows))
+        datetimes = pd.DatetimeIndex(pd.to_datetime(columns[0], format="ISO8601")).tz_localize(DB_TZ)
+        return BarFrame(symbol, exchange, interval, datetimes, np.array(columns[1:], dtype=float).T)
+
+    def close(self):
+        """"""
+        with self.lock:
+            self.conn.close()
+
+
+def create_bar_sink(database: BaseDatabase) -> Optional[BarSink]:
+    """
+    按vnpy数据库实例选择列式写入实现，不支持的后端返回None，由调用方退回save_bar_data
+    """
+    module = type(database).__module__
+    if module.startswith("vnpy_sqlite"):
+        return SqliteBarSink(database.db.database)
+    log.war("数据库{}暂不支持列式批量读写，使用vnpy数据库接口逐根读写".format(module))
+    return None
@@ -0,0 +1,90 @@
+"""
+DataFrame→BarData转换微基准：对比旧版iterrows逐行转换与AKShareClient.df_to_bars向量化转换
+用法: python bench_convert.py [-n 行数] [-r 重复次数]
+"""
+import argparse
+import timeit
+from datetime import datetime
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from vnpy.trader.constant import Exchange, Interval
+from vnpy.trader.object import BarData
+
+from AKShare import AKShareClient, CHINA_TZ
+
+
+def make_kline_df(rows: int, nan_rows: int = 3) -> pd.DataFrame:
+    """
+    生成与_fetch_kline_*输出一致的标准化日K线df
+    """
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range("1991-01-02", periods=rows).strftime("%Y-%m-%d")
+    close = 10 + rng.standard_normal(rows).cumsum() * 0.1
+    df = pd.DataFrame({
+        'trade_date': dates,
+        'open': close + 0.05,
+        'high': close + 0.2,
+        'low': close - 0.2,
+        'close': close,
+        'volumn': rng.integers(1e5, 1e7, rows).astype(float),
+        'turnover': rng.random(rows) * 1e8,
+    })
+    if nan_rows:
+        df.loc[df.index[:nan_rows], 'open'] = np.nan
+    return df
+
+
+def legacy_convert(df: pd.DataFrame, symbol: str, exchange: Exchange, interval: Interval) -> List[BarData]:
+    """
+    旧版query_history中的逐行转换(不含日志)，仅作基准对照
+    """
+    data: List[BarData] = []
+    for ix, row in df.iterrows():
+        date = datetime.strptime(str(row.trade_date), '%Y-%m-%d')
+        date = CHINA_TZ.localize(date)
+
+        for column in ['open', 'high', 'low', 'close', 'volumn']:
+            if pd.isnull(row[column]):
+                break
+
+        row.fillna(0)
+        bar = BarData(
+            symbol=symbol,
+            exchange=exchange,
+            interval=interval,
+            datetime=date,
+            open_price=row['open'],
+            high_price=row['high'],
+            low_price=row['low'],
+            close_price=row['close'],
+            volume=row['volumn'],
+            turnover=row['turnover'],
+            gateway_name='akshare'
+        )
+        data.append(bar)
+    return data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--rows", type=int, default=8000, help="单只股票K线条数")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="重复次数")
+    args = parser.parse_args()
+
+    df = make_kline_df(args.rows)
+    client = AKShareClient()
+    params = ('600600', Exchange.SSE, Interval.DAILY)
+
+    legacy_bars = legacy_convert(df, *params)
+    vector_bars = client.df_to_bars(df, *params)
+    assert len(legacy_bars) == len(vector_bars)
+    assert legacy_bars[-1].datetime == vector_bars[-1].datetime
+    assert legacy_bars[-1].close_price == vector_bars[-1].close_price
+
+    legacy = min(timeit.repeat(lambda: legacy_convert(df, *params), number=1, repeat=args.repeat))
+    vector = min(timeit.repeat(lambda: client.df_to_bars(df, *params), number=1, repeat=args.repeat))
+    print("rows={} iterrows: {:.1f}ms  vectorized: {:.1f}ms  speedup: {:.1f}x".format(
+        args.rows, legacy * 1000, vector * 1000, legacy / vector))
@@ -0,0 +1,663 @@
+"""
+离线同步基准：用假akshare模块替换AKShareClient.pro，用内存数据库替换vnpy数据库，不访问任何网络
+假akshare为每个数据源返回录制或合成的日K线，可注入请求延迟、网络异常和挂起(超过--timeout时触发超时处理)
+依次运行全市场下载、每日增量更新、缺口检查三个场景(--journal时在增量更新前先运行一次数据源全部不可用的更新，检查重新运行能续传失败的股票；--panel时结束后导出日线面板，检查按YYYYMMDD日期区间加载有数据)，输出股票/秒、K线/秒、峰值内存(RSS)与单只股票耗时p50/p99
+用法: python bench_sync.py [-n 股票数] [-w 线程数] [--latency 毫秒] [--error-rate 比例] [--hang-rate 比例] [--json 结果文件]
+录制: python bench_sync.py --record 目录 -n 股票数  (需联网，用真实akshare保存标准化K线，之后以 --recorded 目录 离线回放)
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from vnpy.trader.constant import Exchange, Interval
+from vnpy.trader.database import BaseDatabase, BarOverview, DB_TZ, convert_tz
+from vnpy.trader.object import BarData, HistoryRequest
+
+from utils import log
+from AKShare import AKShareClient, MARKET_START_DATE, SOURCE_RATE_LIMITS, TS_DATE_FORMATE, to_vnpy_codes
+from ak_dm import AShareDailyDataManager, to_china_date
+from journal import STATUS_RUNNING
+from panel import DailyPanel
+from kline_cache import KLINE_COLUMNS
+from metrics import metrics
+from ratelimit import TokenBucket
+
+# 注入异常/挂起的K线接口，按数据源简称
+SOURCE_FUNCTIONS: Dict[str, str] = {
+    "em": "stock_zh_a_hist",
+    "sina": "stock_zh_a_daily",
+    "tx": "stock_zh_a_hist_tx",
+}
+
+# 内存数据库每根K线保存的数值列
+BAR_FIELDS: List[str] = ["open_price", "high_price", "low_price", "close_price", "volume", "turnover",
+                         "open_interest"]
+
+
+class FakeAkshare:
+    """
+    假akshare模块：K线、股票列表、交易日历、上市日期、行情快照和后复权因子接口，返回与akshare相同的列
+    合成K线按(股票代码, 交易日)确定性生成，同一天重复请求结果相同；录制K线按日期区间截取
+    只返回不晚于last_day的K线，用于模拟新交易日的数据发布
+    """
+
+    def __init__(self, symbols: List[str], trade_days: np.ndarray, listing: Dict[str, date],
+                 recorded: Optional[Dict[str, pd.DataFrame]] = None, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, hang_rate: float = 0.0, hang_seconds: float = 60.0,
+                 down: Tuple[str, ...] = (), seed: int = 0):
+        """
+        :param symbols: 6位股票代码
+        :param trade_days: 完整交易日历(含今天之后)，datetime64[D]升序
+        :param listing: 各股票上市日期
+        :param recorded: 录制的标准化K线{股票代码: df}，为None时合成
+        :param latency: 每次请求的基础延迟(秒)
+        :param jitter: 延迟随机波动比例，实际延迟在latency×(1±jitter)之间
+        :param error_rate: K线与因子请求抛出网络异常的概率
+        :param hang_rate: K线与因子请求挂起hang_seconds秒后才返回的概率
+        :param down: 始终失败的数据源简称(em/sina/tx)
+        """
+        self.symbols: List[str] = symbols
+        self.trade_days: np.ndarray = trade_days
+        self.listing: Dict[str, date] = listing
+        self.recorded: Optional[Dict[str, pd.DataFrame]] = recorded
+        self.latency: float = latency
+        self.jitter: float = jitter
+        self.error_rate: float = error_rate
+        self.hang_rate: float = hang_rate
+        self.hang_seconds: float = hang_seconds
+        self.down: Tuple[str, ...] = tuple(SOURCE_FUNCTIONS[name] for name in down)
+        self.last_day: date = trade_days[-1].astype(date)
+
+        self.calls: Dict[str, int] = {}
+        self.rng: random.Random = random.Random(seed)
+        self.lock: threading.Lock = threading.Lock()
+
+    def _network(self, name: str, faults: bool = True):
+        """
+        模拟一次网络请求：计数、延迟，以及按概率注入的挂起和异常
+        :param faults: 是否注入异常与挂起，全市场接口只模拟延迟，避免初始化反复失败
+        """
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            delay = self.latency * (1 + self.jitter * (2 * self.rng.random() - 1))
+            hang = faults and self.rng.random() < self.hang_rate
+            error = faults and self.rng.random() < self.error_rate
+        time.sleep(self.hang_seconds if hang else max(delay, 0.0))
+        if faults and name in self.down:
+            raise ConnectionError("{}：数据源不可用(基准注入)".format(name))
+        if error:
+            raise ConnectionError("{}：网络异常(基准注入)".format(name))
+
+    def _kline(self, symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
+        """
+        标准化日K线(列同KLINE_COLUMNS)，只含上市日期之后且不晚于last_day的交易日
+        """
+        start = max(pd.Timestamp(start_date).date(), self.listing.get(symbol, MARKET_START_DATE))
+        end = min(pd.Timestamp(end_date).date(), self.last_day)
+        if self.recorded is not None:
+            df = self.recorded.get(symbol)
+            if df is None:
+                return pd.DataFrame(columns=KLINE_COLUMNS)
+            mask = (df['trade_date'] >= start.strftime("%Y-%m-%d")) & (df['trade_date'] <= end.strftime("%Y-%m-%d"))
+            return df[mask].reset_index(drop=True)
+
+        first = np.searchsorted(self.trade_days, np.datetime64(start, 'D'))
+        last = np.searchsorted(self.trade_days, np.datetime64(end, 'D'), side="right")
+        days = self.trade_days[first:last]
+        # 价格为交易日的确定性函数：基准价按代码分散，叠加周期波动
+        seed = zlib.crc32(symbol.encode())
+        base = 5.0 + seed % 5000 / 100
+        t = days.astype(np.int64).astype(float)
+        close = np.round(base * (1 + 0.3 * np.sin(t / 60 + seed % 628 / 100)), 2)
+        volume = np.round(1e4 * (2 + np.cos(t / 7 + seed % 314 / 100))) * 100
+        return pd.DataFrame({
+            'trade_date': pd.DatetimeIndex(days).strftime("%Y-%m-%d"),
+            'open': np.round(close * 0.99, 2),
+            'high': np.round(close * 1.02, 2),
+            'low': np.round(close * 0.97, 2),
+            'close': close,
+            'volumn': volume,
+            'turnover': np.round(close * volume, 2),
+        })
+
+    def stock_zh_a_hist(self, symbol: str, period: str = "daily", start_date: str = "19700101",
+                        end_date: str = "20500101", adjust: str = "") -> pd.DataFrame:
+        """
+        东方财富日K线，成交量单位为手
+        """
+        self._network("stock_zh_a_hist")
+        df = self._kline(symbol, start_date, end_date)
+        return pd.DataFrame({
+            '日期': df['trade_date'], '开盘': df['open'], '收盘': df['close'], '最高': df['high'],
+            '最低': df['low'], '成交量': df['volumn'] / 100, '成交额': df['turnover'],
+        })
+
+    def _sina_like(self, name: str, symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
+        """
+        新浪/腾讯日K线，日期为date对象，另含换手率turnover列
+        """
+        self._network(name)
+        df = self._kline(symbol[2:], start_date, end_date)
+        return pd.DataFrame({
+            'date': pd.to_datetime(df['trade_date']).dt.date, 'open': df['open'], 'high': df['high'],
+            'low': df['low'], 'close': df['close'], 'volume': df['volumn'], 'amount': df['turnover'],
+            'turnover': np.full(len(df), 0.01),
+        })
+
+    def stock_zh_a_daily(self, symbol: str, start_date: str = "19900101", end_date: str = "21000118",
+                         adjust: str = "") -> pd.DataFrame:
+        """
+        新浪日K线；adjust为hfq-factor时返回后复权因子表，约三分之一股票无除权除息
+        """
+        if adjust != "hfq-factor":
+            return self._sina_like("stock_zh_a_daily", symbol, start_date, end_date)
+        self._network("stock_zh_a_daily")
+        seed = zlib.crc32(symbol[2:].encode())
+        if seed % 3 == 0:
+            raise ValueError("无除权除息数据")
+        listed = self.listing.get(symbol[2:], MARKET_START_DATE)
+        event = listed + (self.last_day - listed) / 2
+        return pd.DataFrame({'date': [event.isoformat(), listed.isoformat()],
+                             'hfq_factor': [str(1.0 + seed % 50 / 100), "1.0"]})
+
+    def stock_zh_a_hist_tx(self, symbol: str, start_date: str = "19000101", end_date: str = "20500101",
+                           adjust: str = "") -> pd.DataFrame:
+        """
+        腾讯日K线，sz000开头的代码成交量单位为手
+        """
+        df = self._sina_like("stock_zh_a_hist_tx", symbol, start_date, end_date)
+        if symbol.startswith("sz000"):
+            df['volume'] = df['volume'] / 100
+        return df
+
+    def _spot(self) -> pd.DataFrame:
+        """
+        last_day的全市场行情快照，当天无K线(停牌)的股票价格为空
+        """
+        day = self.last_day.strftime("%Y%m%d")
+        frames = [self._kline(symbol, day, day) for symbol in self.symbols]
+        df = pd.DataFrame([frame.iloc[0] if len(frame) else pd.Series(index=KLINE_COLUMNS, dtype=float)
+                           for frame in frames], columns=KLINE_COLUMNS).assign(代码=self.symbols)
+        return pd.DataFrame({
+            '代码': df['代码'], '名称': df['代码'], '最新价': df['close'], '今开': df['open'], '最高': df['high'],
+            '最低': df['low'], '成交量': df['volumn'], '成交额': df['turnover'],
+        })
+
+    def stock_zh_a_spot_em(self) -> pd.DataFrame:
+        """
+        东方财富全市场行情快照(兼作股票列表)，成交量单位为手
+        """
+        self._network("stock_zh_a_spot_em", faults=False)
+        df = self._spot()
+        df['成交量'] = df['成交量'] / 100
+        return df
+
+    def stock_zh_a_spot(self) -> pd.DataFrame:
+        """
+        新浪全市场行情快照，代码带交易所前缀
+        """
+        self._network("stock_zh_a_spot", faults=False)
+        df = self._spot()
+        df['代码'] = [("sh" if symbol.startswith("6") else "sz") + symbol for symbol in df['代码']]
+        return df
+
+    def stock_info_a_code_name(self) -> pd.DataFrame:
+        """"""
+        self._network("stock_info_a_code_name", faults=False)
+        return pd.DataFrame({'code': self.symbols, 'name': self.symbols})
+
+    def tool_trade_date_hist_sina(self) -> pd.DataFrame:
+        """"""
+        self._network("tool_trade_date_hist_sina", faults=False)
+        return pd.DataFrame({'trade_date': self.trade_days.astype(date)})
+
+    def stock_info_sh_name_code(self, symbol: str = "主板A股") -> pd.DataFrame:
+        """"""
+        self._network("stock_info_sh_name_code", faults=False)
+        prefix = ("688",) if symbol == "科创板" else ("600", "601", "603", "605")
+        codes = [code for code in self.symbols if code.startswith(prefix)]
+        return pd.DataFrame({'证券代码': codes, '上市日期': [self.listing[code] for code in codes]})
+
+    def stock_info_sz_name_code(self, symbol: str = "A股列表") -> pd.DataFrame:
+        """"""
+        self._network("stock_info_sz_name_code", faults=False)
+        codes = [code for code in self.symbols if code.startswith(("00", "30"))]
+        return pd.DataFrame({'A股代码': codes, 'A股上市日期': [self.listing[code] for code in codes]})
+
+
+class MemoryDatabase(BaseDatabase):
+    """
+    内存K线数据库，接口与vnpy数据库一致(时间按数据库时区保存为无时区时间，同一时间覆盖写入)
+    每只股票按列保存为numpy数组，数据库本身的内存占用远小于逐根BarData，不干扰峰值内存测量
+    """
+
+    def __init__(self):
+        """"""
+        self.bars: Dict[Tuple[str, Exchange, Interval], Tuple[np.ndarray, np.ndarray]] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def save_bar_data(self, bars: List[BarData], stream: bool = False) -> bool:
+        """"""
+        groups: Dict[Tuple[str, Exchange, Interval], List[BarData]] = {}
+        for bar in bars:
+            groups.setdefault((bar.symbol, bar.exchange, bar.interval), []).append(bar)
+
+        with self.lock:
+            for key, group in groups.items():
+                times = np.array([convert_tz(bar.datetime) for bar in group], dtype="datetime64[ns]")
+                values = np.array([[getattr(bar, field) for field in BAR_FIELDS] for bar in group], dtype=float)
+                old = self.bars.get(key)
+                if old is not None:
+                    times = np.concatenate([old[0], times])
+                    values = np.concatenate([old[1], values])
+                # 稳定排序后同一时间保留最后写入的一根
+                order = np.argsort(times, kind="stable")
+                times, values = times[order], values[order]
+                keep = np.append(times[1:] != times[:-1], True)
+                self.bars[key] = (times[keep], values[keep])
+        return True
+
+    def save_tick_data(self, ticks: list, stream: bool = False) -> bool:
+        """"""
+        return False
+
+    def load_bar_data(self, symbol: str, exchange: Exchange, interval: Interval,
+                      start: datetime, end: datetime) -> List[BarData]:
+        """"""
+        with self.lock:
+            stored = self.bars.get((symbol, exchange, interval))
+        if stored is None:
+            return []
+        times, values = stored
+        mask = (times >= np.datetime64(convert_tz(start), "ns")) & (times <= np.datetime64(convert_tz(end), "ns"))
+        datetimes = pd.DatetimeIndex(times[mask]).tz_localize(DB_TZ).to_pydatetime()
+        return [
+            BarData(symbol=symbol, exchange=exchange, interval=interval, datetime=dt, gateway_name="DB",
+                    **dict(zip(BAR_FIELDS, row)))
+            for dt, row in zip(datetimes, values[mask].tolist())
+        ]
+
+    def load_tick_data(self, symbol: str, exchange: Exchange, start: datetime, end: datetime) -> list:
+        """"""
+        return []
+
+    def delete_bar_data(self, symbol: str, exchange: Exchange, interval: Interval) -> int:
+        """"""
+        with self.lock:
+            stored = self.bars.pop((symbol, exchange, interval), None)
+        return 0 if stored is None else len(stored[0])
+
+    def delete_tick_data(self, symbol: str, exchange: Exchange) -> int:
+        """"""
+        return 0
+
+    def get_bar_overview(self) -> List[BarOverview]:
+        """"""
+        with self.lock:
+            items = list(self.bars.items())
+        return [
+            BarOverview(symbol=symbol, exchange=exchange, interval=interval, count=len(times),
+                        start=pd.Timestamp(times[0]).to_pydatetime(), end=pd.Timestamp(times[-1]).to_pydatetime())
+            for (symbol, exchange, interval), (times, _) in items if len(times)
+        ]
+
+    def get_tick_overview(self) -> list:
+        """"""
+        return []
+
+    def nbytes(self) -> int:
+        """"""
+        with self.lock:
+            return sum(times.nbytes + values.nbytes for times, values in self.bars.values())
+
+
+class BenchManager(AShareDailyDataManager):
+    """
+    记录单只股票耗时的数据管理器：从登记为处理中到登记完成或失败，线程池与流水线执行方式均适用
+    """
+
+    def __init__(self, client: AKShareClient, database: BaseDatabase):
+        """"""
+        super().__init__(client, database)
+        self.started: Dict[str, float] = {}
+        self.latencies: List[float] = []
+        self.latency_lock: threading.Lock = threading.Lock()
+        self.show_progress: bool = False
+
+    def _progress_bar(self, total: int, initial: int) -> tqdm:
+        """"""
+        return tqdm(total=total, initial=initial, disable=not self.show_progress)
+
+    def _record(self, tscode: str, status: str, start: datetime = None, end: datetime = None,
+                bar_count: int = 0, error: str = ""):
+        """"""
+        super()._record(tscode, status, start, end, bar_count, error)
+        now = time.perf_counter()
+        with self.latency_lock:
+            if status == STATUS_RUNNING:
+                self.started[tscode] = now
+                return
+            begin = self.started.pop(tscode, None)
+            if begin is not None:
+                self.latencies.append(now - begin)
+
+
+class RssSampler:
+    """
+    后台线程定期读取/proc/self/statm记录峰值常驻内存；无/proc时退回进程启动以来的ru_maxrss
+    """
+
+    def __init__(self, interval: float = 0.02):
+        """"""
+        self.interval: float = interval
+        self.peak: int = 0
+        self.stop_event: threading.Event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.page_size: int = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def _rss(self) -> Optional[int]:
+        """"""
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self.page_size
+        except OSError:
+            return None
+
+    def _run(self):
+        """"""
+        while True:
+            rss = self._rss()
+            if rss is None:
+                return
+            self.peak = max(self.peak, rss)
+            if self.stop_event.wait(self.interval):
+                return
+
+    def __enter__(self) -> "RssSampler":
+        """"""
+        self.thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        """"""
+        self.stop_event.set()
+        self.thread.join()
+        if not self.peak:
+            # Linux下ru_maxrss单位为KB
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def make_universe(count: int, trade_days: np.ndarray, seed: int = 0) -> Tuple[List[str], Dict[str, date]]:
+    """
+    合成沪深A股代码与上市日期，上市日期在交易日历前90%范围内均匀分布，K线条数因股而异
+    """
+    rng = random.Random(seed)
+    prefixes = ["600", "601", "603", "000", "002", "300", "688"]
+    symbols: List[str] = []
+    seen = set()
+    while len(symbols) < count:
+        symbol = rng.choice(prefixes) + "{:03d}".format(rng.randrange(1000))
+        if symbol not in seen:
+            seen.add(symbol)
+            symbols.append(symbol)
+    symbols.sort()
+    last = int(len(trade_days) * 0.9)
+    listing = {symbol: trade_days[rng.randrange(last)].astype(date) for symbol in symbols}
+    return symbols, listing
+
+
+def load_recorded(path: str, count: int) -> Dict[str, pd.DataFrame]:
+    """
+    读取录制的标准化K线(每只股票一个<代码>.pkl或<代码>.csv文件，列同KLINE_COLUMNS)
+    """
+    recorded: Dict[str, pd.DataFrame] = {}
+    for name in sorted(os.listdir(path)):
+        symbol, ext = os.path.splitext(name)
+        if ext not in (".pkl", ".csv") or len(recorded) >= count:
+            continue
+        file_path = os.path.join(path, name)
+        df = pd.read_pickle(file_path) if ext == ".pkl" else pd.read_csv(file_path, dtype={'trade_date': str})
+        df['trade_date'] = pd.to_datetime(df['trade_date'].astype(str)).dt.strftime("%Y-%m-%d")
+        recorded[symbol] = df[KLINE_COLUMNS].sort_values('trade_date').reset_index(drop=True)
+    return recorded
+
+
+def record(path: str, count: int):
+    """
+    用真实akshare查询前count只股票的全部日线，按标准化df保存为pkl供离线回放(需联网)
+    """
+    os.makedirs(path, exist_ok=True)
+    client = AKShareClient()
+    if not client.init():
+        raise RuntimeError("AKShare数据源初始化失败，无法录制")
+    for symbol in client.symbols['symbol'].astype(str).tolist()[:count]:
+        vt_symbol, exchange = to_vnpy_codes(symbol)
+        req = HistoryRequest(symbol=vt_symbol, exchange=exchange, interval=Interval.DAILY,
+                             start=datetime.combine(MARKET_START_DATE, datetime.min.time()), end=datetime.now())
+        df = client.query_history_df(req)
+        if df is None:
+            log.war("{}录制失败，跳过".format(symbol))
+            continue
+        df.to_pickle(os.path.join(path, symbol + ".pkl"))
+        log.info("{}已录制{}根K线".format(symbol, len(df)))
+
+
+def create_database(kind: str, path: str) -> BaseDatabase:
+    """
+    :param kind: memory为内存数据库；sqlite为临时目录中的vnpy_sqlite文件，可配合--bulk测量列式写入
+    """
+    if kind == "memory":
+        return MemoryDatabase()
+    from vnpy_sqlite.sqlite_database import SqliteDatabase, db
+    db.init(os.path.join(path, "database.db"))
+    return SqliteDatabase()
+
+
+def punch_gaps(manager: AShareDailyDataManager, ratio: float, days: int, seed: int = 0) -> int:
+    """
+    在部分股票本地数据中间删除连续若干个交易日的K线，供缺口检查场景补全；内存中的K线汇总保持不变
+    :return: 删除的K线数
+    """
+    rng = random.Random(seed)
+    database = manager.database
+    removed = 0
+    for overview in list(manager.bar_overviews):
+        if overview.count <= days + 2 or rng.random() >= ratio:
+            continue
+        bars = database.load_bar_data(overview.symbol, overview.exchange, overview.interval,
+                                      overview.start, overview.end)
+        begin = rng.randrange(1, len(bars) - days - 1)
+        database.delete_bar_data(overview.symbol, overview.exchange, overview.interval)
+        database.save_bar_data(bars[:begin] + bars[begin + days:])
+        removed += days
+    return removed
+
+
+def run_scenario(name: str, manager: BenchManager, fake: FakeAkshare, func: Callable[[], None]) -> Dict:
+    """
+    运行一个场景并汇总吞吐、峰值内存与单只股票耗时分位数
+    """
+    metrics.reset()
+    manager.latencies = []
+    calls = sum(fake.calls.values())
+    failures = len(manager.permanent_failures)
+
+    with RssSampler() as sampler:
+        begin = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - begin
+
+    counters = {item["name"]: item["value"] for item in metrics.snapshot()["counters"] if not item["labels"]}
+    symbols = int(counters.get("sync_symbols_total", 0))
+    bars = int(counters.get("sync_bars_saved_total", 0))
+    latencies = np.array(manager.latencies) * 1000
+    return {
+        "scenario": name,
+        "seconds": round(elapsed, 3),
+        "symbols": symbols,
+        "symbols_per_second": round(symbols / elapsed, 1) if elapsed > 0 else 0.0,
+        "bars": bars,
+        "bars_per_second": round(bars / elapsed, 1) if elapsed > 0 else 0.0,
+        "requests": sum(fake.calls.values()) - calls,
+        "failures": len(manager.permanent_failures) - failures,
+        "peak_rss_mb": round(sampler.peak / 1024 ** 2, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2) if latencies.size else None,
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2) if latencies.size else None,
+    }
+
+
+def main(args: argparse.Namespace) -> List[Dict]:
+    """"""
+    trade_days = pd.bdate_range(MARKET_START_DATE, date.today() + timedelta(days=60)).values.astype("datetime64[D]")
+    recorded = None
+    if args.recorded:
+        recorded = load_recorded(args.recorded, args.symbols)
+        if not recorded:
+            raise RuntimeError("{}中没有录制的K线文件".format(args.recorded))
+        symbols = list(recorded)
+        listing = {symbol: date.fromisoformat(df['trade_date'].iloc[0]) if len(df) else date.today()
+                   for symbol, df in recorded.items()}
+        # 录制数据覆盖的区间使用真实交易日，之后补工作日
+        recorded_days = np.unique(np.concatenate([df['trade_date'].to_numpy(dtype="datetime64[D]")
+                                                  for df in recorded.values()]))
+        trade_days = np.concatenate([recorded_days, trade_days[trade_days > recorded_days[-1]]])
+    else:
+        symbols, listing = make_universe(args.symbols, trade_days, args.seed)
+
+    fake = FakeAkshare(symbols, trade_days, listing, recorded, latency=args.latency / 1000, jitter=args.jitter,
+                       error_rate=args.error_rate, hang_rate=args.hang_rate, hang_seconds=args.hang_seconds,
+                       down=tuple(args.down), seed=args.seed)
+    client = AKShareClient()
+    client.pro = fake
+    if args.hedge:
+        client.enable_hedge(args.workers)
+    client.timeout = args.timeout
+    if not args.rate_limit:
+        # 默认不限流，测量的是本地处理能力而不是数据源限额
+        client.limiters = {source_name: TokenBucket(1e9, 1e9) for source_name in SOURCE_RATE_LIMITS}
+
+    workdir = tempfile.mkdtemp(prefix="bench_sync_")
+    try:
+        manager = BenchManager(client, create_database(args.db, workdir))
+        manager.use_pipeline = args.pipeline
+        manager.bulk_write = args.bulk
+        manager.retry_delay = args.retry_delay
+        manager.show_progress = args.verbose
+        if args.journal:
+            manager.enable_journal(os.path.join(workdir, "sync_journal.db"), fresh=True)
+
+        begin = time.perf_counter()
+        manager.init()
+        log.info("基准初始化{}只股票耗时{:.2f}秒".format(len(symbols), time.perf_counter() - begin))
+
+        # 下载截至上一交易日的数据，增量更新场景再发布最近一个交易日
+        published_day = manager.last_published_day()
+        fake.last_day = client.prev_trade_day(published_day)
+        results = [run_scenario("backfill", manager, fake, lambda: manager.download_all(args.workers))]
+        fake.last_day = published_day
+        failed: List[str] = []
+        if args.journal:
+            # 断点续传检查：数据源全部不可用时的一次更新失败后，恢复数据源重新运行须重新抓取全部失败的股票
+            down, retry_delay = fake.down, manager.retry_delay
+            fake.down, manager.retry_delay = tuple(SOURCE_FUNCTIONS.values()), 0.01
+            results.append(run_scenario("outage", manager, fake,
+                                        lambda: manager.update_newest(workers=args.workers)))
+            fake.down, manager.retry_delay = down, retry_delay
+            failed = list(manager.permanent_failures)
+            # 与不带--fresh重新启动相同：续传失败任务而不是新建
+            manager.permanent_failures, manager.fresh = {}, False
+        results.append(run_scenario("update", manager, fake, lambda: manager.update_newest(workers=args.workers)))
+        if failed:
+            stale = [symbol for symbol in failed
+                     if to_china_date(manager.get_overview(*to_vnpy_codes(symbol), Interval.DAILY).end) < published_day]
+            if stale:
+                raise RuntimeError("断点续传检查失败：{}/{}只失败股票重新运行后仍未更新：{}".format(
+                    len(stale), len(failed), ",".join(stale[:10])))
+            log.info("断点续传检查通过：{}只失败股票重新运行后均已更新".format(len(failed)))
+        removed = punch_gaps(manager, args.gap_ratio, args.gap_days, args.seed)
+        log.info("缺口检查场景：删除{}根K线".format(removed))
+        results.append(run_scenario("check", manager, fake, lambda: manager.check_update_all(args.workers)))
+
+        if args.panel:
+            # 面板检查：导出后按README示例的YYYYMMDD字符串加载日期区间
+            manager.panel_path = os.path.join(workdir, ".panel")
+            manager.export_panel()
+            start = (published_day - timedelta(days=365)).strftime(TS_DATE_FORMATE)
+            dates, panel_symbols, fields = DailyPanel(manager.panel_path).load(
+                start, published_day.strftime(TS_DATE_FORMATE), fields=["close", "volume"])
+            if not len(dates) or not np.isfinite(fields["close"]).any():
+                raise RuntimeError("日线面板检查失败：{}~{}加载结果为空".format(start, published_day))
+            log.info("日线面板检查通过：加载{}个交易日×{}只股票".format(len(dates), len(panel_symbols)))
+
+        if isinstance(manager.database, MemoryDatabase):
+            log.info("内存数据库占用{:.1f}MB".format(manager.database.nbytes() / 1024 ** 2))
+        log.info("假akshare请求次数：{}".format(fake.calls))
+        if manager.bar_sink is not None:
+            manager.bar_sink.close()
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--symbols", type=int, default=500, help="股票数量，默认500")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="并发线程数，默认4")
+    parser.add_argument("--latency", type=float, default=0.0, help="每次请求的模拟延迟(毫秒)，默认0")
+    parser.add_argument("--jitter", type=float, default=0.5, help="延迟随机波动比例，默认0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="K线请求抛出网络异常的概率")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="K线请求挂起的概率，挂起超过--timeout时按超时处理")
+    parser.add_argument("--hang-seconds", type=float, default=5.0, help="挂起时长(秒)，默认5")
+    parser.add_argument("--down", type=str, nargs="+", choices=list(SOURCE_FUNCTIONS), default=[],
+                        help="始终失败的数据源，如--down em模拟东方财富被封禁")
+    parser.add_argument("--timeout", type=float, default=30.0, help="单次K线请求超时秒数，默认30")
+    parser.add_argument("--retry-delay", type=float, default=5.0, help="失败股票首次重试的基础延迟(秒)，默认5")
+    parser.add_argument("--rate-limit", help="保留各数据源的真实限流参数", action="store_true")
+    parser.add_argument("--hedge", help="开启对冲请求", action="store_true")
+    parser.add_argument("--pipeline", help="以抓取→转换→写入流水线执行下载/更新", action="store_true")
+    parser.add_argument("--bulk", help="列式批量写入(需--db sqlite)", action="store_true")
+    parser.add_argument("--journal", help="记录断点续传日志(临时文件)", action="store_true")
+    parser.add_argument("--panel", help="结束后导出日线面板(临时目录)并检查按日期区间加载", action="store_true")
+    parser.add_argument("--db", type=str, choices=["memory", "sqlite"], default="memory",
+                        help="数据库：memory内存数据库(默认)，sqlite临时vnpy_sqlite文件")
+    parser.add_argument("--gap-ratio", type=float, default=0.2, help="缺口检查场景中删除K线的股票比例，默认0.2")
+    parser.add_argument("--gap-days", type=int, default=5, help="每只股票删除的连续交易日数，默认5")
+    parser.add_argument("--recorded", type=str, help="回放录制的K线目录(<代码>.pkl或.csv)，不指定时合成K线")
+    parser.add_argument("--record", type=str, help="用真实akshare录制K线到该目录后退出(需联网)")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--json", type=str, help="结果另存为JSON文件，便于对比前后两次运行")
+    parser.add_argument("-v", "--verbose", help="在控制台输出同步日志与进度条(默认日志只写入log.txt)", action="store_true")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.symbols)
+        raise SystemExit(0)
+    if not args.verbose:
+        for handler in log.handlers:
+            if type(handler) is logging.StreamHandler:
+                handler.setLevel(logging.WARNING)
+
+    results = main(args)
+    columns = ["scenario", "seconds", "symbols", "symbols_per_second", "bars", "bars_per_second", "requests",
+               "failures", "peak_rss_mb", "p50_ms", "p99_ms"]
+    print(" ".join("{:>18}".format(column) for column in columns))
+    for result in results:
+        print(" ".join("{:>18}".format(str(result[column])) for column in columns))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=1)
@@ -0,0 +1,157 @@
+import os
+import random
+import sys
+import threading
+import time
+from typing import Dict, Tuple
+
+import requests
+import requests.api
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import metrics
+
+# 连接池缓存的主机数上限，超过时最久未用的主机连接池被关闭(计数随之清零)
+POOL_HOSTS: int = 32
+
+
+class SessionPool:
+    """
+    akshare的HTTP连接池：akshare内部用requests.get等模块级函数请求，每次新建Session，同一主机的每个请求都重新TCP/TLS握手
+    安装后这些请求改为经由共享的keep-alive连接池发出，每个主机最多保持pool_size个空闲连接，线程安全
+    每个请求仍使用独立的Session(与akshare原有行为一致，不在请求之间共享cookie)，只共享底层连接池
+    复用的连接可能已被服务器关闭，读写失败时自动重连重试一次
+    """
+
+    def __init__(self, pool_size: int = 4):
+        """
+        :param pool_size: 每个主机保持的连接数，建议与并发线程数一致
+        """
+        self.pool_size: int = pool_size
+        self.adapter: HTTPAdapter = self._new_adapter()
+        self.lock: threading.Lock = threading.Lock()
+        # 各主机已导出到指标的(请求数, 新建连接数)，用于按增量累加计数器
+        self.exported: Dict[str, Tuple[int, int]] = {}
+
+        self.original_request = None
+        self.original_retry = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork_in_child)
+
+    def _new_adapter(self) -> HTTPAdapter:
+        """"""
+        return HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=self.pool_size,
+                           max_retries=Retry(total=1, connect=1, read=1, status=0, other=0, redirect=False,
+                                             raise_on_redirect=False))
+
+    def _after_fork_in_child(self):
+        """
+        fork出的子进程不能与父进程共用TCP连接：丢弃继承的连接池(不关闭，套接字仍属于父进程)，计数从零开始
+        """
+        self.adapter = self._new_adapter()
+        self.lock = threading.Lock()
+        self.exported = {}
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        替代requests.api.request，经由共享连接池发出请求
+        """
+        session = requests.Session()
+        session.mount("http://", self.adapter)
+        session.mount("https://", self.adapter)
+        try:
+            return session.request(method=method, url=url, **kwargs)
+        finally:
+            self._export()
+
+    def request_with_retry(self, url: str, params: Dict = None, timeout: int = 15, max_retries: int = 3,
+                           base_delay: float = 1.0, random_delay_range: Tuple[float, float] = (0.5, 1.5)) \
+            -> requests.Response:
+        """
+        替代akshare.utils.request.request_with_retry(东方财富分页接口使用)，重试与退避逻辑不变，只是复用连接
+        """
+        last_exception = None
+        for attempt in range(max_retries):
+            try:
+                response = self.request("get", url, params=params, timeout=timeout)
+                response.raise_for_status()
+                return response
+            except (requests.RequestException, ValueError) as ex:
+                last_exception = ex
+                if attempt < max_retries - 1:
+                    time.sleep(base_delay * (2 ** attempt) + random.uniform(*random_delay_range))
+        raise last_exception
+
+    def install(self):
+        """
+        替换requests.api.request(requests.get/post等均经由它)与已导入的akshare模块中的request_with_retry，重复调用无副作用
+        akshare在安装之后才导入时，需再次调用以替换其中的request_with_retry
+        """
+        if self.original_request is None:
+            self.original_request = requests.api.request
+            requests.api.request = self.request
+        for name, module in list(sys.modules.items()):
+            if not name.startswith("akshare") or module is None:
+                continue
+            func = getattr(module, "request_with_retry", None)
+            if func is None or func == self.request_with_retry:
+                continue
+            if self.original_retry is None:
+                self.original_retry = func
+            module.request_with_retry = self.request_with_retry
+
+    def uninstall(self):
+        """"""
+        if self.original_request is not None:
+            requests.api.request = self.original_request
+            self.original_request = None
+        if self.original_retry is not None:
+            for name, module in list(sys.modules.items()):
+                if name.startswith("akshare") and getattr(module, "request_with_retry", None) == \
+                        self.request_with_retry:
+                    module.request_with_retry = self.original_retry
+            self.original_retry = None
+
+    def _pool_counts(self) -> Dict[str, Tuple[int, int]]:
+        """
+        读取urllib3各主机连接池的累计请求数与新建连接数(含经代理的连接池)
+        """
+        managers = [self.adapter.poolmanager] + list(self.adapter.proxy_manager.values())
+        counts: Dict[str, Tuple[int, int]] = {}
+        for manager in managers:
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                requests_count, connections = counts.get(pool.host, (0, 0))
+                counts[pool.host] = (requests_count + pool.num_requests, connections + pool.num_connections)
+        return counts
+
+    def _export(self):
+        """
+        把各主机新增的请求数与新建连接数累加到指标akshare_http_requests_total/akshare_http_connections_total
+        """
+        with self.lock:
+            for host, (requests_count, connections) in self._pool_counts().items():
+                last_requests, last_connections = self.exported.get(host, (0, 0))
+                if requests_count < last_requests:
+                    # 该主机的连接池被淘汰后重建，计数从零开始
+                    last_requests, last_connections = 0, 0
+                if requests_count > last_requests:
+                    metrics.inc("akshare_http_requests_total", requests_count - last_requests, host=host)
+                if connections > last_connections:
+                    metrics.inc("akshare_http_connections_total", connections - last_connections, host=host)
+                self.exported[host] = (requests_count, connections)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        :return: {主机: {requests: 请求数, connections: 新建连接数, reused: 复用连接的请求数}}
+        """
+        with self.lock:
+            counts = self._pool_counts()
+        return {
+            host: {"requests": requests_count, "connections": connections,
+                   "reused": max(requests_count - connections, 0)}
+            for host, (requests_count, connections) in counts.items()
+        }
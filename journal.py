@@ -0,0 +1,156 @@
+import sqlite3
+import threading
+from datetime import datetime
+from typing import List, Tuple, Dict, Optional, Set
+
+from utils import log
+
+# 单只股票状态
+STATUS_PENDING: str = "pending"
+STATUS_RUNNING: str = "running"
+STATUS_DONE: str = "done"
+STATUS_FAILED: str = "failed"
+STATUS_ABANDONED: str = "abandoned"
+
+
+class SyncJournal:
+    """
+    同步任务断点续传日志(SQLite)
+    每次download_all/update_newest/check_update_all对应一个任务(run)，逐只股票记录状态、查询区间与保存的K线数量
+    任务未完成时重新启动会直接从未完成和失败的股票继续，与执行顺序无关；连续max_attempts次运行均失败的股票放弃并在汇总中列出
+    """
+
+    def __init__(self, path: str = "sync_journal.db", max_attempts: int = 3):
+        """
+        :param path: 日志数据库文件
+        :param max_attempts: 单只股票在同一任务中的最大尝试运行次数(一次运行内的延迟重试只计一次)
+        """
+        self.path: str = path
+        self.max_attempts: int = max_attempts
+        self.lock: threading.Lock = threading.Lock()
+        # 本次运行已累加过尝试次数的(任务ID, 股票代码)
+        self.counted: Set[Tuple[int, str]] = set()
+
+        self.conn: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "run_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "task TEXT NOT NULL, "
+            "started_at TEXT NOT NULL, "
+            "finished_at TEXT)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS symbols ("
+            "run_id INTEGER NOT NULL, "
+            "symbol TEXT NOT NULL, "
+            "seq INTEGER NOT NULL, "
+            "status TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "start TEXT, "
+            "end TEXT, "
+            "bar_count INTEGER NOT NULL DEFAULT 0, "
+            "error TEXT, "
+            "updated_at TEXT, "
+            "PRIMARY KEY (run_id, symbol))"
+        )
+
+    def open_run(self, task: str, symbols: List[str], fresh: bool = False) -> Tuple[int, List[str]]:
+        """
+        打开任务：存在未完成的同名任务时续传，否则新建
+        :param task: 任务名，如"all"、"update:20240102"
+        :param symbols: 本次全部股票代码(按处理顺序)
+        :param fresh: 放弃未完成的同名任务，重新开始
+        :return: (任务ID, 待处理的股票代码)
+        """
+        now = datetime.now().isoformat(timespec="seconds")
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT run_id FROM runs WHERE task=? AND finished_at IS NULL ORDER BY run_id DESC LIMIT 1",
+                (task,)
+            ).fetchone()
+
+            if row is not None and fresh:
+                self.conn.execute("UPDATE runs SET finished_at=? WHERE run_id=?", (now, row[0]))
+                row = None
+
+            if row is None:
+                run_id = self.conn.execute(
+                    "INSERT INTO runs (task, started_at) VALUES (?, ?)", (task, now)
+                ).lastrowid
+                log.info("新建同步任务{}：{}".format(run_id, task))
+            else:
+                run_id = row[0]
+                log.info("续传未完成的同步任务{}：{}".format(run_id, task))
+
+            # 新出现的股票(如新上市)补记为待处理，已有记录保持原状态
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO symbols (run_id, symbol, seq, status) VALUES (?, ?, ?, ?)",
+                [(run_id, symbol, seq, STATUS_PENDING) for seq, symbol in enumerate(symbols)]
+            )
+            self.conn.execute(
+                "UPDATE symbols SET status=? WHERE run_id=? AND status=? AND attempts>=?",
+                (STATUS_ABANDONED, run_id, STATUS_FAILED, self.max_attempts)
+            )
+            self.conn.execute("COMMIT")
+
+            rows = self.conn.execute(
+                "SELECT symbol FROM symbols WHERE run_id=? AND status IN (?, ?, ?) ORDER BY seq",
+                (run_id, STATUS_PENDING, STATUS_RUNNING, STATUS_FAILED)
+            ).fetchall()
+        return run_id, [row[0] for row in rows]
+
+    def mark(self, run_id: int, symbol: str, status: str, start: Optional[datetime] = None,
+             end: Optional[datetime] = None, bar_count: int = 0, error: str = ""):
+        """
+        记录单只股票状态，本次运行中首次开始处理(running)时累加尝试次数，同一运行内的延迟重试不再累加
+        延迟重试也计数时，默认重试次数下一次运行失败即达到max_attempts，重新启动时会被直接放弃而不续传
+        """
+        now = datetime.now().isoformat(timespec="seconds")
+        with self.lock:
+            increment = 0
+            if status == STATUS_RUNNING and (run_id, symbol) not in self.counted:
+                self.counted.add((run_id, symbol))
+                increment = 1
+            self.conn.execute(
+                "UPDATE symbols SET status=?, attempts=attempts+?, start=COALESCE(?, start), end=COALESCE(?, end), "
+                "bar_count=?, error=?, updated_at=? WHERE run_id=? AND symbol=?",
+                (status, increment,
+                 start.strftime("%Y%m%d") if start else None,
+                 end.strftime("%Y%m%d") if end else None,
+                 bar_count, error, now, run_id, symbol)
+            )
+
+    def finish_run(self, run_id: int) -> Dict[str, int]:
+        """
+        所有股票均已完成或放弃时关闭任务，否则保持未完成以便下次续传失败的股票
+        :return: 各状态的股票数量
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM symbols WHERE run_id=? GROUP BY status", (run_id,)
+            ).fetchall()
+            summary = dict(rows)
+            if not summary.get(STATUS_PENDING) and not summary.get(STATUS_RUNNING) and not summary.get(STATUS_FAILED):
+                self.conn.execute(
+                    "UPDATE runs SET finished_at=? WHERE run_id=?",
+                    (datetime.now().isoformat(timespec="seconds"), run_id)
+                )
+        return summary
+
+    def failed_symbols(self, run_id: int) -> List[Tuple[str, str]]:
+        """
+        查询失败和已放弃的股票及最后一次错误信息
+        """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT symbol, error FROM symbols WHERE run_id=? AND status IN (?, ?) ORDER BY seq",
+                (run_id, STATUS_FAILED, STATUS_ABANDONED)
+            ).fetchall()
+
+    def close(self):
+        """"""
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Optional, Dict, List, Tuple
+
+import pandas as pd
+
+from utils import log
+
+try:
+    import pyarrow  # noqa: F401
+    CACHE_FORMAT: str = "parquet"
+except ImportError:
+    # 未安装pyarrow时退化为pickle，缓存读写接口不变
+    CACHE_FORMAT: str = "pkl"
+
+# 缓存中保存的标准化K线列
+KLINE_COLUMNS = ['trade_date', 'open', 'high', 'low', 'close', 'volumn', 'turnover']
+
+DEFAULT_MAX_BYTES: int = 2 * 1024 ** 3
+DEFAULT_MAX_AGE: float = 90 * 24 * 3600.0
+
+
+class KlineCache:
+    """
+    标准化日K线df的本地磁盘缓存
+    以(数据源, 股票代码, 起止日期)的哈希为文件名，按总大小(最久未使用优先)和存放时长淘汰
+    是否可缓存由调用方判断：包含最近交易日的窗口数据仍可能变化，不应写入缓存
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES, max_age: float = DEFAULT_MAX_AGE):
+        """
+        :param path: 缓存目录
+        :param max_bytes: 缓存总大小上限(字节)
+        :param max_age: 缓存文件自最近一次使用起的最长保留时间(秒)
+        """
+        self.path: str = path
+        self.max_bytes: int = max_bytes
+        self.max_age: float = max_age
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.writes: int = 0
+        self.evictions: int = 0
+        self.total_bytes: int = 0
+
+        self.lock: threading.Lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+        self.evict()
+
+    def _file_path(self, source: str, symbol: str, start: str, end: str) -> str:
+        """"""
+        key = "{}|{}|{}|{}".format(source, symbol, start, end)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, digest[:2], "{}.{}".format(digest, CACHE_FORMAT))
+
+    def _read(self, file_path: str) -> Optional[pd.DataFrame]:
+        """"""
+        try:
+            if CACHE_FORMAT == "parquet":
+                df = pd.read_parquet(file_path)
+            else:
+                df = pd.read_pickle(file_path)
+            os.utime(file_path)
+            return df
+        except FileNotFoundError:
+            return None
+        except Exception as ex:
+            log.war("K线缓存读取失败，忽略该缓存：{}".format(repr(ex)))
+            return None
+
+    def contains(self, sources: List[str], symbol: str, start: str, end: str) -> bool:
+        """
+        任一数据源是否已缓存该窗口，只检查文件是否存在，不读取也不计入命中统计
+        """
+        return any(os.path.exists(self._file_path(source, symbol, start, end)) for source in sources)
+
+    def get(self, sources: List[str], symbol: str, start: str, end: str) -> Tuple[Optional[str], Optional[pd.DataFrame]]:
+        """
+        按数据源顺序读取缓存，命中时刷新文件访问时间供淘汰使用，每次调用只计一次命中或未命中
+        :param sources: 可接受的数据源，各源缓存的都是标准化后的df
+        :return: (命中的数据源, 标准化df)，未命中返回(None, None)
+        """
+        for source in sources:
+            df = self._read(self._file_path(source, symbol, start, end))
+            if df is not None:
+                with self.lock:
+                    self.hits += 1
+                return source, df
+
+        with self.lock:
+            self.misses += 1
+        return None, None
+
+    def put(self, source: str, symbol: str, start: str, end: str, df: pd.DataFrame):
+        """
+        写入缓存，先写临时文件再原子替换，多线程/多进程下不会读到半个文件
+        """
+        file_path = self._file_path(source, symbol, start, end)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = "{}.{}.{}.tmp".format(file_path, os.getpid(), threading.get_ident())
+        try:
+            df = df[KLINE_COLUMNS].reset_index(drop=True)
+            if CACHE_FORMAT == "parquet":
+                df.to_parquet(tmp_path)
+            else:
+                df.to_pickle(tmp_path)
+            os.replace(tmp_path, file_path)
+            size = os.path.getsize(file_path)
+        except Exception as ex:
+            log.war("K线缓存写入失败：{}".format(repr(ex)))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self.lock:
+            self.writes += 1
+            self.total_bytes += size
+            over_size = self.total_bytes > self.max_bytes
+        if over_size:
+            self.evict()
+
+    def evict(self):
+        """
+        删除超过保留时长未使用的缓存文件，总大小超限时按最久未使用优先继续删除
+        """
+        now = time.time()
+        entries = []
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                file_path = os.path.join(root, name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file_path))
+
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        evicted = 0
+        for mtime, size, file_path in entries:
+            if now - mtime <= self.max_age and total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+            evicted += 1
+
+        with self.lock:
+            self.total_bytes = total_bytes
+            self.evictions += evicted
+
+    def stats(self) -> Dict[str, int]:
+        """
+        缓存命中统计
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "bytes": self.total_bytes,
+            }
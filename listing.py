@@ -0,0 +1,111 @@
+import json
+import os
+import threading
+import time
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from utils import log
+
+LISTING_DATE_FORMAT: str = "%Y%m%d"
+
+
+class ListingIndex:
+    """
+    个股上市日期索引(JSON文件)
+    由交易所股票列表批量填充，也从首个非空K线窗口学习得到；历史数据查询从上市日期开始，不再从1990年逐窗口空查
+    """
+
+    def __init__(self, path: str, refresh_interval: float = 24 * 3600.0, save_every: int = 100):
+        """
+        :param path: 索引文件
+        :param refresh_interval: 存在未收录股票时，两次批量查询之间的最短间隔(秒)
+        :param save_every: 学习到多少条新日期后写一次文件
+        """
+        self.path: str = path
+        self.refresh_interval: float = refresh_interval
+        self.save_every: int = save_every
+
+        self.dates: Dict[str, str] = {}
+        self.refreshed_at: float = 0.0
+        self.unsaved: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.dates = data["dates"]
+            self.refreshed_at = data["refreshed_at"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as ex:
+            log.war("上市日期索引读取失败，重新建立：{}".format(repr(ex)))
+
+    def get(self, symbol: str) -> Optional[date]:
+        """"""
+        with self.lock:
+            value = self.dates.get(symbol)
+        return datetime.strptime(value, LISTING_DATE_FORMAT).date() if value else None
+
+    def needs_refresh(self, symbols: List[str]) -> bool:
+        """
+        是否需要批量查询：有未收录的股票且距上次批量查询已超过refresh_interval
+        """
+        with self.lock:
+            if time.time() - self.refreshed_at < self.refresh_interval:
+                return False
+            return any(symbol not in self.dates for symbol in symbols)
+
+    def update(self, dates: Dict[str, date]) -> int:
+        """
+        写入批量查询得到的上市日期并保存
+        :return: 新收录的股票数量
+        """
+        with self.lock:
+            added = sum(1 for symbol in dates if symbol not in self.dates)
+            self.dates.update({symbol: day.strftime(LISTING_DATE_FORMAT) for symbol, day in dates.items()})
+            self.refreshed_at = time.time()
+        self.save()
+        return added
+
+    def learn(self, symbol: str, day: date):
+        """
+        记录从K线数据得到的首个交易日，已收录的股票不覆盖
+        """
+        with self.lock:
+            if symbol in self.dates:
+                return
+            self.dates[symbol] = day.strftime(LISTING_DATE_FORMAT)
+            self.unsaved += 1
+            if self.unsaved < self.save_every:
+                return
+        self.save()
+
+    def save(self):
+        """
+        写入文件：先读取文件中其他进程已保存的日期合并(本进程的日期优先)，再写临时文件原子替换
+        多进程同步时父进程与各子进程各自保存，不合并时后写入的进程会覆盖其他进程学习到的日期
+        """
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+            saved_dates, saved_refreshed_at = dict(saved["dates"]), saved["refreshed_at"]
+        except FileNotFoundError:
+            saved_dates, saved_refreshed_at = {}, 0.0
+        except (ValueError, KeyError, TypeError) as ex:
+            log.war("上市日期索引读取失败，覆盖写入：{}".format(repr(ex)))
+            saved_dates, saved_refreshed_at = {}, 0.0
+
+        with self.lock:
+            saved_dates.update(self.dates)
+            self.dates = saved_dates
+            self.refreshed_at = max(self.refreshed_at, saved_refreshed_at)
+            data = {"refreshed_at": self.refreshed_at, "dates": dict(self.dates)}
+            self.unsaved = 0
+        temp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+        except OSError as ex:
+            log.war("上市日期索引写入失败：{}".format(repr(ex)))
@@ -0,0 +1,231 @@
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from utils import log
+
+# 请求/单只股票耗时直方图的桶上限(秒)
+LATENCY_BUCKETS: Tuple[float, ...] = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# 单次请求返回行数直方图的桶上限
+ROW_BUCKETS: Tuple[float, ...] = (0, 10, 100, 250, 500, 1000, 2000, 5000, 10000)
+
+# 耗时分类：网络请求、限流与重试等待、df转换、数据库写入，多线程下为各线程合计秒数
+PHASE_NETWORK: str = "network"
+PHASE_SLEEP: str = "sleep"
+PHASE_CONVERT: str = "convert"
+PHASE_SAVE: str = "save"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    固定桶直方图，counts[i]为落在(buckets[i-1], buckets[i]]的样本数，最后一个为超过最大桶上限的样本数
+    """
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        """"""
+        self.buckets: Tuple[float, ...] = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float):
+        """"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        按桶内线性插值估计分位数，落在最大桶之外时返回最大桶上限
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """
+    进程内指标登记(线程安全)：计数器、瞬时值、直方图和分类耗时
+    运行结束时及运行期间定期导出为Prometheus文本格式或JSON，多进程同步时子进程的快照合并到主进程
+    """
+
+    def __init__(self):
+        """"""
+        self.started_at: float = time.time()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.gauges: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def reset(self):
+        """
+        清空全部指标并重新计时，fork出的子进程开始时调用，避免把继承自主进程的指标再合并回去
+        """
+        with self.lock:
+            self.started_at = time.time()
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        """"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """"""
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels):
+        """"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def phase(self, phase: str) -> Iterator[None]:
+        """
+        统计代码块耗时，累加到sync_phase_seconds_total{phase}
+        """
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc("sync_phase_seconds_total", time.perf_counter() - begin, phase=phase)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        """"""
+        with self.lock:
+            return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    def snapshot(self) -> Dict:
+        """
+        可JSON序列化的全部指标，另附运行秒数与股票处理速度
+        """
+        with self.lock:
+            elapsed = time.time() - self.started_at
+            symbols = sum(value for (name, _), value in self.counters.items() if name == "sync_symbols_total")
+            return {
+                "elapsed_seconds": round(elapsed, 3),
+                "symbols_per_second": round(symbols / elapsed, 3) if elapsed > 0 else 0.0,
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                           for (name, labels), value in sorted(self.gauges.items())],
+                "histograms": [{"name": name, "labels": dict(labels), "buckets": list(histogram.buckets),
+                                "counts": list(histogram.counts), "sum": histogram.sum, "count": histogram.count,
+                                "p50": histogram.quantile(0.5), "p99": histogram.quantile(0.99)}
+                               for (name, labels), histogram in sorted(self.histograms.items())],
+            }
+
+    def merge(self, snapshot: Dict):
+        """
+        合并子进程的指标快照：计数器与直方图累加，瞬时值取快照中的值
+        """
+        with self.lock:
+            for item in snapshot["counters"]:
+                key = (item["name"], tuple(sorted(item["labels"].items())))
+                self.counters[key] = self.counters.get(key, 0.0) + item["value"]
+            for item in snapshot["gauges"]:
+                self.gauges[(item["name"], tuple(sorted(item["labels"].items())))] = item["value"]
+            for item in snapshot["histograms"]:
+                key = (item["name"], tuple(sorted(item["labels"].items())))
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(tuple(item["buckets"]))
+                histogram.counts = [a + b for a, b in zip(histogram.counts, item["counts"])]
+                histogram.sum += item["sum"]
+                histogram.count += item["count"]
+
+    def to_prometheus(self) -> str:
+        """
+        Prometheus文本格式(node_exporter textfile collector可直接读取)
+        """
+        snapshot = self.snapshot()
+        lines: List[str] = [
+            "# TYPE sync_elapsed_seconds gauge",
+            "sync_elapsed_seconds {}".format(snapshot["elapsed_seconds"]),
+            "# TYPE sync_symbols_per_second gauge",
+            "sync_symbols_per_second {}".format(snapshot["symbols_per_second"]),
+        ]
+        typed = set()
+        for kind, items in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+            for item in items:
+                if item["name"] not in typed:
+                    typed.add(item["name"])
+                    lines.append("# TYPE {} {}".format(item["name"], kind))
+                lines.append("{}{} {}".format(item["name"], _format_labels(item["labels"]), item["value"]))
+        for item in snapshot["histograms"]:
+            name = item["name"]
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {} histogram".format(name))
+            cumulative = 0
+            for bound, count in zip(item["buckets"] + ["+Inf"], item["counts"]):
+                cumulative += count
+                labels = dict(item["labels"], le=str(bound))
+                lines.append("{}_bucket{} {}".format(name, _format_labels(labels), cumulative))
+            lines.append("{}_sum{} {}".format(name, _format_labels(item["labels"]), item["sum"]))
+            lines.append("{}_count{} {}".format(name, _format_labels(item["labels"]), item["count"]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """
+        写入指标文件，扩展名为.json时写JSON，否则写Prometheus文本格式；先写临时文件再原子替换
+        """
+        if path.endswith(".json"):
+            content = json.dumps(self.snapshot(), ensure_ascii=False, indent=1)
+        else:
+            content = self.to_prometheus()
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        except OSError as ex:
+            log.war("指标文件写入失败：{}".format(repr(ex)))
+
+    def start_exporter(self, path: str, interval: float) -> threading.Event:
+        """
+        启动后台线程，每隔interval秒写一次指标文件
+        :return: 停止事件，set后线程退出
+        """
+        stop = threading.Event()
+
+        def export():
+            while not stop.wait(interval):
+                self.write(path)
+
+        threading.Thread(target=export, name="metrics-exporter", daemon=True).start()
+        return stop
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    """"""
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                          for key, value in labels.items()) + "}"
+
+
+metrics = Metrics()
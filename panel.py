@@ -0,0 +1,199 @@
+import json
+import os
+from datetime import date
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+
+from utils import log
+
+# 面板字段，与BarFrame.values的列顺序一致
+PANEL_FIELDS: List[str] = ["open", "high", "low", "close", "volume", "turnover"]
+
+# 容量不足时每次至少扩充的交易日行数与股票列数，扩容需复制全部字段文件
+DATE_GROWTH: int = 256
+SYMBOL_GROWTH: int = 256
+
+DateLike = Union[str, date, np.datetime64]
+
+
+def _to_day(value: DateLike) -> np.datetime64:
+    """
+    日期转为numpy日期，字符串可为YYYYMMDD(与TS_DATE_FORMATE一致)或YYYY-MM-DD
+    np.datetime64直接解析"20200101"会当作年份20200101，因此统一经pd.Timestamp转换
+    """
+    return np.datetime64(pd.Timestamp(value).date(), "D")
+
+
+class DailyPanel:
+    """
+    全市场日线面板：每个字段一个.npy文件，形状为(交易日, 股票)，以内存映射方式读写，缺失为NaN
+    日期轴为交易日历，股票轴按首次写入顺序排列，新上市股票追加在末尾
+    单写多读：写入方修改字段文件后原子替换dates.npy与meta.json提交，读取方只看到已提交的日期与股票范围
+    """
+
+    def __init__(self, path: str, readonly: bool = True):
+        """
+        :param path: 面板目录
+        :param readonly: 只读打开(研究/回测加载)，否则为写入方，目录不存在时新建
+        """
+        self.path: str = path
+        self.readonly: bool = readonly
+
+        self.dates: np.ndarray = np.array([], dtype="datetime64[D]")
+        self.symbols: List[str] = []
+        self.symbol_index: Dict[str, int] = {}
+        # 各股票已写入的最新交易日(YYYY-MM-DD，未写入为空)与已读取的数据库K线数，用于增量导出
+        self.last: List[str] = []
+        self.counts: List[int] = []
+        self.arrays: Dict[str, np.ndarray] = {}
+
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            if readonly:
+                raise FileNotFoundError("日线面板不存在：{}".format(path))
+            os.makedirs(path, exist_ok=True)
+            return
+
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dates = np.load(os.path.join(path, "dates.npy"))
+        self.symbols = meta["symbols"]
+        self.symbol_index = {symbol: column for column, symbol in enumerate(self.symbols)}
+        self.last = meta["last"]
+        self.counts = meta["counts"]
+        mmap_mode = "r" if readonly else "r+"
+        self.arrays = {
+            field: np.load(os.path.join(path, field + ".npy"), mmap_mode=mmap_mode)
+            for field in PANEL_FIELDS
+        }
+
+    def _field_path(self, field: str) -> str:
+        """"""
+        return os.path.join(self.path, field + ".npy")
+
+    def _ensure_capacity(self, rows: int, columns: int):
+        """
+        字段文件容量不足时新建更大的文件并复制已有数据，再原子替换
+        已打开旧文件的读取方继续读取旧文件，不受影响
+        """
+        capacity = self.arrays[PANEL_FIELDS[0]].shape if self.arrays else (0, 0)
+        if self.arrays and rows <= capacity[0] and columns <= capacity[1]:
+            return
+        shape = (capacity[0] if self.arrays and rows <= capacity[0] else max(rows, capacity[0] + DATE_GROWTH),
+                 capacity[1] if self.arrays and columns <= capacity[1] else max(columns, capacity[1] + SYMBOL_GROWTH))
+        log.info("日线面板扩容：{}→{}".format(capacity, shape))
+
+        for field in PANEL_FIELDS:
+            temp_path = "{}.{}.tmp".format(self._field_path(field), os.getpid())
+            array = open_memmap(temp_path, mode="w+", dtype=np.float64, shape=shape)
+            array[:] = np.nan
+            old = self.arrays.get(field)
+            if old is not None:
+                array[:old.shape[0], :old.shape[1]] = old
+            array.flush()
+            del array
+            os.replace(temp_path, self._field_path(field))
+            self.arrays[field] = np.load(self._field_path(field), mmap_mode="r+")
+
+    def extend_dates(self, days: np.ndarray) -> int:
+        """
+        把交易日历中晚于面板最后一个交易日的日期追加到日期轴
+        :param days: datetime64[D]升序
+        :return: 追加的交易日数
+        """
+        if self.dates.size:
+            days = days[days > self.dates[-1]]
+        if not days.size:
+            return 0
+        self._ensure_capacity(len(self.dates) + len(days), len(self.symbols))
+        self.dates = np.concatenate([self.dates, days.astype("datetime64[D]")])
+        return len(days)
+
+    def status(self, symbol: str) -> Tuple[Optional[np.datetime64], int]:
+        """
+        :return: (已写入的最新交易日，未写入为None, 已读取的数据库K线数)
+        """
+        column = self.symbol_index.get(symbol)
+        if column is None or not self.last[column]:
+            return None, 0
+        return np.datetime64(self.last[column], "D"), self.counts[column]
+
+    def write(self, symbol: str, days: np.ndarray, values: np.ndarray, reset: bool = False) -> int:
+        """
+        写入一只股票的日线，不在日期轴上的K线忽略
+        :param days: K线交易日，datetime64[D]升序
+        :param values: n×6数组，列顺序同PANEL_FIELDS
+        :param reset: 先清空该股票的全部数据(数据库中旧区间有变化时整只重写)
+        :return: 忽略的K线数量
+        """
+        column = self.symbol_index.get(symbol)
+        if column is None:
+            column = len(self.symbols)
+            self._ensure_capacity(len(self.dates), column + 1)
+            self.symbols.append(symbol)
+            self.symbol_index[symbol] = column
+            self.last.append("")
+            self.counts.append(0)
+
+        rows = np.searchsorted(self.dates, days)
+        valid = rows < len(self.dates)
+        valid[valid] = self.dates[rows[valid]] == days[valid]
+        for index, field in enumerate(PANEL_FIELDS):
+            array = self.arrays[field]
+            if reset:
+                array[:, column] = np.nan
+            array[rows[valid], column] = values[valid, index]
+
+        self.counts[column] = len(days) if reset else self.counts[column] + len(days)
+        if reset or not self.last[column]:
+            self.last[column] = str(days[-1]) if days.size else ""
+        elif days.size:
+            self.last[column] = str(max(days[-1], np.datetime64(self.last[column], "D")))
+        return int((~valid).sum())
+
+    def commit(self):
+        """
+        刷新字段文件，再原子替换日期轴与元数据，提交本次写入
+        """
+        for array in self.arrays.values():
+            array.flush()
+        temp_path = os.path.join(self.path, "dates.{}.tmp.npy".format(os.getpid()))
+        np.save(temp_path, self.dates)
+        os.replace(temp_path, os.path.join(self.path, "dates.npy"))
+        temp_path = os.path.join(self.path, "meta.{}.tmp".format(os.getpid()))
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"symbols": self.symbols, "last": self.last, "counts": self.counts}, f)
+        os.replace(temp_path, os.path.join(self.path, "meta.json"))
+
+    def load(self, start: Optional[DateLike] = None, end: Optional[DateLike] = None,
+             symbols: Optional[List[str]] = None, fields: Optional[List[str]] = None) \
+            -> Tuple[np.ndarray, List[str], Dict[str, np.ndarray]]:
+        """
+        按日期区间和股票子集加载面板
+        日期区间总是内存映射上的视图(零拷贝)；股票子集在面板中连续排列时也是视图，否则按列取出为副本
+        :param start: 起始交易日(含)，默认最早
+        :param end: 结束交易日(含)，默认最新
+        :param symbols: 股票代码列表，默认全部；面板中没有的代码忽略
+        :param fields: 字段列表，默认PANEL_FIELDS
+        :return: (交易日数组, 股票代码列表, {字段: (交易日, 股票)数组})
+        """
+        first = 0 if start is None else int(np.searchsorted(self.dates, _to_day(start)))
+        last = len(self.dates) if end is None else int(np.searchsorted(self.dates, _to_day(end), side="right"))
+
+        if symbols is None:
+            columns = slice(0, len(self.symbols))
+            symbols = list(self.symbols)
+        else:
+            symbols = [symbol for symbol in symbols if symbol in self.symbol_index]
+            indices = np.array([self.symbol_index[symbol] for symbol in symbols], dtype=np.int64)
+            if indices.size and np.array_equal(indices, np.arange(indices[0], indices[0] + indices.size)):
+                columns = slice(int(indices[0]), int(indices[0]) + indices.size)
+            else:
+                columns = indices
+
+        return self.dates[first:last], symbols, {
+            field: self.arrays[field][first:last, columns] for field in (fields or PANEL_FIELDS)
+        }
@@ -0,0 +1,215 @@
+import queue
+import threading
+import time
+from typing import Callable, List, Tuple, Any, Dict, Optional, Iterable
+
+from utils import log
+
+# 队列结束标记
+_STOP = object()
+
+
+class StageStats:
+    """
+    单个流水线阶段的吞吐统计(线程安全)
+    """
+
+    def __init__(self, name: str):
+        """"""
+        self.name: str = name
+        self.items: int = 0
+        self.busy: float = 0.0
+        self.queue_samples: int = 0
+        self.queue_total: int = 0
+        self.queue_max: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def add(self, items: int, busy: float):
+        """"""
+        with self.lock:
+            self.items += items
+            self.busy += busy
+
+    def sample_queue(self, depth: int):
+        """
+        记录该阶段输入队列的深度
+        """
+        with self.lock:
+            self.queue_samples += 1
+            self.queue_total += depth
+            self.queue_max = max(self.queue_max, depth)
+
+    def summary(self, elapsed: float, workers: int) -> str:
+        """"""
+        with self.lock:
+            rate = self.items / elapsed if elapsed > 0 else 0.0
+            utilization = self.busy / (elapsed * workers) if elapsed > 0 else 0.0
+            queue_avg = self.queue_total / self.queue_samples if self.queue_samples else 0.0
+            return "{}：处理{}只，{:.2f}只/秒，忙碌率{:.0%}，输入队列平均{:.1f}/最大{}".format(
+                self.name, self.items, rate, utilization, queue_avg, self.queue_max)
+
+
+class SyncPipeline:
+    """
+    抓取→转换→写入三段流水线
+    多个抓取线程并发请求数据源，单个转换线程把df转换为K线，单个写入线程把多只股票合并为一批写入数据库
+    阶段之间使用有界队列，下游变慢时上游阻塞等待(背压)，内存占用不随股票数量增长
+    各阶段统计吞吐量、忙碌率和队列深度，用于判断瓶颈在网络还是数据库
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[Any], Any],
+        convert: Callable[[Any, Any], Any],
+        write: Callable[[List[Tuple[Any, Any]]], List[Tuple[Any, str]]],
+        fetch_workers: int = 4,
+        queue_size: int = 32,
+        batch_size: int = 50,
+        batch_bars: int = 200000,
+        batch_wait: float = 1.0,
+        idle_wait: float = 0.05,
+    ):
+        """
+        :param fetch: 抓取函数，输入任务，返回原始数据
+        :param convert: 转换函数，输入任务和原始数据，返回待写入数据
+        :param write: 批量写入函数，输入[(任务, 待写入数据)]，返回[(任务, 进度描述)]
+        :param fetch_workers: 抓取线程数
+        :param queue_size: 阶段间队列容量
+        :param batch_size: 每批最多合并的股票数
+        :param batch_bars: 每批最多合并的K线数
+        :param batch_wait: 写入线程等待凑批的最长时间(秒)
+        :param idle_wait: 上游超过该时间(秒)没有新数据时立即写入已凑的批，不等满batch_wait
+        """
+        self.fetch: Callable = fetch
+        self.convert: Callable = convert
+        self.write: Callable = write
+        self.fetch_workers: int = max(fetch_workers, 1)
+        self.batch_size: int = batch_size
+        self.batch_bars: int = batch_bars
+        self.batch_wait: float = batch_wait
+        self.idle_wait: float = idle_wait
+
+        self.task_queue: queue.Queue = queue.Queue()
+        self.convert_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.write_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.done_queue: queue.Queue = queue.Queue()
+
+        self.fetch_stats: StageStats = StageStats("抓取")
+        self.convert_stats: StageStats = StageStats("转换")
+        self.write_stats: StageStats = StageStats("写入")
+        self.batches: int = 0
+        self.elapsed: float = 0.0
+
+    def _fetch_loop(self):
+        """"""
+        while True:
+            task = self.task_queue.get()
+            if task is _STOP:
+                return
+            begin = time.perf_counter()
+            try:
+                raw = self.fetch(task)
+            except Exception as ex:
+                log.error("抓取{}异常：{}".format(task, repr(ex)))
+                raw = None
+            self.fetch_stats.add(1, time.perf_counter() - begin)
+            self.convert_stats.sample_queue(self.convert_queue.qsize())
+            self.convert_queue.put((task, raw))
+
+    def _convert_loop(self):
+        """"""
+        while True:
+            item = self.convert_queue.get()
+            if item is _STOP:
+                self.write_queue.put(_STOP)
+                return
+            task, raw = item
+            begin = time.perf_counter()
+            try:
+                data = self.convert(task, raw)
+            except Exception as ex:
+                log.error("转换{}异常：{}".format(task, repr(ex)))
+                data = None
+            self.convert_stats.add(1, time.perf_counter() - begin)
+            self.write_stats.sample_queue(self.write_queue.qsize())
+            self.write_queue.put((task, data))
+
+    def _flush(self, batch: List[Tuple[Any, Any]]):
+        """"""
+        begin = time.perf_counter()
+        try:
+            results = self.write(batch)
+        except Exception as ex:
+            log.error("批量写入异常：{}".format(repr(ex)))
+            results = [(task, "写入异常") for task, _ in batch]
+        self.write_stats.add(len(batch), time.perf_counter() - begin)
+        self.batches += 1
+        for result in results:
+            self.done_queue.put(result)
+
+    def _write_loop(self):
+        """"""
+        batch: List[Tuple[Any, Any]] = []
+        batch_bars = 0
+        deadline: Optional[float] = None
+        while True:
+            # 已有待写数据时最多等待idle_wait：上游空闲(如增量更新只剩少量股票)时立即写入
+            timeout = None if deadline is None else min(max(deadline - time.monotonic(), 0), self.idle_wait)
+            try:
+                item = self.write_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is not None and item is not _STOP:
+                batch.append(item)
+                batch_bars += len(item[1]) if item[1] else 0
+                if deadline is None:
+                    deadline = time.monotonic() + self.batch_wait
+
+            full = len(batch) >= self.batch_size or batch_bars >= self.batch_bars
+            expired = deadline is not None and time.monotonic() >= deadline
+            if batch and (item is None or item is _STOP or full or expired):
+                self._flush(batch)
+                batch = []
+                batch_bars = 0
+                deadline = None
+
+            if item is _STOP:
+                return
+
+    def run(self, tasks: Iterable[Any]) -> Iterable[Tuple[Any, str]]:
+        """
+        执行流水线，按完成顺序逐个产出(任务, 进度描述)，调用方在当前线程更新进度
+        """
+        tasks = list(tasks)
+        for task in tasks:
+            self.task_queue.put(task)
+        for _ in range(self.fetch_workers):
+            self.task_queue.put(_STOP)
+
+        fetchers = [threading.Thread(target=self._fetch_loop, daemon=True) for _ in range(self.fetch_workers)]
+        converter = threading.Thread(target=self._convert_loop, daemon=True)
+        writer = threading.Thread(target=self._write_loop, daemon=True)
+        for thread in fetchers + [converter, writer]:
+            thread.start()
+
+        begin = time.perf_counter()
+        for _ in range(len(tasks)):
+            yield self.done_queue.get()
+
+        for thread in fetchers:
+            thread.join()
+        self.convert_queue.put(_STOP)
+        converter.join()
+        writer.join()
+        self.elapsed = time.perf_counter() - begin
+
+    def stats(self) -> Dict[str, str]:
+        """
+        各阶段吞吐统计
+        """
+        return {
+            "fetch": self.fetch_stats.summary(self.elapsed, self.fetch_workers),
+            "convert": self.convert_stats.summary(self.elapsed, 1),
+            "write": self.write_stats.summary(self.elapsed, 1) + "，共{}批".format(self.batches),
+        }
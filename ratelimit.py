@@ -0,0 +1,85 @@
+import multiprocessing
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    令牌桶限流器(线程安全)
+    以rate个/秒的速度补充令牌，最多积累capacity个，允许短时突发后回落到稳定速率
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        """
+        :param rate: 每秒补充令牌数，即稳定状态下每秒允许的请求数
+        :param capacity: 桶容量，即允许的最大突发请求数
+        """
+        self.rate: float = rate
+        self.capacity: float = max(capacity, 1.0)
+        self.tokens: float = self.capacity
+        self.updated_at: float = time.monotonic()
+        self.lock: threading.Lock = threading.Lock()
+
+    def _refill(self, now: float):
+        """"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """
+        取出令牌，令牌不足时阻塞等待
+        :param tokens: 需要的令牌数
+        :return: 实际等待的秒数
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class SharedTokenBucket:
+    """
+    跨进程令牌桶限流器
+    令牌数与更新时间存放在共享内存中，由进程锁保护，多进程共享同一数据源的请求额度
+    需在创建子进程时作为参数传入(或随fork继承)，接口与TokenBucket一致
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0, context=None):
+        """
+        :param rate: 每秒补充令牌数，即所有进程合计每秒允许的请求数
+        :param capacity: 桶容量，即所有进程合计允许的最大突发请求数
+        :param context: multiprocessing上下文，默认使用当前默认上下文
+        """
+        context = context or multiprocessing.get_context()
+        self.rate: float = rate
+        self.capacity: float = max(capacity, 1.0)
+        self.tokens = context.Value('d', self.capacity, lock=False)
+        self.updated_at = context.Value('d', time.monotonic(), lock=False)
+        self.lock = context.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """
+        取出令牌，令牌不足时阻塞等待
+        :param tokens: 需要的令牌数
+        :return: 实际等待的秒数
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens.value = min(self.capacity,
+                                        self.tokens.value + (now - self.updated_at.value) * self.rate)
+                self.updated_at.value = now
+                if self.tokens.value >= tokens:
+                    self.tokens.value -= tokens
+                    return waited
+                wait = (tokens - self.tokens.value) / self.rate
+            time.sleep(wait)
+            waited += wait
@@ -0,0 +1,70 @@
+import heapq
+import itertools
+import random
+import time
+from typing import Any, Dict, List, Tuple, Optional
+
+
+class RetryQueue:
+    """
+    延迟重试队列(非线程安全，由调度线程独占使用)
+    失败的任务按指数退避加随机抖动延后到期，到期前调度线程继续处理其他任务，不在失败处原地sleep
+    单个任务超过max_retries次重试仍失败即视为永久失败，由调用方汇总报告
+    """
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 5.0, max_delay: float = 300.0):
+        """
+        :param max_retries: 单个任务最多重试次数(不含首次执行)
+        :param base_delay: 第1次重试的基础延迟(秒)，之后每次翻倍
+        :param max_delay: 单次延迟上限(秒)
+        """
+        self.max_retries: int = max_retries
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+
+        self.heap: List[Tuple[float, int, Any]] = []
+        self.attempts: Dict[Any, int] = {}
+        self.counter = itertools.count()
+        self.retried: int = 0
+
+    def delay(self, attempt: int) -> float:
+        """
+        第attempt次重试的延迟：base_delay * 2^(attempt-1)，上限max_delay，再乘以[0.5, 1.5)的随机抖动
+        抖动使同一时刻失败的大量任务错开重试，避免恢复后集中冲击数据源
+        """
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+        return delay * (0.5 + random.random())
+
+    def push(self, item: Any) -> Optional[float]:
+        """
+        登记一次失败
+        :return: 已安排重试时返回延迟秒数，重试次数用尽返回None
+        """
+        attempt = self.attempts.get(item, 0) + 1
+        if attempt > self.max_retries:
+            return None
+        self.attempts[item] = attempt
+        delay = self.delay(attempt)
+        heapq.heappush(self.heap, (time.monotonic() + delay, next(self.counter), item))
+        return delay
+
+    def pop_ready(self) -> Optional[Any]:
+        """
+        取出一个已到期的任务，没有到期任务时返回None
+        """
+        if self.heap and self.heap[0][0] <= time.monotonic():
+            self.retried += 1
+            return heapq.heappop(self.heap)[2]
+        return None
+
+    def wait_time(self) -> Optional[float]:
+        """
+        距最早到期任务的秒数，队列为空时返回None
+        """
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - time.monotonic(), 0.0)
+
+    def __len__(self) -> int:
+        """"""
+        return len(self.heap)
@@ -0,0 +1,102 @@
+import threading
+from collections import deque
+from typing import List, Dict, Optional, Deque, Tuple
+
+import numpy as np
+
+
+class SourceStats:
+    """
+    单个数据源最近若干次请求的耗时与成败
+    """
+
+    def __init__(self, window: int):
+        """"""
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.results: Deque[bool] = deque(maxlen=window)
+
+    def error_rate(self) -> float:
+        """"""
+        if not self.results:
+            return 0.0
+        return 1.0 - sum(self.results) / len(self.results)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """"""
+        if not self.latencies:
+            return None
+        return float(np.percentile(self.latencies, q))
+
+
+class SourceScheduler:
+    """
+    按滚动统计的耗时与失败率为数据源排序(线程安全)
+    期望代价 = 耗时中位数 / 成功率，样本不足的数据源代价视为0，保持调用方给出的默认优先级
+    对冲请求的等待时限取当前数据源耗时的高分位数，超过时限仍未返回即同时请求下一数据源
+    """
+
+    def __init__(self, window: int = 50, min_samples: int = 5, hedge_percentile: float = 90.0,
+                 hedge_min_delay: float = 0.5):
+        """
+        :param window: 每个数据源保留的最近请求数
+        :param min_samples: 参与排序和计算时限所需的最少成功样本数
+        :param hedge_percentile: 对冲时限使用的耗时分位数
+        :param hedge_min_delay: 对冲时限下限(秒)，避免过早发出多余请求
+        """
+        self.window: int = window
+        self.min_samples: int = min_samples
+        self.hedge_percentile: float = hedge_percentile
+        self.hedge_min_delay: float = hedge_min_delay
+
+        self.stats: Dict[str, SourceStats] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def record(self, source: str, latency: float, ok: bool):
+        """
+        记录一次请求结果，只有成功请求的耗时参与耗时统计
+        """
+        with self.lock:
+            stats = self.stats.setdefault(source, SourceStats(self.window))
+            stats.results.append(ok)
+            if ok:
+                stats.latencies.append(latency)
+
+    def _cost(self, source: str) -> float:
+        """"""
+        stats = self.stats.get(source)
+        if stats is None or len(stats.latencies) < self.min_samples:
+            return 0.0
+        return stats.percentile(50) / max(1.0 - stats.error_rate(), 0.05)
+
+    def order(self, sources: List[Tuple]) -> List[Tuple]:
+        """
+        按期望代价从低到高排序，代价相同时保持原顺序
+        :param sources: 以数据源名称为首元素的元组列表
+        """
+        with self.lock:
+            return sorted(sources, key=lambda item: self._cost(item[0]))
+
+    def hedge_delay(self, source: str) -> Optional[float]:
+        """
+        等待该数据源多久后发出对冲请求，样本不足时返回None(不对冲)
+        """
+        with self.lock:
+            stats = self.stats.get(source)
+            if stats is None or len(stats.latencies) < self.min_samples:
+                return None
+            return max(stats.percentile(self.hedge_percentile), self.hedge_min_delay)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """
+        各数据源当前统计
+        """
+        with self.lock:
+            return {
+                source: {
+                    "requests": len(stats.results),
+                    "error_rate": round(stats.error_rate(), 3),
+                    "p50": round(stats.percentile(50) or 0.0, 3),
+                    "p90": round(stats.percentile(90) or 0.0, 3),
+                }
+                for source, stats in self.stats.items()
+            }
@@ -0,0 +1,56 @@
+import os
+import time
+from datetime import date
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils import log
+
+DEFAULT_TTL: float = 12 * 3600.0
+
+
+class UniverseSnapshot:
+    """
+    股票列表与交易日历的本地快照
+    启动时直接读取快照即可开始同步，无需请求网络；快照超过ttl时由调用方在后台刷新，供下次启动使用
+    交易日历不包含今天(如跨年后)的快照视为不可用，需同步重新查询
+    """
+
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL):
+        """
+        :param path: 快照文件
+        :param ttl: 快照有效期(秒)，超过后仍可使用但需刷新
+        """
+        self.path: str = path
+        self.ttl: float = ttl
+
+    def load(self) -> Optional[Tuple[pd.DataFrame, pd.DataFrame, float]]:
+        """
+        读取快照
+        :return: (股票列表df, 交易日历df, 已保存秒数)，快照不存在、损坏或交易日历已过期时返回None
+        """
+        try:
+            data = pd.read_pickle(self.path)
+        except FileNotFoundError:
+            return None
+        except Exception as ex:
+            log.war("股票列表快照读取失败，重新查询：{}".format(repr(ex)))
+            return None
+
+        list_trade = data["trade_cal"]
+        last_day = pd.to_datetime(list_trade['trade_date']).values.astype('datetime64[D]').max()
+        if last_day < np.datetime64(date.today(), 'D'):
+            log.info("股票列表快照中的交易日历未覆盖今天，重新查询")
+            return None
+        return data["symbols"], list_trade, time.time() - data["saved_at"]
+
+    def save(self, symbols: pd.DataFrame, list_trade: pd.DataFrame):
+        """
+        写入快照，先写临时文件再原子替换，读取方不会读到写了一半的文件
+        :param list_trade: 完整交易日历(含今天及之后的交易日)
+        """
+        temp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        pd.to_pickle({"saved_at": time.time(), "symbols": symbols, "trade_cal": list_trade}, temp_path)
+        os.replace(temp_path, self.path)
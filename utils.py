@@ -1,8 +1,67 @@
+import atexit
 import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from multiprocessing import util
+from typing import Dict, List
+
+# 日志文件超过该大小(字节)时轮转，0为不按大小轮转
+LOG_MAX_BYTES: int = 20 * 1024 ** 2
+# 保留的旧日志文件数(log.txt.1 ~ log.txt.N)
+LOG_BACKUP_COUNT: int = 7
+# 同类高频日志的默认采样间隔(秒)
+SAMPLE_INTERVAL: float = 60.0
+
+
+class RotatingLogHandler(RotatingFileHandler):
+    """
+    按大小或按天轮转的日志文件：超过max_bytes，或跨过本地零点(启动时文件最后写入于之前的日期)时轮转
+    多进程同步时只有主进程轮转，子进程(fork或spawn)只追加写入，避免多个进程同时改名
+    """
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int, daily: bool = True):
+        """"""
+        started = os.path.getmtime(filename) if os.path.exists(filename) else time.time()
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.daily: bool = daily
+        # spawn启动的子进程(Windows)重新导入时新建日志对象，在此关闭轮转
+        self.rotate_enabled: bool = multiprocessing.parent_process() is None
+        self.rollover_at: float = self._next_midnight(started)
+
+    @staticmethod
+    def _next_midnight(timestamp: float) -> float:
+        """"""
+        day = datetime.fromtimestamp(timestamp).date() + timedelta(days=1)
+        return datetime.combine(day, datetime.min.time()).timestamp()
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        """"""
+        if not self.rotate_enabled:
+            return False
+        if self.daily and time.time() >= self.rollover_at and self.stream is not None and self.stream.tell():
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        """"""
+        super().doRollover()
+        self.rollover_at = self._next_midnight(time.time())
 
 
 class logger:
-    def __init__(self, path, clevel=logging.INFO, Flevel=logging.INFO):
+    """
+    异步日志：调用方只把日志记录放入队列立即返回，格式化与控制台/文件写入由后台线程完成，下载循环不因磁盘I/O阻塞
+    日志文件按大小和日期轮转；高频的同类日志用sample按key采样，日志量不随股票数量增长
+    进程退出(含multiprocessing子进程)时写完队列中的日志，之后的日志改为直接写入
+    """
+
+    def __init__(self, path, clevel=logging.INFO, Flevel=logging.INFO,
+                 max_bytes: int = LOG_MAX_BYTES, backup_count: int = LOG_BACKUP_COUNT):
         self.logger = logging.getLogger(path)
         self.logger.setLevel(logging.DEBUG)
         fmt = logging.Formatter('[%(asctime)s] [%(levelname)s] %(message)s', '%Y-%m-%d %H:%M:%S')
@@ -11,11 +70,87 @@ class logger:
         sh.setFormatter(fmt)
         sh.setLevel(clevel)
         # 设置文件日志
-        fh = logging.FileHandler(path, encoding='utf-8')
+        fh = RotatingLogHandler(path, max_bytes, backup_count)
         fh.setFormatter(fmt)
         fh.setLevel(Flevel)
-        self.logger.addHandler(sh)
-        self.logger.addHandler(fh)
+        self.handlers: List[logging.Handler] = [sh, fh]
+
+        self.queue_handler: QueueHandler = QueueHandler(queue.SimpleQueue())
+        self.listener: QueueListener = None
+        self.logger.addHandler(self.queue_handler)
+        self._start_listener()
+        atexit.register(self.stop)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork_in_child)
+        util.register_after_fork(self, logger._after_process_fork)
+
+        # 采样状态：key -> [最近一次输出的时间, 之后被合并的条数]
+        self.samples: Dict[str, List] = {}
+        self.sample_lock: threading.Lock = threading.Lock()
+
+    def _start_listener(self):
+        """"""
+        self.listener = QueueListener(self.queue_handler.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def _after_fork_in_child(self):
+        """
+        fork出的子进程不继承后台线程：换用新队列(父进程队列中尚未写出的日志不重复写)并重新启动写日志线程
+        """
+        if self.listener is None:
+            return
+        for handler in self.handlers:
+            if isinstance(handler, RotatingLogHandler):
+                handler.rotate_enabled = False
+        self.queue_handler.queue = queue.SimpleQueue()
+        self._start_listener()
+
+    def _after_process_fork(self):
+        """
+        multiprocessing子进程启动时清空继承的退出回调后调用，在此登记子进程退出时写完队列
+        """
+        util.Finalize(self, self.stop, exitpriority=0)
+
+    def stop(self):
+        """
+        输出尚未附带的采样合并条数，写完队列中的日志并停止后台线程，之后的日志直接写入控制台和文件
+        """
+        if self.listener is None:
+            return
+        self.flush_samples()
+        self.listener.stop()
+        self.listener = None
+        self.logger.removeHandler(self.queue_handler)
+        for handler in self.handlers:
+            self.logger.addHandler(handler)
+
+    def sample(self, key: str, message: str, level: int = logging.INFO, interval: float = SAMPLE_INTERVAL):
+        """
+        高频同类日志采样：同一key每interval秒最多输出一条，期间的其余日志只计数，合并条数附在该key的下一条输出中
+        :param key: 日志类别，如"日K线来源"
+        :param level: logging日志级别
+        """
+        now = time.monotonic()
+        with self.sample_lock:
+            state = self.samples.get(key)
+            if state is not None and now - state[0] < interval:
+                state[1] += 1
+                return
+            self.samples[key] = [now, 0]
+        if state is not None and state[1]:
+            message = "{}(前{:.0f}秒内另有{}条同类日志已合并)".format(message, now - state[0], state[1])
+        self.logger.log(level, message)
+
+    def flush_samples(self):
+        """
+        输出各类别最近一次输出之后被合并的条数
+        """
+        with self.sample_lock:
+            pending = [(key, state[1]) for key, state in self.samples.items() if state[1]]
+            for key, _ in pending:
+                self.samples[key][1] = 0
+        for key, count in pending:
+            self.logger.info("{}：另有{}条同类日志已合并".format(key, count))
 
     def debug(self, message):
         self.logger.debug(message)
@@ -24,7 +159,7 @@ class logger:
         self.logger.info(message)
 
     def war(self, message):
-        self.logger.warn(message)
+        self.logger.warning(message)
 
     def error(self, message):
         self.logger.error(message)
@@ -0,0 +1,151 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Optional
+
+from utils import log
+
+# 队列中单只股票状态
+QUEUE_PENDING: str = "pending"
+QUEUE_LEASED: str = "leased"
+QUEUE_DONE: str = "done"
+QUEUE_FAILED: str = "failed"
+
+
+class WorkQueue:
+    """
+    多节点共享的股票任务队列(SQLite文件，放在各节点都能访问的共享目录)
+    各节点按需从队列领取(租约)一批股票，处理完成后回写结果，处理快的节点自然多领，无需预先分片
+    租约到期仍未完成(节点宕机或被杀)的股票重新变为可领取，由其他节点接手；领取超过max_attempts次仍未完成则标记失败
+    租约时间使用各节点的本地时钟，多主机部署时需保持时钟同步；共享目录须支持文件锁(如NFS需开启lock)
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 600.0, max_attempts: int = 3,
+                 worker_id: Optional[str] = None):
+        """
+        :param path: 队列数据库文件
+        :param lease_seconds: 租约时长(秒)，处理期间由心跳线程定期续约
+        :param max_attempts: 单只股票最多被领取的次数
+        :param worker_id: 节点标识，默认为主机名:进程号
+        """
+        self.path: str = path
+        self.lease_seconds: float = lease_seconds
+        self.max_attempts: int = max_attempts
+        self.worker_id: str = worker_id or "{}:{}".format(socket.gethostname(), os.getpid())
+        self.lock: threading.Lock = threading.Lock()
+
+        # 多个进程同时写同一文件，等待写锁而不是立即报错
+        self.conn: sqlite3.Connection = sqlite3.connect(path, timeout=60.0, check_same_thread=False,
+                                                        isolation_level=None)
+        # 队列文件放在多主机共享的网络文件系统上：WAL依赖同一主机上的共享内存，跨主机会丢失或重复领取，
+        # 因此使用默认的回滚日志(已是WAL的旧队列文件在此切换回来)，并发控制依赖文件锁
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS queue ("
+            "task TEXT NOT NULL, "
+            "symbol TEXT NOT NULL, "
+            "seq INTEGER NOT NULL, "
+            "status TEXT NOT NULL, "
+            "owner TEXT, "
+            "lease_until REAL NOT NULL DEFAULT 0, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "error TEXT, "
+            "PRIMARY KEY (task, symbol))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS queue_status ON queue (task, status, seq)")
+
+    def populate(self, task: str, symbols: List[str]) -> int:
+        """
+        登记任务的全部股票，已登记的股票保持原状态，各节点重复调用结果一致
+        :return: 新登记的股票数量
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO queue (task, symbol, seq, status) VALUES (?, ?, ?, ?)",
+                [(task, symbol, seq, QUEUE_PENDING) for seq, symbol in enumerate(symbols)]
+            )
+            added = self.conn.total_changes - before
+            self.conn.execute("COMMIT")
+        return added
+
+    def lease(self, task: str, count: int = 1) -> List[str]:
+        """
+        领取最多count只待处理或租约已过期的股票，写锁内完成查询和更新，保证同一股票不会被两个节点同时领取
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute(
+                "UPDATE queue SET status=?, error=? WHERE task=? AND status=? AND lease_until<? AND attempts>=?",
+                (QUEUE_FAILED, "租约过期次数超过上限", task, QUEUE_LEASED, now, self.max_attempts)
+            )
+            rows = self.conn.execute(
+                "SELECT symbol FROM queue WHERE task=? AND "
+                "(status=? OR (status=? AND lease_until<?)) ORDER BY seq LIMIT ?",
+                (task, QUEUE_PENDING, QUEUE_LEASED, now, count)
+            ).fetchall()
+            symbols = [row[0] for row in rows]
+            self.conn.executemany(
+                "UPDATE queue SET status=?, owner=?, lease_until=?, attempts=attempts+1 WHERE task=? AND symbol=?",
+                [(QUEUE_LEASED, self.worker_id, now + self.lease_seconds, task, symbol) for symbol in symbols]
+            )
+            self.conn.execute("COMMIT")
+        return symbols
+
+    def renew(self, task: str) -> int:
+        """
+        为本节点持有的全部租约续期
+        :return: 续期的股票数量
+        """
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE queue SET lease_until=? WHERE task=? AND status=? AND owner=?",
+                (time.time() + self.lease_seconds, task, QUEUE_LEASED, self.worker_id)
+            )
+        return cursor.rowcount
+
+    def complete(self, task: str, symbol: str, error: str = ""):
+        """
+        回写处理结果；租约已被其他节点接手的股票不覆盖对方状态
+        :param error: 错误信息，为空表示成功
+        """
+        with self.lock:
+            self.conn.execute(
+                "UPDATE queue SET status=?, error=?, lease_until=0 WHERE task=? AND symbol=? AND owner=?",
+                (QUEUE_FAILED if error else QUEUE_DONE, error, task, symbol, self.worker_id)
+            )
+
+    def counts(self, task: str) -> Dict[str, int]:
+        """
+        各状态的股票数量
+        """
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT status, COUNT(*) FROM queue WHERE task=? GROUP BY status", (task,)
+            ).fetchall())
+
+    def start_heartbeat(self, task: str) -> threading.Event:
+        """
+        启动后台心跳线程，每隔租约时长的1/3为本节点持有的租约续期
+        :return: 停止事件，set后心跳线程退出
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    self.renew(task)
+                except sqlite3.Error as ex:
+                    log.war("任务队列续约失败：{}".format(repr(ex)))
+
+        threading.Thread(target=beat, name="workqueue-heartbeat", daemon=True).start()
+        return stop
+
+    def close(self):
+        """"""
+        with self.lock:
+            self.conn.close()